@@ -352,8 +352,11 @@ class PlatformBuilder(UefiBuilder, BuildSettingsManager):
 
     def SetPlatformEnvAfterTarget(self):
         logging.debug("PlatformBuilder SetPlatformEnvAfterTarget")
-        if os.name == 'nt':
+        drive_backend = self.env.GetValue("VIRTUAL_DRIVE_BACKEND", "").lower()
+        if drive_backend == "vhd" or (os.name == 'nt' and not drive_backend):
             self.env.SetValue("VIRTUAL_DRIVE_PATH", Path(self.env.GetValue("BUILD_OUTPUT_BASE"), "VirtualDrive.vhd"), "Platform Hardcoded.")
+        elif drive_backend == "dir":
+            self.env.SetValue("VIRTUAL_DRIVE_PATH", Path(self.env.GetValue("BUILD_OUTPUT_BASE"), "VirtualDrive"), "Platform Hardcoded.")
         else:
             self.env.SetValue("VIRTUAL_DRIVE_PATH", Path(self.env.GetValue("BUILD_OUTPUT_BASE"), "VirtualDrive.img"), "Platform Hardcoded.")
 
@@ -370,6 +373,9 @@ class PlatformBuilder(UefiBuilder, BuildSettingsManager):
             Env("STARTUP_NSH", "", "UEFI Shell Startup script to run if specified (Not compatible with `RUN_TESTS==TRUE`)."),
             Env("EMPTY_DRIVE", "FALSE", "Whether to empty the virtual drive used by the shell before running."),
             Env("SHUTDOWN_AFTER_RUN", "FALSE", "Whether or not to shutdown after the startup nsh runs."),
+            Env("VIRTUAL_DRIVE_BACKEND", "", "How the virtual drive is managed: `fat` (in-process), `dir` (host directory), `mtools` (Linux default) or `vhd` (Windows default)."),
+            Env("VIRTUAL_DRIVE_HARDLINK", "FALSE", "Whether the `dir` virtual drive may hardlink files instead of copying them. Firmware writes to those files modify the originals."),
+            Env("TEST_SHARDS", "1", "Number of QEMU instances to split the tests across when `RUN_TESTS==TRUE`."),
         ]
 
     #
@@ -903,6 +909,8 @@ class PlatformBuilder(UefiBuilder, BuildSettingsManager):
         return
 
     def FlashRomImage(self):
+        self.test_results = []
+
         # Values with defaults specified via `SetPlatformDefaultEnv`
         run_tests = (self.env.GetValue("RUN_TESTS", "FALSE").upper() == "TRUE")
         shutdown_after_run = (self.env.GetValue("SHUTDOWN_AFTER_RUN").upper() == "TRUE")
@@ -914,7 +922,8 @@ class PlatformBuilder(UefiBuilder, BuildSettingsManager):
         # Other configurable values
         output_base = self.env.GetValue("BUILD_OUTPUT_BASE")
         drive_path = self.env.GetValue("VIRTUAL_DRIVE_PATH")
-        drive_size = int(self.env.GetValue("VIRTUAL_DRIVE_SIZE", 60))
+        drive_size = self.env.GetValue("VIRTUAL_DRIVE_SIZE", "60")
+        test_shards = int(self.env.GetValue("TEST_SHARDS", "1"))
         run_paging_audit = False
 
         # General debugging information for users
@@ -928,52 +937,74 @@ class PlatformBuilder(UefiBuilder, BuildSettingsManager):
             if not shutdown_after_run:
                 logging.info("SHUTDOWN_AFTER_RUN=FALSE. You will need to close qemu manually to gather test results.")
 
+        # Glob files if requested
+        file_list = []
+        if file_regex:
+            for pattern in file_regex.split(","):
+                file_list.extend(Path(output_base, target_arch).glob(pattern))
+
+        # Size the drive for the files being inserted if requested
+        auto_size = (str(drive_size).upper() == "AUTO")
+        if auto_size:
+            drive_size = self.Helper.required_drive_size(file_list)
+            logging.info(f"VIRTUAL_DRIVE_SIZE=AUTO. Using a {drive_size}MB virtual drive.")
+        else:
+            drive_size = int(drive_size)
+
+        # Get the version number (repo release)
+        outstream = StringIO()
+        version = "Unknown"
+        ret = RunCmd('git', "rev-parse HEAD", outstream=outstream)
+        if ret == 0:
+            commithash = outstream.getvalue().strip()
+            outstream = StringIO()
+            # See git-describe docs for a breakdown of this command output
+            ret = RunCmd("git", f'describe {commithash} --tags', outstream=outstream)
+            if ret == 0:
+                version = outstream.getvalue().strip()
+
+        self.env.SetValue("VERSION", version, "Set Version value")
+
+        if run_tests and test_shards > 1:
+            return self.__RunTestShards(file_list, test_shards, drive_size, shutdown_after_run)
+
         # Get a reference to the virtual drive, creating / wiping as necessary
         # Helper located at QemuPkg/Plugins/VirtualDriveManager
-        virtual_drive = self.Helper.get_virtual_drive(drive_path)
+        virtual_drive = self.Helper.get_virtual_drive(drive_path, self.env.GetValue("VIRTUAL_DRIVE_BACKEND"),
+                                                      self.env.GetValue("VIRTUAL_DRIVE_HARDLINK", "FALSE").upper() == "TRUE")
         if empty_drive:
             virtual_drive.wipe(drive_size)
+        elif auto_size and (virtual_drive.capacity() or drive_size) < drive_size:
+            logging.warning(f"Virtual drive is smaller than the {drive_size}MB required. Recreating it.")
+            virtual_drive.wipe(drive_size)
 
         if not virtual_drive.exists():
             virtual_drive.make_drive(drive_size)
 
-        # Glob files if requested
-        file_list = []
-        if file_regex:
-            for pattern in file_regex.split(","):
-                file_list.extend(Path(output_base, target_arch).glob(pattern))
-
        # If running tests, add the files and auto-generate a startup nsh
         if run_tests:
             if any(DXE_PAGING_AUDIT_BIN_NAME in os.path.basename(test) for test in file_list):
                 run_paging_audit = True
 
-            self.Helper.add_tests(virtual_drive, file_list, auto_run = run_tests, auto_shutdown = shutdown_after_run, paging_audit = run_paging_audit)
+            insert_status = self.Helper.add_tests(virtual_drive, file_list, auto_run = run_tests, auto_shutdown = shutdown_after_run, paging_audit = run_paging_audit, sync = True)
 
         # if a startup nsh was specified, insert files and startup script
         elif startup_nsh:
             lines = Path(startup_nsh).read_text().splitlines()
             virtual_drive.add_startup_script(lines, auto_shutdown=shutdown_after_run)
-            [virtual_drive.add_file(file) for file in file_list]
+            insert_status = self.Helper.sync_files(virtual_drive, file_list)
 
         # Otherwise just add the files and add an empty startup script (possibly shutdown after run)
         else:
             virtual_drive.add_startup_script([], auto_shutdown=shutdown_after_run)
-            [virtual_drive.add_file(file) for file in file_list]
+            insert_status = self.Helper.sync_files(virtual_drive, file_list)
 
-        # Get the version number (repo release)
-        outstream = StringIO()
-        version = "Unknown"
-        ret = RunCmd('git', "rev-parse HEAD", outstream=outstream)
-        if ret == 0:
-            commithash = outstream.getvalue().strip()
-            outstream = StringIO()
-            # See git-describe docs for a breakdown of this command output
-            ret = RunCmd("git", f'describe {commithash} --tags', outstream=outstream)
-            if ret == 0:
-                version = outstream.getvalue().strip()
-
-        self.env.SetValue("VERSION", version, "Set Version value")
+        failed_files = [file.name for file, inserted in insert_status.items() if not inserted]
+        if failed_files:
+            logging.error(f"Failed to insert {len(failed_files)} file(s) into the virtual drive: {', '.join(failed_files)}")
+            # Tests that failed to insert are reported as failures when results are gathered
+            if not run_tests:
+                return -1
 
         # Run Qemu
         # Helper located at Platforms/QemuQ35Pkg/Plugins/QemuRunner
@@ -985,21 +1016,54 @@ class PlatformBuilder(UefiBuilder, BuildSettingsManager):
         if not run_tests:
             return 0
 
+        return self.__ReportTestResults([(virtual_drive, file_list)], run_paging_audit)
+
+    def __RunTestShards(self, file_list, shard_count, drive_size, shutdown_after_run):
+        """Runs the tests split across concurrent QEMU instances and reports the merged results."""
+        run_paging_audit = any(DXE_PAGING_AUDIT_BIN_NAME in os.path.basename(test) for test in file_list)
+        var_store = Path(self.env.GetValue("BUILD_OUTPUT_BASE"), "FV", "SECURE_FLASH0.fd")
+
+        # Helper located at QemuPkg/Plugins/VirtualDriveManager
+        shards = self.Helper.run_test_shards(self.env, self.Helper.QemuRun, file_list, shard_count, var_store, drive_size,
+                                             auto_shutdown = shutdown_after_run, paging_audit = run_paging_audit)
+        failed_shards = [shard for shard in shards if shard.returncode != 0]
+        for shard in failed_shards:
+            logging.critical(f"Failed running Qemu for test shard {shard.index}")
+        if failed_shards:
+            return failed_shards[0].returncode
+
+        return self.__ReportTestResults([(shard.drive, shard.tests) for shard in shards], run_paging_audit)
+
+    def __ReportTestResults(self, test_drives, run_paging_audit):
+        """Gathers the results of the tests run from each (virtual drive, tests) pair and returns the failure count."""
+        result_output_dir = Path(self.env.GetValue("VIRTUAL_DRIVE_PATH")).parent / "unit_test_results"
+        file_list = [test for _, tests in test_drives for test in tests]
+
         # Gather test results if they were run.
         now = datetime.datetime.now()
         FET = FAILURE_EXEMPT_TESTS
         FEOL = FAILURE_EXEMPT_OMISSION_LENGTH
 
         if run_paging_audit:
-            self.Helper.generate_paging_audit (virtual_drive, Path(drive_path).parent / "unit_test_results", self.env.GetValue("VERSION"), "ArmVirt")
+            audit_drive = next(drive for drive, tests in test_drives if any(DXE_PAGING_AUDIT_BIN_NAME in test.name for test in tests))
+            self.Helper.generate_paging_audit (audit_drive, result_output_dir, self.env.GetValue("VERSION"), "ArmVirt")
 
         # Filter out tests that are exempt
-        tests = list(filter(lambda file: file.name not in FET or not (now - FET.get(file.name)).total_seconds() < FEOL, file_list))
         tests_exempt = list(filter(lambda file: file.name in FET and (now - FET.get(file.name)).total_seconds() < FEOL, file_list))
-        if len(tests_exempt) > 0:
-            self.Helper.report_results(virtual_drive, tests_exempt, Path(drive_path).parent / "unit_test_results")
+
+        # Extract and parse all results once. The per test, suite and case results, including durations, remain
+        # available to callers through `self.test_results`. The durations are recorded to balance test shards.
         # Helper located at QemuPkg/Plugins/VirtualDriveManager
-        return self.Helper.report_results(virtual_drive, tests, Path(drive_path).parent / "unit_test_results")
+        self.test_results = []
+        for drive, tests in test_drives:
+            self.test_results.extend(self.Helper.collect_results(drive, tests, result_output_dir))
+        self.Helper.record_test_durations(self.test_results, result_output_dir)
+
+        exempt_names = {test.name for test in tests_exempt}
+        self.Helper.write_results(self.test_results, result_output_dir, exempt_names)
+        if len(tests_exempt) > 0:
+            self.Helper.log_results([result for result in self.test_results if result.test in exempt_names])
+        return self.Helper.log_results([result for result in self.test_results if result.test not in exempt_names])
 
 if __name__ == "__main__":
     import argparse
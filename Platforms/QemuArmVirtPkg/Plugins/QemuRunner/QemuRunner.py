@@ -7,14 +7,9 @@
 ##
 
 import logging
-import io
 import os
-import re
-import datetime
-import threading
 from pathlib import Path
 from edk2toolext.environment.plugintypes import uefi_helper_plugin
-from edk2toollib import utility_functions
 
 class QemuRunner(uefi_helper_plugin.IUefiHelperPlugin):
 
@@ -29,37 +24,22 @@ class QemuRunner(uefi_helper_plugin.IUefiHelperPlugin):
     @staticmethod
     # raw helper function to extract version number from QEMU
     def QueryQemuVersion(exec):
-        if exec is None:
+        # Module located at QemuPkg/Plugins/QemuRunnerLib
+        from QemuCapabilities import QemuCapabilities
+        capabilities = QemuCapabilities.probe(exec)
+        if capabilities is None:
             return None
-
-        result = io.StringIO()
-        ret = utility_functions.RunCmd(exec, "--version", outstream=result)
-        if ret != 0:
-            return None
-
-        # expected version string will be "QEMU emulator version maj.min.rev"
-        res = result.getvalue()
-        ver_str = re.search(r'version\s*([\d.]+)', res).group(1)
-
-        return ver_str.split('.')
-
-
-    @staticmethod
-    def RunSwTpmThread(tpm_dir, tpm_sock):
-        """Runs SWTPM in a separate thread"""
-        tpm_cmd = "swtpm"
-        tpm_args = f"socket --tpmstate dir={tpm_dir} --ctrl type=unixio,path={tpm_sock} --tpm2 --log level=1"
-
-        # Start the TPM emulator in a separate thread
-        ret = utility_functions.RunCmd(tpm_cmd, tpm_args)
-        if ret != 0:
-            logging.critical("Failed to start SWTPM emulator.")
-            return
+        return capabilities.version
 
 
     @staticmethod
     def Runner(env):
         ''' Runs QEMU '''
+        # Modules located at QemuPkg/Plugins/QemuRunnerLib
+        from QemuCommand import QemuConfig, run_qemu
+        from QemuRunnerLib import QemuRunnerLib
+        from RunProfile import ARM_VIRT_PROFILES, DEFAULT_PROFILE
+
         VirtualDrive = env.GetValue("VIRTUAL_DRIVE_PATH")
         OutputPath_FV = os.path.join(env.GetValue("BUILD_OUTPUT_BASE"), "FV")
         repo_version = env.GetValue("VERSION", "Unknown")
@@ -69,22 +49,51 @@ class QemuRunner(uefi_helper_plugin.IUefiHelperPlugin):
         if not executable:
             executable = str(Path(env.GetValue("QEMU_DIR", ''),"qemu-system-aarch64"))
 
-        qemu_version = QemuRunner.QueryQemuVersion(executable)
+        # First query the version and capabilities, which are cached per QEMU binary
+        capabilities = QemuRunnerLib.get_qemu_capabilities(env, executable)
+        if capabilities is None:
+            logging.critical(f"Failed to query the QEMU version from {executable}.")
+            return -1
+        qemu_version = capabilities.version
+
+        # QEMU_PROFILE selects the CPU features, optional devices, core count and TCG settings of the machine
+        profile_name = env.GetValue("QEMU_PROFILE", DEFAULT_PROFILE).lower()
+        profile = ARM_VIRT_PROFILES.get(profile_name)
+        if profile is None:
+            logging.critical(f"Unknown QEMU_PROFILE {profile_name}. Use one of: {', '.join(ARM_VIRT_PROFILES)}.")
+            return -1
+        logging.info(f"QEMU profile {profile.name}: {profile.description}.")
+
+        # Write the console output to QEMU_CONSOLE_LOG, and watch it to end QEMU early if the firmware fails or hangs
+        sink = QemuRunnerLib.create_output_sink(env)
+        monitor = QemuRunnerLib.create_console_monitor(env)
+        watchdog = QemuRunnerLib.create_watchdog(env)
+        profiler = QemuRunnerLib.create_boot_profiler(env)
+
+        config = QemuConfig(executable)
 
         # turn off network
-        args = "-net none"
+        config.add("net", "none")
 
         # If we are using the QEMU external dependency, we need to tell it
         # where to look for roms
         if not env.GetValue("QEMU_PATH") and env.GetValue("QEMU_DIR"):
-            args += f" -L {str(Path(env.GetValue('QEMU_DIR'), 'share'))}"
+            config.add("L", str(Path(env.GetValue('QEMU_DIR'), 'share')))
+
+        code_fd = os.path.join(OutputPath_FV, "QEMU_EFI.fd")
+        var_store = env.GetValue("VAR_STORE_PATH", os.path.join(OutputPath_FV, "SECURE_FLASH0.fd"))
+
+        # Boot from a VM snapshot at the UEFI shell, which is saved in a qcow2 image of the variable store
+        snapshot = QemuRunnerLib.create_snapshot(env, executable, [code_fd], var_store, VirtualDrive)
 
         # Mount disk with either startup.nsh or OS image
+        # A snapshot attaches the disk with startup.nsh once the UEFI shell is running
         path_to_os = env.GetValue("PATH_TO_OS")
         if path_to_os is not None:
-            args += " -m 8192"
+            config.memory = 8192
 
-            file_extension = Path(path_to_os).suffix.lower().replace('"', '')
+            path_to_os = path_to_os.strip('"')
+            file_extension = Path(path_to_os).suffix.lower()
 
             storage_format = {
                 ".vhd": "raw",
@@ -96,114 +105,80 @@ class QemuRunner(uefi_helper_plugin.IUefiHelperPlugin):
                 raise Exception(f"Unknown OS storage type: {path_to_os}")
 
             if storage_format == "iso":
-                args += f" -cdrom \"{path_to_os}\""
+                config.add("cdrom", path_to_os)
             else:
-                args += f" -drive file=\"{path_to_os}\",format={storage_format},if=none,id=os_disk"
-                args += " -device ahci,id=ahci"
-                args += " -device ide-hd,drive=os_disk,bus=ahci.0"
+                config.add_drive(file=path_to_os, format=storage_format, interface="none", id="os_disk")
+                config.add_device("ahci", id="ahci")
+                config.add_device("ide-hd", drive="os_disk", bus="ahci.0")
         else:
-            args += " -m 2048"
-            if os.path.isfile(VirtualDrive):
-                args += f" -drive file={VirtualDrive},if=virtio"
-            elif os.path.isdir(VirtualDrive):
-                args += f" -drive file=fat:rw:{VirtualDrive},format=raw,media=disk"
-            else:
-                logging.critical("Virtual Drive Path Invalid")
+            config.memory = 2048
+            if snapshot is None:
+                if os.path.isfile(VirtualDrive):
+                    config.add_drive(file=VirtualDrive, interface="virtio")
+                elif os.path.isdir(VirtualDrive):
+                    config.add_drive(file=f"fat:rw:{VirtualDrive}", format="raw", media="disk")
+                else:
+                    logging.critical("Virtual Drive Path Invalid")
+
+        config.machine = "virt"
+        profile.apply(config, qemu_version)
+        config.add_global("cfi.pflash01", "secure", "on")
+        if snapshot is not None:
+            config.add_drive(interface="pflash", format="qcow2", unit=0, file=snapshot.image)
+        else:
+            config.add_drive(interface="pflash", format="raw", unit=0, file=var_store)
 
-        args += " -machine virt,secure=on,virtualization=on,gic-version=3,mte=on,iommu=smmuv3" #,accel=(tcg|kvm)"
-        args += " -cpu max,sve=off,sme=off"
-        # Hardcoded to 4 cores for now
-        args += " -smp 4"
-        args += " -global driver=cfi.pflash01,property=secure,value=on"
-        args += " -drive if=pflash,format=raw,unit=0,file=" + \
-            os.path.join(OutputPath_FV, "SECURE_FLASH0.fd")
+        config.add_drive(interface="pflash", format="raw", unit=1, file=code_fd, readonly="on")
 
-        code_fd = os.path.join(OutputPath_FV, "QEMU_EFI.fd")
-        args += " -drive if=pflash,format=raw,unit=1,file=" + \
-                code_fd + ",readonly=on"
-
-        sw_tpm_thread = None
-        sw_tpm_enable = env.GetValue("SWTPM_ENABLE", "TRUE")
-        if os.name == 'nt':
-            sw_tpm_enable = "FALSE"
-        if str(sw_tpm_enable).upper() == "TRUE":
-            tpm_dir = env.GetValue("BUILD_OUTPUT_BASE")
-            tpm_sock = os.path.join(tpm_dir, "swtpm-sock")
-            args += f" -chardev socket,id=chrtpm,path={tpm_sock}"
-            args += " -tpmdev emulator,id=tpm0,chardev=chrtpm"
-            args += " -device tpm-tis-device,tpmdev=tpm0"
-
-            logging.info("Starting TPM emulator in a different thread.")
-            sw_tpm_thread = threading.Thread(target=QemuRunner.RunSwTpmThread, args=(tpm_dir, tpm_sock))
-            sw_tpm_thread.start()
+        # Each run gets its own TPM emulator, with a temporary TPM state unless SWTPM_STATE_DIR is set
+        swtpm = QemuRunnerLib.create_swtpm(env, "tpm-tis-device", [code_fd])
+        if swtpm is not None:
+            swtpm.configure(config)
 
         # Add XHCI USB controller and mouse
-        args += " -device qemu-xhci,id=usb"
-        args += " -device usb-tablet,id=input0,bus=usb.0,port=1"  # add a usb mouse
-        args += " -device usb-kbd,id=input1,bus=usb.0,port=2"     # add a usb keyboard
-
-        creation_time = Path(code_fd).stat().st_ctime
-        creation_datetime = datetime.datetime.fromtimestamp(creation_time)
-        creation_date = creation_datetime.strftime("%m/%d/%Y")
+        config.add_device("qemu-xhci", id="usb")
+        config.add_device("usb-tablet", id="input0", bus="usb.0", port=1)  # add a usb mouse
+        config.add_device("usb-kbd", id="input1", bus="usb.0", port=2)     # add a usb keyboard
 
-        args += f" -smbios type=0,vendor=\"Project Mu\",version=\"mu_tiano_platforms-{repo_version}\",date={creation_date},uefi=on"
-        args += f" -smbios type=1,manufacturer=Palindrome,product=\"QEMU ArmVirt\",family=QEMU,version=\"{'.'.join(qemu_version)}\",serial=42-42-42-42"
-        args += f" -smbios type=3,manufacturer=Palindrome,serial=42-42-42-42,asset=ArmVirt,sku=ArmVirt"
+        config.add_firmware_smbios(repo_version, code_fd)
+        config.add_smbios(1, manufacturer="Palindrome", product="QEMU ArmVirt", family="QEMU",
+                          version='.'.join(qemu_version), serial="42-42-42-42")
+        config.add_smbios(3, manufacturer="Palindrome", serial="42-42-42-42", asset="ArmVirt", sku="ArmVirt")
 
         if (env.GetValue("QEMU_HEADLESS").upper() == "TRUE"):
-            args += " -display none"  # no graphics
+            config.add("display", "none")  # no graphics
         else:
-            args += " -device bochs-display,addr=0x1f"
+            config.add_device("bochs-display", addr="0x1f")
 
         # Check for gdb server setting
         gdb_port = env.GetValue("GDB_SERVER")
         if (gdb_port != None):
             logging.log(logging.INFO, "Enabling GDB server at port tcp::" + gdb_port + ".")
-            args += " -gdb tcp::" + gdb_port
+            config.add("gdb", "tcp::" + gdb_port)
 
         # write ConOut messages to telnet localhost port
         serial_port = env.GetValue("SERIAL_PORT")
         if serial_port != None:
-            args += " -serial tcp:127.0.0.1:" + serial_port + ",server,nowait"
+            config.add("serial", "tcp:127.0.0.1:" + serial_port, server=None, nowait=None)
         else:
             # write messages to stdio
-            args += " -serial stdio"
+            config.add("serial", "stdio")
 
         # Connect the debug monitor to a telnet localhost port
         monitor_port = env.GetValue("MONITOR_PORT")
         if monitor_port is not None:
-            args += " -monitor tcp:127.0.0.1:" + monitor_port + ",server,nowait"
-
-        ## TODO: Save the console mode. The original issue comes from: https://gitlab.com/qemu-project/qemu/-/issues/1674
-        if os.name == 'nt' and qemu_version[0] >= '8':
-            import win32console
-            std_handle = win32console.GetStdHandle(win32console.STD_INPUT_HANDLE)
-            try:
-                console_mode = std_handle.GetConsoleMode()
-            except Exception:
-                std_handle = None
-
-        # Run QEMU
-        ret = utility_functions.RunCmd(executable, args)
-
-        ## TODO: restore the customized RunCmd once unit tests with asserts are figured out
-        if ret == 0xc0000005:
-            ret = 0
-
-        ## TODO: remove this once we upgrade to newer QEMU
-        if ret == 0x8B and qemu_version[0] == '4':
-            # QEMU v4 will return segmentation fault when shutting down.
-            # Tested same FDs on QEMU 6 and 7, not observing the same.
-            ret = 0
-
-        if os.name == 'nt' and qemu_version[0] >= '8' and std_handle is not None:
-            # Restore the console mode for Windows on QEMU v8+.
-            std_handle.SetConsoleMode(console_mode)
-        elif os.name != 'nt':
-            # Linux version of QEMU will mess with the print if its run failed, let's just restore it anyway
-            utility_functions.RunCmd('stty', 'sane', capture=False)
-
-        if sw_tpm_thread is not None:
-            sw_tpm_thread.join()
+            config.add("monitor", "tcp:127.0.0.1:" + monitor_port, server=None, nowait=None)
+
+        # Run QEMU once the TPM emulator is ready, and stop the emulator once QEMU exits
+        ret = None
+        try:
+            if swtpm is not None:
+                swtpm.start()
+            ret = run_qemu(config, qemu_version, sink=sink, monitor=monitor, watchdog=watchdog, snapshot=snapshot,
+                           profiler=profiler)
+        finally:
+            if swtpm is not None:
+                swtpm.stop(capture=ret == 0)
+        QemuRunnerLib.write_boot_profile(env, profiler, config, qemu_version, snapshot)
 
         return ret
@@ -8,14 +8,9 @@
 
 import logging
 import os
-import datetime
-import re
-import io
 import shutil
 from pathlib import Path
-import threading
 from edk2toolext.environment.plugintypes import uefi_helper_plugin
-from edk2toollib import utility_functions
 
 class QemuRunner(uefi_helper_plugin.IUefiHelperPlugin):
 
@@ -30,38 +25,22 @@ class QemuRunner(uefi_helper_plugin.IUefiHelperPlugin):
     @staticmethod
     # raw helper function to extract version number from QEMU
     def QueryQemuVersion(exec):
-        if exec is None:
+        # Module located at QemuPkg/Plugins/QemuRunnerLib
+        from QemuCapabilities import QemuCapabilities
+        capabilities = QemuCapabilities.probe(exec)
+        if capabilities is None:
             return None
-
-        result = io.StringIO()
-        ret = utility_functions.RunCmd(exec, "--version", outstream=result)
-        if ret != 0:
-            logging.error(result.getvalue())
-            logging.error(ret)
-            return None
-
-        # expected version string will be "QEMU emulator version maj.min.rev"
-        res = result.getvalue()
-        ver_str = re.search(r'version\s*([\d.]+)', res).group(1)
-
-        return ver_str.split('.')
+        return capabilities.version
 
 
-    @staticmethod
-    def RunSwTpmThread(tpm_dir, tpm_sock):
-        """Runs SWTPM in a separate thread"""
-        tpm_cmd = "swtpm"
-        tpm_args = f"socket --tpmstate dir={tpm_dir} --ctrl type=unixio,path={tpm_sock} --tpm2 --log level=1"
-
-        # Start the TPM emulator in a separate thread
-        ret = utility_functions.RunCmd(tpm_cmd, tpm_args)
-        if ret != 0:
-            logging.critical("Failed to start SWTPM emulator.")
-            return
-
     @staticmethod
     def Runner(env):
         ''' Runs QEMU '''
+        # Modules located at QemuPkg/Plugins/QemuRunnerLib
+        from Accelerator import select_accelerator, validate_cpu
+        from QemuCommand import QemuConfig, run_qemu
+        from QemuRunnerLib import QemuRunnerLib
+
         VirtualDrive = env.GetValue("VIRTUAL_DRIVE_PATH")
         OutputPath_FV = os.path.join(env.GetValue("BUILD_OUTPUT_BASE"), "FV")
         repo_version = env.GetValue("VERSION", "Unknown")
@@ -71,40 +50,50 @@ class QemuRunner(uefi_helper_plugin.IUefiHelperPlugin):
         if not executable:
             executable = str(Path(env.GetValue("QEMU_DIR", ''), "qemu-system-x86_64"))
 
-        # First query the version
-        qemu_version = QemuRunner.QueryQemuVersion(executable)
+        # First query the version and capabilities, which are cached per QEMU binary
+        capabilities = QemuRunnerLib.get_qemu_capabilities(env, executable)
+        if capabilities is None:
+            logging.critical(f"Failed to query the QEMU version from {executable}.")
+            return -1
+        qemu_version = capabilities.version
+
+        # Write the console output to QEMU_CONSOLE_LOG, and watch it to end QEMU early if the firmware fails or hangs
+        sink = QemuRunnerLib.create_output_sink(env)
+        monitor = QemuRunnerLib.create_console_monitor(env)
+        watchdog = QemuRunnerLib.create_watchdog(env)
+        profiler = QemuRunnerLib.create_boot_profiler(env)
+
+        config = QemuConfig(executable)
 
         # write messages to stdio
-        args = "-debugcon stdio"
+        config.add("debugcon", "stdio")
 
         # If we are using the QEMU external dependency, we need to tell it
         # where to look for roms
         if not env.GetValue("QEMU_PATH") and env.GetValue("QEMU_DIR"):
-            args += f" -L {str(Path(env.GetValue('QEMU_DIR'), 'share'))}"
+            config.add("L", str(Path(env.GetValue('QEMU_DIR'), 'share')))
 
         # debug messages out thru virtual io port
-        args += " -global isa-debugcon.iobase=0x402"
+        config.add_global("isa-debugcon", "iobase", "0x402")
         # Turn off S3 support
-        args += " -global ICH9-LPC.disable_s3=1"
+        config.add_global("ICH9-LPC", "disable_s3", 1)
         # Increase TSEG to 32 Mb
-        args += " -global mch.extended-tseg-mbytes=32"
-
-        accel = ""
-        if env.GetValue("QEMU_ACCEL") is not None:
-            if env.GetValue("QEMU_ACCEL").lower() == "kvm":
-                accel = ",accel=kvm"
-            elif env.GetValue("QEMU_ACCEL").lower() == "tcg":
-                accel = ",accel=tcg"
-            elif env.GetValue("QEMU_ACCEL").lower() == "whpx":
-                accel = ",accel=whpx"
-
-        args += " -machine q35,smm=on" + accel
+        config.add_global("mch", "extended-tseg-mbytes", 32)
+
+        config.machine = "q35"
+        config.machine_options["smm"] = "on"
+        # QEMU_ACCEL=auto uses KVM when the host and QEMU support it, and TCG otherwise
+        accel = select_accelerator(env.GetValue("QEMU_ACCEL"), capabilities)
+        if accel is not None:
+            config.machine_options["accel"] = accel
+
         path_to_os = env.GetValue("PATH_TO_OS")
         if path_to_os is not None:
             # Potentially dealing with big daddy, give it more juice...
-            args += " -m 8192"
+            config.memory = 8192
 
-            file_extension = Path(path_to_os).suffix.lower().replace('"', '')
+            path_to_os = path_to_os.strip('"')
+            file_extension = Path(path_to_os).suffix.lower()
 
             storage_format = {
                 ".vhd": "raw",
@@ -116,12 +105,12 @@ class QemuRunner(uefi_helper_plugin.IUefiHelperPlugin):
                 raise Exception(f"Unknown OS storage type: {path_to_os}")
 
             if storage_format == "iso":
-                args += f" -cdrom \"{path_to_os}\""
+                config.add("cdrom", path_to_os)
             else:
-                args += f" -drive file=\"{path_to_os}\",format={storage_format},if=none,id=os_nvme"
-                args += " -device nvme,serial=nvme-1,drive=os_nvme"
+                config.add_drive(file=path_to_os, format=storage_format, interface="none", id="os_nvme")
+                config.add_device("nvme", serial="nvme-1", drive="os_nvme")
         else:
-            args += " -m 2048"
+            config.memory = 2048
 
         cpu_model = env.GetValue("CPU_MODEL")
         if cpu_model is None:
@@ -129,17 +118,19 @@ class QemuRunner(uefi_helper_plugin.IUefiHelperPlugin):
 
         logging.log(logging.INFO, "CPU model: " + cpu_model)
 
-        #args += " -cpu qemu64,+rdrand,umip,+smep,+popcnt" # most compatible x64 CPU model + RDRAND + UMIP + SMEP +POPCNT support (not included by default)
-        cpu_arg = " -cpu " + cpu_model + ",rdrand=on,umip=on,smep=on,pdpe1gb=on,popcnt=on,+sse,+sse2,+sse3,+ssse3,+sse4.2,+sse4.1"
-        args += cpu_arg
+        #config.cpu_options = {"+rdrand": None, "umip": None, "+smep": None, "+popcnt": None} # qemu64 is the most compatible x64 CPU model
+        # RDRAND + UMIP + SMEP + PDPE1GB + POPCNT + SSE support (not included by default)
+        config.cpu = cpu_model
+        config.cpu_options = {"rdrand": "on", "umip": "on", "smep": "on", "pdpe1gb": "on", "popcnt": "on",
+                              "+sse": None, "+sse2": None, "+sse3": None, "+ssse3": None, "+sse4.2": None, "+sse4.1": None}
+        validate_cpu(config, accel, capabilities)
 
         if env.GetBuildValue ("QEMU_CORE_NUM") is not None:
-            args += " -smp " + env.GetBuildValue ("QEMU_CORE_NUM")
-        args += " -global driver=cfi.pflash01,property=secure,value=on"
+            config.smp = int(env.GetBuildValue ("QEMU_CORE_NUM"))
+        config.add_global("cfi.pflash01", "secure", "on")
 
         code_fd = os.path.join(OutputPath_FV, "QEMUQ35_CODE.fd")
-        args += " -drive if=pflash,format=raw,unit=0,file=" + \
-                code_fd + ",readonly=on"
+        config.add_drive(interface="pflash", format="raw", unit=0, file=code_fd, readonly="on")
 
         orig_var_store = os.path.join(OutputPath_FV, "QEMUQ35_VARS.fd")
         dfci_var_store =env.GetValue("DFCI_VAR_STORE")
@@ -148,141 +139,112 @@ class QemuRunner(uefi_helper_plugin.IUefiHelperPlugin):
                 shutil.copy(orig_var_store, dfci_var_store)
             use_this_varstore = dfci_var_store
         else:
-            use_this_varstore = orig_var_store
-        args += " -drive if=pflash,format=raw,unit=1,file=" + use_this_varstore
+            use_this_varstore = env.GetValue("VAR_STORE_PATH", orig_var_store)
+
+        # Boot from a VM snapshot at the UEFI shell, which is saved in a qcow2 image of the variable store
+        snapshot = QemuRunnerLib.create_snapshot(env, executable, [code_fd], use_this_varstore, VirtualDrive)
+        if snapshot is not None:
+            config.add_drive(interface="pflash", format="qcow2", unit=1, file=snapshot.image)
+        else:
+            config.add_drive(interface="pflash", format="raw", unit=1, file=use_this_varstore)
 
         # Add XHCI USB controller and mouse
-        args += " -device qemu-xhci,id=usb"
-        args += " -device usb-tablet,id=input0,bus=usb.0,port=1"  # add a usb mouse
-        #args += " -device usb-kbd,id=input1,bus=usb.0,port=2"    # add a usb keyboard
+        config.add_device("qemu-xhci", id="usb")
+        config.add_device("usb-tablet", id="input0", bus="usb.0", port=1)  # add a usb mouse
+        #config.add_device("usb-kbd", id="input1", bus="usb.0", port=2)    # add a usb keyboard
 
         dfci_files = env.GetValue("DFCI_FILES")
         if dfci_files is not None:
-            args += f" -drive file=fat:rw:{dfci_files},format=raw,media=disk,if=none,id=dfci_disk"
-            args += " -device usb-storage,bus=usb.0,drive=dfci_disk"
+            config.add_drive(file=f"fat:rw:{dfci_files}", format="raw", media="disk", interface="none", id="dfci_disk")
+            config.add_device("usb-storage", bus="usb.0", drive="dfci_disk")
 
         install_files = env.GetValue("INSTALL_FILES")
         if install_files is not None:
-            args += f" -drive file={install_files},format=raw,media=disk,if=none,id=install_disk"
-            args += " -device usb-storage,bus=usb.0,drive=install_disk"
+            config.add_drive(file=install_files, format="raw", media="disk", interface="none", id="install_disk")
+            config.add_device("usb-storage", bus="usb.0", drive="install_disk")
 
-        boot_selection = ''
+        boot_selection = {}
         boot_to_front_page = env.GetValue("BOOT_TO_FRONT_PAGE")
         if boot_to_front_page is not None:
             if (boot_to_front_page.upper() == "TRUE"):
-                boot_selection += ",version=Vol+"
+                boot_selection["version"] = "Vol+"
 
         alt_boot_enable = env.GetValue("ALT_BOOT_ENABLE")
         if alt_boot_enable is not None:
             if alt_boot_enable.upper() == "TRUE":
-                boot_selection += ",version=Vol-"
+                boot_selection["version"] = "Vol-"
 
         # If DFCI_VAR_STORE is enabled, don't enable the Virtual Drive
+        # A snapshot attaches the Virtual Drive once the UEFI shell is running
         dfci_var_store = env.GetValue("DFCI_VAR_STORE")
-        if dfci_var_store is None:
+        if dfci_var_store is None and snapshot is None:
             # Mount disk with startup.nsh
             if os.path.isfile(VirtualDrive):
-                args += f" -drive file={VirtualDrive},if=virtio"
+                config.add_drive(file=VirtualDrive, interface="virtio")
             elif os.path.isdir(VirtualDrive):
-                args += f" -drive file=fat:rw:{VirtualDrive},format=raw,media=disk"
+                config.add_drive(file=f"fat:rw:{VirtualDrive}", format="raw", media="disk")
             else:
                 logging.critical("Virtual Drive Path Invalid")
 
         if env.GetValue("ENABLE_NETWORK") or dfci_var_store:
-            args += " -netdev user,id=net0"
+            netdev = {"id": "net0"}
 
             if dfci_var_store:
                 # forward ports for robotframework 8270 and 8271
-                args += ",hostfwd=tcp::8270-:8270,hostfwd=tcp::8271-:8271"
+                netdev["hostfwd"] = ["tcp::8270-:8270", "tcp::8271-:8271"]
+            config.add("netdev", "user", **netdev)
 
             if boot_to_front_page is None:
                 # Booting to Windows, use a PCI nic
-                args += " -device e1000,netdev=net0"
+                config.add_device("e1000", netdev="net0")
             else:
                 # Booting to UEFI, use virtio-net-pci
-                args += " -device virtio-net-pci,netdev=net0"
+                config.add_device("virtio-net-pci", netdev="net0")
         else:
-            args += " -net none"
-
-        creation_time = Path(code_fd).stat().st_ctime
-        creation_datetime = datetime.datetime.fromtimestamp(creation_time)
-        creation_date = creation_datetime.strftime("%m/%d/%Y")
-
-        args += f" -smbios type=0,vendor=\"Project Mu\",version=\"mu_tiano_platforms-{repo_version}\",date={creation_date},uefi=on"
-        args += f" -smbios type=1,manufacturer=Palindrome,product=\"QEMU Q35\",family=QEMU,version=\"{'.'.join(qemu_version)}\",serial=42-42-42-42,uuid=9de555c0-05d7-4aa1-84ab-bb511e3a8bef"
-        args += f" -smbios type=3,manufacturer=Palindrome,serial=40-41-42-43{boot_selection}"
-
-        sw_tpm_thread = None
-        sw_tpm_enable = env.GetValue("SWTPM_ENABLE", "TRUE")
-        if os.name == 'nt':
-            sw_tpm_enable = "FALSE"
-        if str(sw_tpm_enable).upper() == "TRUE":
-            tpm_dir = env.GetValue("BUILD_OUTPUT_BASE")
-            tpm_sock = os.path.join(tpm_dir, "swtpm-sock")
-            args += f" -chardev socket,id=chrtpm,path={tpm_sock}"
-            args += " -tpmdev emulator,id=tpm0,chardev=chrtpm"
-            args += " -device tpm-tis,tpmdev=tpm0"
-
-            logging.info("Starting TPM emulator in a different thread.")
-            sw_tpm_thread = threading.Thread(target=QemuRunner.RunSwTpmThread, args=(tpm_dir, tpm_sock))
-            sw_tpm_thread.start()
+            config.add("net", "none")
+
+        config.add_firmware_smbios(repo_version, code_fd)
+        config.add_smbios(1, manufacturer="Palindrome", product="QEMU Q35", family="QEMU", version='.'.join(qemu_version),
+                          serial="42-42-42-42", uuid="9de555c0-05d7-4aa1-84ab-bb511e3a8bef")
+        config.add_smbios(3, manufacturer="Palindrome", serial="40-41-42-43", **boot_selection)
+
+        # Each run gets its own TPM emulator, with a temporary TPM state unless SWTPM_STATE_DIR is set
+        swtpm = QemuRunnerLib.create_swtpm(env, "tpm-tis", [code_fd])
+        if swtpm is not None:
+            swtpm.configure(config)
 
         if (env.GetValue("QEMU_HEADLESS").upper() == "TRUE"):
-            args += " -display none"  # no graphics
+            config.add("display", "none")  # no graphics
         else:
-            args += " -device bochs-display,addr=0x03 -vga none"
+            config.add_device("bochs-display", addr="0x03")
+            config.add("vga", "none")
 
         # Check for gdb server setting
         gdb_port = env.GetValue("GDB_SERVER")
         if (gdb_port != None):
             logging.log(logging.INFO, "Enabling GDB server at port tcp::" + gdb_port + ".")
-            args += " -gdb tcp::" + gdb_port
+            config.add("gdb", "tcp::" + gdb_port)
 
         # write ConOut messages to telnet localhost port
         serial_port = env.GetValue("SERIAL_PORT")
         if serial_port != None:
-            args += " -serial tcp:127.0.0.1:" + serial_port + ",server,nowait"
+            config.add("serial", "tcp:127.0.0.1:" + serial_port, server=None, nowait=None)
 
         # Connect the debug monitor to a telnet localhost port
         monitor_port = env.GetValue("MONITOR_PORT")
         if monitor_port is not None:
-            args += " -monitor tcp:127.0.0.1:" + monitor_port + ",server,nowait"
-
-        ## TODO: Save the console mode. The original issue comes from: https://gitlab.com/qemu-project/qemu/-/issues/1674
-        if os.name == 'nt' and qemu_version[0] >= '8':
-            import win32console
-            std_handle = win32console.GetStdHandle(win32console.STD_INPUT_HANDLE)
-            try:
-                console_mode = std_handle.GetConsoleMode()
-            except Exception:
-                std_handle = None
-
+            config.add("monitor", "tcp:127.0.0.1:" + monitor_port, server=None, nowait=None)
 
-        # Run QEMU
+        # Run QEMU once the TPM emulator is ready, and stop the emulator once QEMU exits
+        ret = None
         try:
-            ret = utility_functions.RunCmd(executable, args)
-        except KeyboardInterrupt:
-            logging.critical("QEMU run interrupted by user (ctrl+c).")
-            ret = -1
-
-        ## TODO: restore the customized RunCmd once unit tests with asserts are figured out
-        if ret == 0xc0000005:
-            ret = 0
-
-        ## TODO: remove this once we upgrade to newer QEMU
-        if ret == 0x8B and qemu_version[0] == '4':
-            # QEMU v4 will return segmentation fault when shutting down.
-            # Tested same FDs on QEMU 6 and 7, not observing the same.
-            ret = 0
-
-        if os.name == 'nt' and qemu_version[0] >= '8' and std_handle is not None:
-            # Restore the console mode for Windows on QEMU v8+.
-            std_handle.SetConsoleMode(console_mode)
-        elif os.name != 'nt':
-            # Linux version of QEMU will mess with the print if its run failed, let's just restore it anyway
-            utility_functions.RunCmd('stty', 'sane', capture=False)
-
-        if sw_tpm_thread is not None:
-            sw_tpm_thread.join()
+            if swtpm is not None:
+                swtpm.start()
+            ret = run_qemu(config, qemu_version, sink=sink, monitor=monitor, watchdog=watchdog, snapshot=snapshot,
+                           profiler=profiler)
+        finally:
+            if swtpm is not None:
+                swtpm.stop(capture=ret == 0)
+        QemuRunnerLib.write_boot_profile(env, profiler, config, qemu_version, snapshot)
 
         return ret
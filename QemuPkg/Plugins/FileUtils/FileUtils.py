@@ -0,0 +1,83 @@
+##
+# File helpers shared by the QEMU plugins, for cloning and hashing firmware, drive and TPM state files.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import hashlib
+import os
+import shutil
+
+from os import PathLike
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+MB = 1024 * 1024
+
+# ioctl request that makes a file share all blocks with another file (Linux reflink)
+FICLONE = 0x40049409
+
+
+def reflink(src: PathLike, dst: PathLike) -> bool:
+    """Creates `dst` as a reflink of `src`, sharing all blocks. Returns False if the file system does not support it."""
+    if fcntl is None:
+        return False
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return True
+        except OSError:
+            pass
+    os.unlink(dst)
+    return False
+
+
+def clone_file(src: PathLike, dst: PathLike):
+    """Copies `src` to `dst`.
+
+    The copy shares blocks with `src` (a reflink) when the file system supports it. Otherwise only the allocated
+    regions of `src` are copied so a sparse file stays sparse.
+    """
+    if reflink(src, dst):
+        return
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+
+        size = os.fstat(fsrc.fileno()).st_size
+        if not hasattr(os, "SEEK_DATA"):
+            shutil.copyfileobj(fsrc, fdst, MB)
+            return
+
+        offset = 0
+        while offset < size:
+            try:
+                data = os.lseek(fsrc.fileno(), offset, os.SEEK_DATA)
+            except OSError:
+                # ENXIO, no data after offset
+                break
+            hole = os.lseek(fsrc.fileno(), data, os.SEEK_HOLE)
+            fsrc.seek(data)
+            fdst.seek(data)
+            remaining = hole - data
+            while remaining > 0:
+                chunk = fsrc.read(min(remaining, MB))
+                if not chunk:
+                    break
+                fdst.write(chunk)
+                remaining -= len(chunk)
+            offset = hole
+        fdst.truncate(size)
+
+
+def hash_file(path: PathLike) -> str:
+    """Returns the SHA-256 digest of a file as a hex string."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(MB), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
@@ -0,0 +1,48 @@
+##
+# Tests the file helpers shared by the QEMU plugins.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from FileUtils import MB, clone_file, hash_file  # noqa: E402
+
+
+class FileUtilsTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.src = os.path.join(temp_dir.name, "src.img")
+        self.dst = os.path.join(temp_dir.name, "dst.img")
+
+    def test_clone_sparse_file(self):
+        with open(self.src, "wb") as f:
+            f.write(b"head")
+            f.seek(8 * MB)
+            f.write(b"middle")
+            f.truncate(16 * MB)
+
+        clone_file(self.src, self.dst)
+
+        with open(self.src, "rb") as fsrc, open(self.dst, "rb") as fdst:
+            self.assertEqual(fsrc.read(), fdst.read())
+
+    def test_hash_file(self):
+        data = os.urandom(MB + 1)
+        with open(self.src, "wb") as f:
+            f.write(data)
+
+        self.assertEqual(hash_file(self.src), hashlib.sha256(data).hexdigest())
+
+
+if __name__ == "__main__":
+    unittest.main()
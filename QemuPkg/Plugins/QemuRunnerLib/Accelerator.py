@@ -0,0 +1,142 @@
+##
+# Selects the QEMU accelerator of a run and checks the CPU configuration works with it.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import logging
+import os
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# The accelerators that can be requested with QEMU_ACCEL, besides `auto`
+ACCELERATORS = ("kvm", "tcg", "whpx")
+
+KVM_DEVICE = "/dev/kvm"
+
+# ioctl requests of /dev/kvm, and the only API version KVM has reported since Linux 2.6.22
+KVM_GET_API_VERSION = 0xAE00
+KVM_CREATE_VM = 0xAE01
+KVM_API_VERSION = 12
+
+# The /proc/cpuinfo names of QEMU CPU flags that differ from the QEMU name
+CPUINFO_NAMES = {"sse3": "pni", "sse4.1": "sse4_1", "sse4.2": "sse4_2"}
+
+# Other names QEMU accepts for a CPU flag, which `-cpu help` only lists under one name
+FLAG_ALIASES = {"sse3": "pni", "pni": "sse3", "sse4.1": "sse4_1", "sse4_1": "sse4.1", "sse4.2": "sse4_2",
+                "sse4_2": "sse4.2"}
+
+# CPU flags KVM emulates when the host CPU does not have them
+KVM_EMULATED_FLAGS = {"hypervisor", "umip", "x2apic", "tsc-deadline"}
+
+
+def host_cpu_flags() -> set[str]:
+    """Returns the flags of the host CPU from /proc/cpuinfo, or an empty set if they are unknown."""
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def kvm_unavailable_reason() -> str | None:
+    """Returns why KVM cannot run a VM on this host, or None if it can."""
+    if sys.platform != "linux" or fcntl is None:
+        return "KVM is only available on Linux"
+    if not os.path.exists(KVM_DEVICE):
+        flags = host_cpu_flags()
+        if flags and not flags & {"vmx", "svm"}:
+            return ("the CPU does not expose hardware virtualization (vmx or svm), e.g. nested virtualization is "
+                    "disabled for this VM")
+        return f"{KVM_DEVICE} does not exist, the kvm modules are not loaded"
+
+    try:
+        kvm = os.open(KVM_DEVICE, os.O_RDWR | os.O_CLOEXEC)
+    except OSError as e:
+        return f"{KVM_DEVICE} cannot be opened, e.g. the user is not in the group that owns it. {e}"
+    try:
+        version = fcntl.ioctl(kvm, KVM_GET_API_VERSION)
+        if version != KVM_API_VERSION:
+            return f"{KVM_DEVICE} reports the unsupported API version {version}"
+        # Creating a VM fails if the CPU virtualization extensions are disabled, e.g. in the firmware setup
+        os.close(fcntl.ioctl(kvm, KVM_CREATE_VM, 0))
+    except OSError as e:
+        return f"{KVM_DEVICE} cannot create a VM. {e}"
+    finally:
+        os.close(kvm)
+    return None
+
+
+def select_accelerator(requested: str | None, capabilities) -> str | None:
+    """Returns the accelerator to run QEMU with, or None for the QEMU default (TCG).
+
+    `auto` selects KVM if the host can run VMs with it and the QEMU binary supports it, otherwise TCG. Other values
+    are used if the QEMU binary supports them, unknown values are ignored.
+
+    Args:
+        requested (str | None): The requested accelerator, e.g. the value of QEMU_ACCEL
+        capabilities (QemuCapabilities): The capabilities of the QEMU binary
+    """
+    if requested is None:
+        return None
+    requested = requested.lower()
+
+    if requested == "auto":
+        reason = kvm_unavailable_reason()
+        if reason is None and capabilities.accelerators and not capabilities.supports_accel("kvm"):
+            reason = "the QEMU binary does not support it"
+        if reason is not None:
+            logging.info(f"KVM is not used, {reason}. Using TCG.")
+            return "tcg"
+        logging.info("Using the KVM accelerator.")
+        return "kvm"
+
+    if requested not in ACCELERATORS:
+        return None
+    if capabilities.accelerators and not capabilities.supports_accel(requested):
+        logging.warning(f"The QEMU binary does not support the {requested} accelerator. Using the default.")
+        return None
+    return requested
+
+
+def validate_cpu(config, accel: str | None, capabilities):
+    """Adjusts the CPU model and flags of a QemuConfig so QEMU can start with them under an accelerator.
+
+    The `host` model requires KVM and is replaced by `max` otherwise. Enabled flags the QEMU binary does not
+    recognize, and under KVM flags the host CPU lacks, are removed with a warning, as QEMU would fail or silently
+    drop them.
+
+    Args:
+        config (QemuConfig): The QEMU configuration
+        accel (str | None): The accelerator QEMU runs with, None for TCG
+        capabilities (QemuCapabilities): The capabilities of the QEMU binary
+    """
+    if config.cpu == "host" and accel != "kvm":
+        logging.warning("The host CPU model requires KVM. Using the max CPU model instead.")
+        config.cpu = "max"
+    if config.cpu and capabilities.cpu_models and not capabilities.supports_cpu(config.cpu):
+        logging.warning(f"The QEMU binary does not list the {config.cpu} CPU model.")
+
+    recognized = set(capabilities.cpu_flags)
+    host_flags = host_cpu_flags() if accel == "kvm" else set()
+    for option, value in list(config.cpu_options.items()):
+        flag = option.lstrip("+-")
+        # Only check flags that are enabled, not disabled flags or other CPU properties
+        if option.startswith("-") or value not in (None, "on", True):
+            continue
+
+        if recognized and flag not in recognized and FLAG_ALIASES.get(flag) not in recognized:
+            logging.warning(f"The QEMU binary does not recognize the {flag} CPU flag, it is not enabled.")
+            del config.cpu_options[option]
+        elif host_flags and flag not in KVM_EMULATED_FLAGS and CPUINFO_NAMES.get(flag, flag) not in host_flags:
+            logging.warning(f"The host CPU does not support the {flag} CPU flag, it is not enabled under KVM.")
+            del config.cpu_options[option]
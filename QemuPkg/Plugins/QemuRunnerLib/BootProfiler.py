@@ -0,0 +1,135 @@
+##
+# Measures the boot phases of a QEMU run from host timestamps of the firmware debug output.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import datetime
+import json
+import logging
+import re
+import time
+
+from os import PathLike
+from pathlib import Path
+
+from DispatchProfiler import DispatchProfiler
+
+
+# Bump when the contents of the report change
+PROFILE_VERSION = 1
+
+# The number of modules logged after a run, longest first
+TOP_MODULES = 10
+
+# The boot phases in order, each with the debug output that shows it has started
+PHASE_MARKERS = [
+    ("PEI", r"^Install PPI: |Loading PEIM at "),
+    ("DXE", r"Loading DXE CORE at |HOBLIST address in DXE = "),
+    ("BDS", r"\[Bds\] ?Entry"),
+    ("Shell", r"\[Bds\] ?Booting .*Shell|Loading driver at .*\bShell\.efi|UEFI Interactive Shell"),
+]
+
+
+class BootProfiler:
+    """Timestamps each console line of a QEMU run and derives the boot phases from well-known debug output.
+
+    SEC starts when QEMU starts. Each later phase starts at the first line matching its marker and ends when the
+    next phase that was seen starts. The shell phase marks the time to shell, it has no duration. Phases without a
+    matching line, e.g. with a RELEASE build, are reported as null.
+
+    Attributes:
+        markers (list[tuple[str, re.Pattern]]): The phases after SEC with their markers
+        start (float | None): The monotonic time QEMU started
+        first_output (float | None): Seconds from the start to the first console line
+        marks (dict[str, float]): Seconds from the start to the first line of each phase seen
+        lines (int): The number of console lines
+        dispatch (DispatchProfiler): The time attributed to each PEIM and driver
+    """
+
+    def __init__(self, markers: list[tuple[str, str]] = PHASE_MARKERS):
+        self.markers = [(phase, re.compile(pattern)) for phase, pattern in markers]
+        self.start = None
+        self.started = None
+        self.first_output = None
+        self.end = None
+        self.marks = {}
+        self.lines = 0
+        self.dispatch = DispatchProfiler()
+        self._phase = "SEC"
+        self._next = 0
+
+    def begin(self):
+        """Records that QEMU started."""
+        self.start = time.monotonic()
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+
+    def feed(self, line: str, timestamp: float = None) -> float:
+        """Records a console line, returning its host timestamp in seconds from the start."""
+        elapsed = (time.monotonic() if timestamp is None else timestamp) - self.start
+        self.lines += 1
+        if self.first_output is None:
+            self.first_output = elapsed
+        # Phases are only searched for in order, so a marker printed again later does not move a boundary
+        for index in range(self._next, len(self.markers)):
+            phase, regex = self.markers[index]
+            if regex.search(line):
+                self.marks[phase] = elapsed
+                self._phase = phase
+                self._next = index + 1
+                break
+        self.dispatch.feed(line, elapsed, self._phase)
+        return elapsed
+
+    def finish(self):
+        """Records that QEMU exited."""
+        self.end = time.monotonic() - self.start
+        self.dispatch.finish(self.end)
+
+    def report(self) -> dict:
+        """Returns the timing report of the run."""
+        boundaries = [("SEC", 0.0)] + [(phase, self.marks.get(phase)) for phase, _ in self.markers]
+        seen = [(phase, start) for phase, start in boundaries if start is not None]
+        phases = {}
+        for phase, start in boundaries:
+            if phase == "Shell":
+                continue
+            if start is None:
+                phases[phase] = None
+                continue
+            later = [mark for _, mark in seen if mark > start]
+            end = min(later) if later else self.end
+            phases[phase] = {"start": start, "end": end, "duration": None if end is None else end - start}
+
+        return {
+            "version": PROFILE_VERSION,
+            "started": self.started.isoformat() if self.started else None,
+            "lines": self.lines,
+            "first_output": self.first_output,
+            "phases": phases,
+            "time_to_shell": self.marks.get("Shell"),
+            "total": self.end,
+        }
+
+    def write(self, path: PathLike, **metadata):
+        """Writes the timing report as JSON, with any metadata identifying the run (e.g. the firmware version).
+
+        The time attributed to each PEIM and driver is written next to it, as a table longest first
+        (`<name>.drivers.txt`) and as folded stacks for flamegraph tools (`<name>.folded`).
+        """
+        path = Path(path)
+        report = self.report()
+        report.update(metadata)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        self.dispatch.write_table(path.with_suffix(".drivers.txt"))
+        self.dispatch.write_folded(path.with_suffix(".folded"))
+
+        phases = ", ".join(f"{phase} {timing['duration']:.2f}s" for phase, timing in report["phases"].items()
+                           if timing is not None and timing["duration"] is not None)
+        shell = f"{report['time_to_shell']:.2f}s" if report["time_to_shell"] is not None else "not reached"
+        logging.info(f"Boot phases: {phases or 'no markers found'}. Time to shell: {shell}. Report: {path}")
+        if self.dispatch.modules:
+            logging.info(f"Slowest modules:\n{self.dispatch.format_table(TOP_MODULES)}")
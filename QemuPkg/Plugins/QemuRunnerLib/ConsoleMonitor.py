@@ -0,0 +1,106 @@
+##
+# Watches the console output of QEMU for firmware failures and other events.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import json
+import logging
+import re
+
+from dataclasses import dataclass, field
+from os import PathLike
+
+
+# The exit code of a QEMU run ended by a fatal trigger, distinct from the exit codes of QEMU itself
+FATAL_TRIGGER_EXIT_CODE = 0xA55E
+
+# Trigger actions
+ACTION_LOG = "log"    # log the line and keep running
+ACTION_STOP = "stop"  # end QEMU and report success, e.g. on a test complete sentinel
+ACTION_FAIL = "fail"  # end QEMU and report FATAL_TRIGGER_EXIT_CODE
+
+
+@dataclass
+class ConsoleTrigger:
+    """A regular expression searched for in each console line.
+
+    Attributes:
+        name (str): The name reported when the trigger matches
+        pattern (str): The regular expression
+        action (str): What to do when the trigger matches: `log`, `stop` or `fail`
+    """
+    name: str
+    pattern: str
+    action: str = ACTION_FAIL
+    regex: re.Pattern = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.action not in (ACTION_LOG, ACTION_STOP, ACTION_FAIL):
+            raise ValueError(f"Unknown action {self.action} for console trigger {self.name}.")
+        self.regex = re.compile(self.pattern)
+
+
+DEFAULT_TRIGGERS = [
+    # e.g. "ASSERT [DxeCore] /MdeModulePkg/Core/Dxe/Mem/Page.c(123): Status == EFI_SUCCESS"
+    ConsoleTrigger("ASSERT", r"\bASSERT (\[[^\]]*\] )?\S+\(\d+\): "),
+    ConsoleTrigger("X64 exception", r"!!!! X64 Exception Type - "),
+    ConsoleTrigger("IA32 exception", r"!!!! IA32 Exception Type - "),
+    ConsoleTrigger("AArch64 exception", r"\b(Synchronous|SError) Exception at 0x"),
+]
+
+
+def load_triggers(path: PathLike) -> list[ConsoleTrigger]:
+    """Loads console triggers from a JSON list of `{"name": ..., "pattern": ..., "action": ...}` objects.
+
+    Raises:
+        (OSError): The file cannot be read
+        (ValueError): The file is not valid JSON or holds an invalid trigger
+    """
+    with open(path, "r") as f:
+        entries = json.load(f)
+    try:
+        return [ConsoleTrigger(entry["name"], entry["pattern"], entry.get("action", ACTION_FAIL)) for entry in entries]
+    except (KeyError, TypeError, AttributeError, re.error) as e:
+        raise ValueError(f"Invalid console trigger in {path}. {e}")
+
+
+class ConsoleMonitor:
+    """Searches the console output of a QEMU run for triggers.
+
+    Feed each line with `feed`. Once a `stop` or `fail` trigger matches, `triggered` is set and the run should end.
+    """
+
+    def __init__(self, triggers: list[ConsoleTrigger] = None):
+        self.triggers = list(DEFAULT_TRIGGERS if triggers is None else triggers)
+        self.triggered = None
+        self.triggered_line = None
+
+    def feed(self, line: str) -> ConsoleTrigger | None:
+        """Checks a console line, returning the trigger that ends the run if one matched."""
+        for trigger in self.triggers:
+            if not trigger.regex.search(line):
+                continue
+            if trigger.action == ACTION_LOG:
+                logging.warning(f"Console trigger {trigger.name}: {line}")
+                continue
+            self.triggered = trigger
+            self.triggered_line = line
+            return trigger
+        return None
+
+    def exit_code(self, ret: int) -> int:
+        """Returns the exit code of the run, given the exit code of QEMU."""
+        if self.triggered is None:
+            return ret
+        return FATAL_TRIGGER_EXIT_CODE if self.triggered.action == ACTION_FAIL else 0
+
+    def report(self):
+        """Logs the trigger that ended the run."""
+        if self.triggered is None:
+            return
+        if self.triggered.action == ACTION_STOP:
+            logging.info(f"QEMU stopped on console trigger {self.triggered.name}: {self.triggered_line}")
+            return
+        logging.critical(f"QEMU stopped on console trigger {self.triggered.name}: {self.triggered_line}")
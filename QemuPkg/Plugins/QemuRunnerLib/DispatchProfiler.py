@@ -0,0 +1,120 @@
+##
+# Attributes the boot time of a QEMU run to the PEIMs and drivers the firmware dispatches.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import re
+
+from dataclasses import dataclass
+from os import PathLike
+
+
+# e.g. "Loading driver at 0x0007E6A000 EntryPoint=0x0007E6A2C0 DevicePathDxe.efi"
+MODULE_LOAD = re.compile(r"Loading (?:PEIM|driver) at 0x[0-9A-Fa-f]+ EntryPoint=0x[0-9A-Fa-f]+\s*(\S*)")
+# e.g. "Loading PEIM 9B3ADA4F-AE56-4C24-8DEA-F03B7558AE50", printed by the PEI dispatcher before the load
+MODULE_GUID = re.compile(r"Loading (?:PEIM|driver) ([0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-"
+                         r"[0-9A-Fa-f]{12})")
+PROTOCOL_INSTALL = "InstallProtocolInterface: "
+
+
+@dataclass
+class ModuleTiming:
+    """The boot time attributed to a module.
+
+    Attributes:
+        phase (str): The boot phase the module was dispatched in
+        name (str): The module file name, its GUID if it has no debug name, or `[<phase>]` for the time
+            before the first module of a phase
+        duration (float): Seconds from each load of the module to the next module load or phase change
+        loads (int): The number of times the module was loaded
+        protocols (int): The number of protocol interfaces installed while the module was running
+    """
+    phase: str
+    name: str
+    duration: float = 0.0
+    loads: int = 0
+    protocols: int = 0
+
+
+class DispatchProfiler:
+    """Attributes wall-clock time to each PEIM and driver from the module loading lines of the debug output.
+
+    The time from a module load to the next module load, or to the start of the next boot phase, is attributed to
+    the module. This covers loading the image, running its entry point and the dispatcher overhead that follows.
+    """
+
+    def __init__(self):
+        self.modules = {}
+        self._owner = None
+        self._since = 0.0
+        self._phase = None
+        self._guid = None
+
+    def feed(self, line: str, elapsed: float, phase: str):
+        """Records a console line, with its host timestamp in seconds and the boot phase it was printed in."""
+        if phase != self._phase:
+            self._switch(elapsed, self._module(phase, f"[{phase}]"))
+            self._phase = phase
+
+        if line.startswith(PROTOCOL_INSTALL):
+            if self._owner is not None:
+                self._owner.protocols += 1
+            return
+        if "Loading " not in line:
+            return
+
+        match = MODULE_LOAD.search(line)
+        if match is not None:
+            name = match.group(1) or self._guid or "Unknown"
+            self._guid = None
+            module = self._module(phase, name)
+            module.loads += 1
+            self._switch(elapsed, module)
+            return
+
+        match = MODULE_GUID.search(line)
+        if match is not None:
+            self._guid = match.group(1)
+
+    def finish(self, elapsed: float):
+        """Attributes the time until QEMU exited."""
+        self._switch(elapsed, None)
+
+    def ranked(self) -> list[ModuleTiming]:
+        """Returns the modules, longest first."""
+        return sorted(self.modules.values(), key=lambda module: module.duration, reverse=True)
+
+    def format_table(self, limit: int = None) -> str:
+        """Formats the modules as a table, longest first."""
+        total = sum(module.duration for module in self.modules.values()) or 1.0
+        lines = [f"{'Time (ms)':>10}  {'Share':>6}  {'Loads':>5}  {'Protocols':>9}  {'Phase':<5}  Module"]
+        for module in self.ranked()[:limit]:
+            lines.append(f"{module.duration * 1000:>10.1f}  {module.duration / total:>6.1%}  {module.loads:>5}  "
+                         f"{module.protocols:>9}  {module.phase:<5}  {module.name}")
+        return "\n".join(lines)
+
+    def write_table(self, path: PathLike):
+        with open(path, "w") as f:
+            f.write(self.format_table() + "\n")
+
+    def write_folded(self, path: PathLike):
+        """Writes the modules as folded stacks (`<phase>;<module> <microseconds>`) for flamegraph tools."""
+        with open(path, "w") as f:
+            for module in self.ranked():
+                microseconds = round(module.duration * 1000000)
+                if microseconds > 0:
+                    f.write(f"{module.phase};{module.name} {microseconds}\n")
+
+    def _module(self, phase: str, name: str) -> ModuleTiming:
+        key = (phase, name)
+        if key not in self.modules:
+            self.modules[key] = ModuleTiming(phase, name)
+        return self.modules[key]
+
+    def _switch(self, elapsed: float, owner: ModuleTiming | None):
+        if self._owner is not None:
+            self._owner.duration += max(0.0, elapsed - self._since)
+        self._owner = owner
+        self._since = elapsed
@@ -0,0 +1,107 @@
+##
+# Receives the console output of QEMU without passing every line through Python logging.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import gzip
+import logging
+import re
+
+from collections import deque
+from os import PathLike
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# The number of console lines kept for failure reports
+DEFAULT_TAIL_LINES = 100
+
+# The lines forwarded to the logger when the output is written to a file and no filter is configured. Besides
+# failures, this keeps the lines the platform builds check in the build log after a run, e.g. the CPU brand name.
+DEFAULT_FORWARD_PATTERN = r"\bASSERT\b|Exception|\bERROR\b|\bFAIL|\[Bds\] ?Booting|CPU Brand Name:"
+
+# The file suffix of each compression
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+# Bytes buffered before the output is written to the file
+BUFFER_SIZE = 1024 * 1024
+
+
+class OutputSink:
+    """Writes the raw console output of QEMU to a buffered, optionally compressed, file.
+
+    The output is split into lines for the console listeners of the run. The last lines are kept in a ring buffer
+    for failure reports, and only lines matching the forward filter are logged. Without a file, every line is
+    logged unless a filter is given, so the console can still be followed.
+
+    Attributes:
+        path (Path | None): The file the raw output is written to, including any compression suffix
+        tail (deque[str]): The last console lines
+        forward (re.Pattern | None): The lines to log, or None to log every line
+        logging_level (int): The level forwarded lines are logged at
+    """
+
+    def __init__(self, path: PathLike = None, compression: str = None, tail_lines: int = DEFAULT_TAIL_LINES,
+                 forward_pattern: str = None, logging_level: int = logging.INFO):
+        self.path = None
+        self.tail = deque(maxlen=max(1, tail_lines))
+        if forward_pattern is None and path is not None:
+            forward_pattern = DEFAULT_FORWARD_PATTERN
+        self.forward = re.compile(forward_pattern) if forward_pattern else None
+        self.logging_level = logging_level
+        self._file = None
+        self._partial = b""
+
+        if path is not None:
+            self.path = Path(path)
+            if compression and compression != "none":
+                if compression not in COMPRESSION_SUFFIXES:
+                    raise ValueError(f"Unknown console log compression {compression}.")
+                if compression == "zstd" and zstandard is None:
+                    logging.warning("zstandard is not installed, the console log is compressed with gzip instead.")
+                    compression = "gzip"
+                self.path = self.path.with_name(self.path.name + COMPRESSION_SUFFIXES[compression])
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if compression == "gzip":
+                # A low level keeps up with DEBUG builds, the output compresses well regardless
+                self._file = gzip.open(self.path, "wb", compresslevel=1)
+            elif compression == "zstd":
+                self._file = zstandard.ZstdCompressor(level=3).stream_writer(open(self.path, "wb"))
+            else:
+                self._file = open(self.path, "wb", buffering=BUFFER_SIZE)
+
+    def write(self, data: bytes) -> list[str]:
+        """Writes raw console output, returning the lines it completed."""
+        if self._file is not None:
+            self._file.write(data)
+
+        chunks = (self._partial + data).split(b"\n")
+        self._partial = chunks.pop()
+        return [self._line(chunk) for chunk in chunks]
+
+    def close(self) -> list[str]:
+        """Closes the file, returning the last line if the output did not end with a newline."""
+        lines = [self._line(self._partial)] if self._partial else []
+        self._partial = b""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return lines
+
+    def log_tail(self):
+        """Logs the last console lines."""
+        location = f" Full output: {self.path}" if self.path is not None else ""
+        logging.critical(f"Last {len(self.tail)} console lines:{location}\n" + "\n".join(self.tail))
+
+    def _line(self, chunk: bytes) -> str:
+        line = chunk.decode(errors="replace").rstrip("\r")
+        self.tail.append(line)
+        if self.forward is None or self.forward.search(line):
+            logging.log(self.logging_level, line)
+        return line
@@ -0,0 +1,35 @@
+##
+# Tests the lines the output sink forwards to the build log.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from OutputSink import OutputSink  # noqa: E402
+
+
+class OutputSinkTest(unittest.TestCase):
+
+    def test_console_log_forwards_checked_lines(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            sink = OutputSink(os.path.join(temp_dir, "Console.log"))
+            with self.assertLogs(level="INFO") as logs:
+                sink.write(b"Loading driver at 0x0007E6A000\r\nCPU Brand Name: Intel Core Processor (Skylake)\r\n"
+                           b"ASSERT [Foo] Bar.c(1): FALSE\r\n")
+                sink.close()
+
+            self.assertEqual([record.getMessage() for record in logs.records],
+                             ["CPU Brand Name: Intel Core Processor (Skylake)", "ASSERT [Foo] Bar.c(1): FALSE"])
+            with open(sink.path, "rb") as f:
+                self.assertIn(b"Loading driver at", f.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,195 @@
+##
+# Probes and caches the version and capabilities of a QEMU binary.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import io
+import json
+import logging
+import os
+import re
+import threading
+
+from dataclasses import asdict, dataclass, field
+from os import PathLike
+from pathlib import Path
+
+from edk2toollib.utility_functions import RunCmd
+
+
+# Bump when the probed data or its parsing changes, so older cache entries are probed again
+CACHE_VERSION = 1
+
+_lock = threading.Lock()
+_probed = {}
+
+
+@dataclass
+class QemuCapabilities:
+    """The version of a QEMU binary and the options it supports.
+
+    Attributes:
+        version (list[str]): The version components, e.g. `["8", "2", "0"]`
+        accelerators (list[str]): The accelerators built into the binary (`-accel help`), e.g. `tcg`, `kvm`
+        cpu_models (list[str]): The CPU models the binary emulates (`-cpu help`)
+        cpu_flags (list[str]): The CPU feature flags the binary recognizes (`-cpu help`), x86 only
+        machines (list[str]): The machine types and versions the binary emulates (`-machine help`)
+    """
+    version: list[str]
+    accelerators: list[str] = field(default_factory=list)
+    cpu_models: list[str] = field(default_factory=list)
+    cpu_flags: list[str] = field(default_factory=list)
+    machines: list[str] = field(default_factory=list)
+
+    def supports_accel(self, accel: str) -> bool:
+        return accel.lower() in self.accelerators
+
+    def supports_cpu(self, cpu_model: str) -> bool:
+        return cpu_model in self.cpu_models
+
+    def supports_machine(self, machine: str) -> bool:
+        return machine in self.machines
+
+    @staticmethod
+    def probe(executable: PathLike, cache_path: PathLike = None) -> "QemuCapabilities | None":
+        """Returns the capabilities of a QEMU binary, running it only if they are not cached.
+
+        Results are cached in memory and, if `cache_path` is provided, in that JSON file. Entries are keyed by the
+        binary's path, modification time and size, so an updated binary is probed again.
+
+        Args:
+            executable (PathLike): The QEMU binary
+            cache_path (PathLike): The file to cache the capabilities of each binary in
+
+        Returns:
+            (QemuCapabilities | None): The capabilities, or None if the version of the binary could not be queried
+        """
+        if executable is None:
+            return None
+
+        try:
+            stat = os.stat(executable)
+            path = str(Path(executable).resolve())
+        except OSError:
+            # e.g. the binary is only found through the PATH
+            stat = None
+            path = str(executable)
+        key = {"cache_version": CACHE_VERSION,
+               "mtime_ns": stat.st_mtime_ns if stat else None,
+               "size": stat.st_size if stat else None}
+
+        with _lock:
+            cached = _probed.get(path)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+
+            cache = _load_cache(cache_path)
+            entry = cache.get(path)
+            capabilities = None
+            if stat is not None and entry is not None and entry.get("key") == key:
+                try:
+                    capabilities = QemuCapabilities(**entry["capabilities"])
+                except TypeError:
+                    capabilities = None
+
+            if capabilities is None:
+                capabilities = _query(executable)
+                if capabilities is None:
+                    return None
+                if stat is not None and cache_path is not None:
+                    cache[path] = {"key": key, "capabilities": asdict(capabilities)}
+                    _save_cache(cache_path, cache)
+
+            _probed[path] = (key, capabilities)
+            return capabilities
+
+
+def _run(executable: PathLike, args: str) -> str | None:
+    """Runs QEMU and returns its output, or None if it failed."""
+    outstream = io.StringIO()
+    ret = RunCmd(str(executable), args, outstream=outstream, logging_level=logging.DEBUG)
+    if ret != 0:
+        logging.debug(f"[{executable} {args}] Result: {ret}")
+        return None
+    return outstream.getvalue()
+
+
+def _query(executable: PathLike) -> QemuCapabilities | None:
+    """Runs QEMU to query its version and capabilities."""
+    output = _run(executable, "--version")
+    # expected version string will be "QEMU emulator version maj.min.rev"
+    match = re.search(r'version\s*([\d.]+)', output or "")
+    if match is None:
+        logging.error(f"Failed to query the version of {executable}.")
+        return None
+
+    capabilities = QemuCapabilities(match.group(1).split('.'))
+    capabilities.accelerators = _parse_list(_run(executable, "-accel help"))
+    capabilities.cpu_models, capabilities.cpu_flags = _parse_cpus(_run(executable, "-cpu help"))
+    capabilities.machines = _parse_list(_run(executable, "-machine help"))
+    return capabilities
+
+
+def _parse_list(output: str | None) -> list[str]:
+    """Returns the first word of each line after the header line of a QEMU `help` listing."""
+    if not output:
+        return []
+    names = []
+    for line in output.splitlines()[1:]:
+        words = line.split()
+        if words:
+            names.append(words[0])
+    return names
+
+
+def _parse_cpus(output: str | None) -> tuple[list[str], list[str]]:
+    """Returns the CPU models and the recognized CPU flags listed by `-cpu help`.
+
+    x86 binaries prefix each model with `x86` and list the recognized CPUID flags after the models.
+    """
+    models = []
+    flags = []
+    section = None
+    for line in (output or "").splitlines():
+        if line.startswith("Available CPUs"):
+            section = models
+            continue
+        if line.startswith("Recognized CPUID flags"):
+            section = flags
+            continue
+        if section is None or not line.strip():
+            continue
+
+        if section is models:
+            words = line.split()
+            if words[0] == "x86" and len(words) > 1:
+                words = words[1:]
+            models.append(words[0])
+        else:
+            flags.extend(line.split())
+    return models, flags
+
+
+def _load_cache(cache_path: PathLike) -> dict:
+    if cache_path is None:
+        return {}
+    try:
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(cache_path: PathLike, cache: dict):
+    staging = Path(f"{cache_path}.{os.getpid()}.tmp")
+    try:
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(staging, "w") as f:
+            json.dump(cache, f, indent=2)
+        os.replace(staging, cache_path)
+    except OSError as e:
+        logging.warning(f"Failed to cache QEMU capabilities at {cache_path}. {e}")
+        staging.unlink(missing_ok=True)
@@ -0,0 +1,246 @@
+##
+# Builds QEMU command lines from a structured configuration and runs QEMU.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import datetime
+import json
+import logging
+import os
+import shlex
+import subprocess
+
+from dataclasses import asdict, dataclass, field
+from os import PathLike
+from pathlib import Path
+
+from edk2toollib import utility_functions
+
+from BootProfiler import BootProfiler
+from ConsoleMonitor import ConsoleMonitor
+from OutputSink import OutputSink
+from Snapshot import VmSnapshot
+from Watchdog import WATCHDOG_EXIT_CODE, Watchdog
+
+
+# Bytes of console output read from QEMU at a time
+READ_SIZE = 64 * 1024
+
+
+def _format_value(value) -> str:
+    if isinstance(value, bool):
+        return "on" if value else "off"
+    return str(value).replace(",", ",,")
+
+
+def format_options(value: str = None, **props) -> str:
+    """Formats a QEMU option value, e.g. `format_options("socket", id="chrtpm")` is `socket,id=chrtpm`.
+
+    Property values of True and False are written as `on` and `off`, None writes the bare property name (e.g.
+    `+sse` or `server`) and a list repeats the property for each item. Commas in property values are escaped.
+    """
+    parts = [] if value is None else [str(value)]
+    for name, prop in props.items():
+        for item in (prop if isinstance(prop, list) else [prop]):
+            parts.append(name if item is None else f"{name}={_format_value(item)}")
+    return ",".join(parts)
+
+
+@dataclass
+class QemuConfig:
+    """A QEMU machine configuration that serializes to an argument list, without any shell quoting.
+
+    Attributes:
+        executable (str): The QEMU binary
+        machine (str): The machine type, e.g. `q35`
+        machine_options (dict): The machine properties, e.g. `{"smm": "on"}`
+        cpu (str): The CPU model
+        cpu_options (dict): The CPU properties and flags, e.g. `{"rdrand": "on", "+sse": None}`
+        memory (int): The memory size in MB
+        smp (int): The number of CPUs
+        options (list[list[str]]): Every other option in order, as `[option, value]` pairs without the leading dash
+    """
+    executable: str
+    machine: str = None
+    machine_options: dict = field(default_factory=dict)
+    cpu: str = None
+    cpu_options: dict = field(default_factory=dict)
+    memory: int = None
+    smp: int = None
+    options: list = field(default_factory=list)
+
+    def add(self, option: str, value: str = None, **props) -> "QemuConfig":
+        """Adds an option, e.g. `add("chardev", "socket", id="chrtpm", path=sock)`. See `format_options`."""
+        formatted = format_options(value, **props)
+        self.options.append([option, formatted] if value is not None or props else [option])
+        return self
+
+    def add_drive(self, interface: str = None, **props) -> "QemuConfig":
+        """Adds a drive. `interface` is the `if` property, e.g. `pflash` or `virtio`."""
+        if interface is not None:
+            props = {"if": interface, **props}
+        return self.add("drive", **props)
+
+    def add_device(self, driver: str, **props) -> "QemuConfig":
+        """Adds a device, e.g. `add_device("usb-tablet", id="input0", bus="usb.0", port=1)`."""
+        return self.add("device", driver, **props)
+
+    def add_global(self, driver: str, prop: str, value) -> "QemuConfig":
+        """Sets the default value of a device property, e.g. `add_global("ICH9-LPC", "disable_s3", 1)`."""
+        return self.add("global", f"{driver}.{prop}={_format_value(value)}")
+
+    def add_smbios(self, table_type: int, **props) -> "QemuConfig":
+        """Adds SMBIOS table fields, e.g. `add_smbios(1, manufacturer="Palindrome")`."""
+        return self.add("smbios", type=table_type, **props)
+
+    def add_firmware_smbios(self, repo_version: str, code_fd: PathLike) -> "QemuConfig":
+        """Adds the SMBIOS type 0 (BIOS information) table shared by the platforms, dated by the code FD."""
+        creation_date = datetime.datetime.fromtimestamp(Path(code_fd).stat().st_ctime).strftime("%m/%d/%Y")
+        return self.add_smbios(0, vendor="Project Mu", version=f"mu_tiano_platforms-{repo_version}",
+                               date=creation_date, uefi="on")
+
+    def argv(self) -> list[str]:
+        """Returns the QEMU command as an argument list."""
+        argv = [str(self.executable)]
+        if self.machine is not None:
+            argv += ["-machine", format_options(self.machine, **self.machine_options)]
+        if self.cpu is not None:
+            argv += ["-cpu", format_options(self.cpu, **self.cpu_options)]
+        if self.memory is not None:
+            argv += ["-m", str(self.memory)]
+        if self.smp is not None:
+            argv += ["-smp", str(self.smp)]
+        for option in self.options:
+            argv += [f"-{option[0]}"] + option[1:]
+        return argv
+
+    def command_line(self) -> str:
+        """Returns the QEMU command as a string for logging or running it by hand."""
+        if os.name == 'nt':
+            return subprocess.list2cmdline(self.argv())
+        return shlex.join(self.argv())
+
+    def save(self, path: PathLike):
+        """Saves the configuration so it can be replayed with `load`."""
+        with open(path, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+
+    @staticmethod
+    def load(path: PathLike) -> "QemuConfig":
+        """Loads a configuration saved with `save`."""
+        with open(path, "r") as f:
+            return QemuConfig(**json.load(f))
+
+
+def run_qemu(config: QemuConfig, qemu_version: list[str], sink: OutputSink = None, monitor: ConsoleMonitor = None,
+             watchdog: Watchdog = None, snapshot: VmSnapshot = None, profiler: BootProfiler = None) -> int:
+    """Runs QEMU and returns its exit code, passing its console output to the sink and the listeners of the run.
+
+    The console state QEMU changes is restored once it exits, and known benign exit codes are reported as success.
+    If a trigger of the console monitor ends the run, QEMU is killed and the exit code is provided by the monitor.
+    If the watchdog ends the run, the exit code is WATCHDOG_EXIT_CODE.
+
+    Args:
+        config (QemuConfig): The QEMU configuration
+        qemu_version (list[str]): The version of the QEMU binary
+        sink (OutputSink): Receives the console output, closed once QEMU exits. By default every line is logged.
+        monitor (ConsoleMonitor): Watches the output for triggers that end the run
+        watchdog (Watchdog): Shuts QEMU down if the run takes too long or its output stops
+        snapshot (VmSnapshot): Restores or takes a VM snapshot at the UEFI shell, then runs the tests
+        profiler (BootProfiler): Timestamps the output to measure the boot phases
+    """
+    if sink is None:
+        sink = OutputSink()
+
+    ## TODO: Save the console mode. The original issue comes from: https://gitlab.com/qemu-project/qemu/-/issues/1674
+    std_handle = None
+    if os.name == 'nt' and qemu_version[0] >= '8':
+        import win32console
+        std_handle = win32console.GetStdHandle(win32console.STD_INPUT_HANDLE)
+        try:
+            console_mode = std_handle.GetConsoleMode()
+        except Exception:
+            std_handle = None
+
+    if watchdog is not None:
+        watchdog.configure(config)
+    if snapshot is not None:
+        snapshot.configure(config, qemu_version)
+
+    def feed(lines: list[str]) -> bool:
+        """Passes lines to the listeners, returning False once the monitor ends the run."""
+        for line in lines:
+            if watchdog is not None:
+                watchdog.feed(line)
+            if snapshot is not None:
+                snapshot.feed(line)
+            if profiler is not None:
+                profiler.feed(line)
+            if monitor is not None and monitor.feed(line) is not None:
+                return False
+        return True
+
+    logging.info(f"Running QEMU: {config.command_line()}")
+    start_time = datetime.datetime.now()
+    if profiler is not None:
+        profiler.begin()
+    process = subprocess.Popen(config.argv(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if watchdog is not None:
+        watchdog.start(process)
+    if snapshot is not None:
+        snapshot.start(process)
+    try:
+        # Read whatever output is available rather than line by line, the sink splits it into lines
+        while data := process.stdout.read1(READ_SIZE):
+            if not feed(sink.write(data)):
+                process.kill()
+                break
+        ret = process.wait()
+    except KeyboardInterrupt:
+        logging.critical("QEMU run interrupted by user (ctrl+c).")
+        process.kill()
+        process.wait()
+        ret = -1
+    finally:
+        process.stdout.close()
+        feed(sink.close())
+        if watchdog is not None:
+            watchdog.stop()
+        if snapshot is not None:
+            snapshot.stop()
+        if profiler is not None:
+            profiler.finish()
+    logging.info(f"QEMU exited with {ret} after {datetime.datetime.now() - start_time}.")
+    if watchdog is not None and watchdog.expired is not None:
+        watchdog.report()
+        sink.log_tail()
+        ret = WATCHDOG_EXIT_CODE
+    elif monitor is not None and monitor.triggered is not None:
+        monitor.report()
+        ret = monitor.exit_code(ret)
+        if ret != 0:
+            sink.log_tail()
+    elif ret != 0 and sink.forward is not None:
+        # Not every line was logged, so show how the run ended
+        sink.log_tail()
+
+    ## TODO: restore the customized RunCmd once unit tests with asserts are figured out
+    if ret == 0xc0000005:
+        ret = 0
+
+    ## TODO: remove this once we upgrade to newer QEMU
+    if ret == 0x8B and qemu_version[0] == '4':
+        # QEMU v4 will return segmentation fault when shutting down.
+        # Tested same FDs on QEMU 6 and 7, not observing the same.
+        ret = 0
+
+    if os.name == 'nt' and std_handle is not None:
+        # Restore the console mode for Windows on QEMU v8+.
+        std_handle.SetConsoleMode(console_mode)
+    elif os.name != 'nt':
+        # Linux version of QEMU will mess with the print if its run failed, let's just restore it anyway
+        utility_functions.RunCmd('stty', 'sane', capture=False)
+
+    return ret
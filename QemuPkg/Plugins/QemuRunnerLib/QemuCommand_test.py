@@ -0,0 +1,60 @@
+##
+# Tests that run_qemu drives the listeners of a run.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Put on the python path by FileUtils_path_env.yaml during a build
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "FileUtils"))
+
+from QemuCommand import QemuConfig, run_qemu  # noqa: E402
+
+
+class FakeSnapshot:
+    """Records the calls run_qemu makes to a VmSnapshot."""
+
+    def __init__(self):
+        self.calls = []
+        self.process = None
+        self.lines = []
+
+    def configure(self, config, qemu_version):
+        self.calls.append("configure")
+
+    def start(self, process):
+        self.calls.append("start")
+        self.process = process
+
+    def feed(self, line):
+        self.lines.append(line)
+
+    def stop(self):
+        self.calls.append("stop")
+
+
+class RunQemuTest(unittest.TestCase):
+
+    def run_python(self, script: str, **listeners) -> int:
+        # The Python interpreter stands in for QEMU, `-c` runs the script
+        config = QemuConfig(sys.executable)
+        config.add("c", script)
+        return run_qemu(config, ["8", "2", "0"], **listeners)
+
+    def test_snapshot_is_started(self):
+        snapshot = FakeSnapshot()
+        ret = self.run_python("print('Shell>')", snapshot=snapshot)
+
+        self.assertEqual(ret, 0)
+        self.assertEqual(snapshot.calls, ["configure", "start", "stop"])
+        self.assertIsNotNone(snapshot.process)
+        self.assertEqual(snapshot.lines, ["Shell>"])
+
+
+if __name__ == "__main__":
+    unittest.main()
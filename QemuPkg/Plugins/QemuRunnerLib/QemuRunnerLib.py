@@ -0,0 +1,205 @@
+##
+# This plugin provides the QEMU support shared by the platform QEMU runners.
+#
+# The modules in this directory can be imported by the runners once this plugin is loaded, as the plugin manager
+# adds the directory of each plugin to the module search path.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import logging
+import os
+
+from os import PathLike
+from pathlib import Path
+
+from edk2toolext.environment.plugintypes.uefi_helper_plugin import IUefiHelperPlugin
+
+from BootProfiler import BootProfiler
+from ConsoleMonitor import ConsoleMonitor, load_triggers
+from OutputSink import DEFAULT_TAIL_LINES, OutputSink
+from QemuCapabilities import QemuCapabilities
+from Snapshot import DEFAULT_READY_PATTERN, VmSnapshot
+from SwTpm import SwTpm
+from TpmState import TpmStateStore
+from Watchdog import Watchdog
+
+
+class QemuRunnerLib(IUefiHelperPlugin):
+    def RegisterHelpers(self, obj):
+        fp = str(Path(__file__).absolute())
+        obj.Register("get_qemu_capabilities", QemuRunnerLib.get_qemu_capabilities, fp)
+        obj.Register("create_output_sink", QemuRunnerLib.create_output_sink, fp)
+        obj.Register("create_console_monitor", QemuRunnerLib.create_console_monitor, fp)
+        obj.Register("create_watchdog", QemuRunnerLib.create_watchdog, fp)
+        obj.Register("create_snapshot", QemuRunnerLib.create_snapshot, fp)
+        obj.Register("create_swtpm", QemuRunnerLib.create_swtpm, fp)
+        obj.Register("create_boot_profiler", QemuRunnerLib.create_boot_profiler, fp)
+        obj.Register("write_boot_profile", QemuRunnerLib.write_boot_profile, fp)
+        return 0
+
+    @staticmethod
+    def get_qemu_capabilities(env, executable: str) -> QemuCapabilities | None:
+        """Returns the version and capabilities of a QEMU binary, cached in the build output.
+
+        Args:
+            env (VarDict): The build environment
+            executable (str): The QEMU binary
+        """
+        return QemuCapabilities.probe(executable, capability_cache_path(env))
+
+    @staticmethod
+    def create_output_sink(env) -> OutputSink:
+        """Returns the sink for the console output of a QEMU run.
+
+        The raw output is written to `QEMU_CONSOLE_LOG`, if set, compressed with `QEMU_CONSOLE_COMPRESSION` (`gzip`
+        or `zstd`). Only the lines matching the `QEMU_CONSOLE_FILTER` regular expression are logged, by default
+        every line without a console log and failures, the shell boot and the CPU brand name with one.
+        `QEMU_CONSOLE_TAIL_LINES` is the number of console lines reported when a run fails.
+
+        Args:
+            env (VarDict): The build environment
+        """
+        return OutputSink(env.GetValue("QEMU_CONSOLE_LOG"), env.GetValue("QEMU_CONSOLE_COMPRESSION"),
+                          int(env.GetValue("QEMU_CONSOLE_TAIL_LINES", DEFAULT_TAIL_LINES)),
+                          env.GetValue("QEMU_CONSOLE_FILTER"))
+
+    @staticmethod
+    def create_console_monitor(env) -> ConsoleMonitor | None:
+        """Returns a monitor for the console output of a QEMU run, or None if `QEMU_CONSOLE_TRIGGERS` is not set.
+
+        Monitoring is opt-in, as unit tests may assert on purpose. `QEMU_CONSOLE_TRIGGERS=DEFAULT` ends the run on an
+        ASSERT or a CPU exception, any other value is a JSON file of triggers.
+
+        Args:
+            env (VarDict): The build environment
+
+        Raises:
+            (OSError): The triggers file cannot be read
+            (ValueError): The triggers file is invalid
+        """
+        triggers_file = env.GetValue("QEMU_CONSOLE_TRIGGERS")
+        if not triggers_file:
+            return None
+        if triggers_file.upper() == "DEFAULT":
+            return ConsoleMonitor()
+        return ConsoleMonitor(load_triggers(triggers_file))
+
+    @staticmethod
+    def create_watchdog(env) -> Watchdog | None:
+        """Returns a watchdog for a QEMU run, or None if no timeout is configured.
+
+        `QEMU_TIMEOUT` is the number of seconds the run may take and `QEMU_IDLE_TIMEOUT` the number of seconds it
+        may go without console output. A value of 0 disables the timeout.
+
+        Args:
+            env (VarDict): The build environment
+        """
+        timeout = float(env.GetValue("QEMU_TIMEOUT", 0)) or None
+        idle_timeout = float(env.GetValue("QEMU_IDLE_TIMEOUT", 0)) or None
+        if timeout is None and idle_timeout is None:
+            return None
+        return Watchdog(timeout, idle_timeout)
+
+    @staticmethod
+    def create_snapshot(env, executable: str, firmware: list[PathLike], var_store: PathLike,
+                        drive: PathLike) -> VmSnapshot | None:
+        """Returns the VM snapshot support for a QEMU run, or None if `QEMU_SNAPSHOT` is not enabled.
+
+        Snapshots are kept in `BUILD_OUTPUT_BASE/QemuSnapshots`. `QEMU_SNAPSHOT_READY` overrides the console output
+        that shows the UEFI shell is starting. Runs that attach other drives, boot an OS or run on Windows do not
+        use snapshots, as the tests could not be started from a known file system.
+
+        Args:
+            env (VarDict): The build environment
+            executable (str): The QEMU binary, whose qemu-img is used to create the variable store image
+            firmware (list[PathLike]): The firmware files the snapshot depends on, e.g. the code FD
+            var_store (PathLike): The raw variable store
+            drive (PathLike): The virtual drive with `startup.nsh`
+        """
+        if str(env.GetValue("QEMU_SNAPSHOT", "FALSE")).upper() != "TRUE":
+            return None
+        if os.name == 'nt':
+            logging.warning("QEMU_SNAPSHOT is not supported on Windows.")
+            return None
+        for name in ("PATH_TO_OS", "DFCI_FILES", "DFCI_VAR_STORE", "INSTALL_FILES"):
+            if env.GetValue(name) is not None:
+                logging.warning(f"QEMU_SNAPSHOT is not supported with {name}.")
+                return None
+
+        qemu_img = Path(executable).parent / "qemu-img"
+        return VmSnapshot(Path(env.GetValue("BUILD_OUTPUT_BASE"), "QemuSnapshots"), firmware, var_store, drive,
+                          str(qemu_img) if qemu_img.is_file() else "qemu-img",
+                          env.GetValue("QEMU_SNAPSHOT_READY", DEFAULT_READY_PATTERN))
+
+    @staticmethod
+    def create_swtpm(env, device: str, firmware: list[PathLike]) -> SwTpm | None:
+        """Returns the TPM emulator of a QEMU run, or None if `SWTPM_ENABLE` is disabled or on Windows.
+
+        The TPM state is kept in `SWTPM_STATE_DIR` if set, otherwise in a temporary directory of the run. With
+        `SWTPM_GOLDEN_STATE` enabled, a run without a TPM state starts from the golden state of the firmware build,
+        kept in `BUILD_OUTPUT_BASE/SwTpmStates` and captured from the first successful run of the build that does not
+        run tests or a startup script, which could leave changes in the TPM, e.g. NV indices or a cleared hierarchy.
+
+        Args:
+            env (VarDict): The build environment
+            device (str): The TPM device of the machine, e.g. `tpm-tis`
+            firmware (list[PathLike]): The firmware files the golden state depends on, e.g. the code FD
+        """
+        if os.name == 'nt' or str(env.GetValue("SWTPM_ENABLE", "TRUE")).upper() != "TRUE":
+            return None
+
+        golden = None
+        if str(env.GetValue("SWTPM_GOLDEN_STATE", "FALSE")).upper() == "TRUE":
+            golden = TpmStateStore(Path(env.GetValue("BUILD_OUTPUT_BASE"), "SwTpmStates"), firmware, device)
+        runs_tests = str(env.GetValue("RUN_TESTS", "FALSE")).upper() == "TRUE" or bool(env.GetValue("STARTUP_NSH"))
+        return SwTpm(env.GetValue("SWTPM_STATE_DIR"), device, golden=golden, capture_golden=not runs_tests)
+
+    @staticmethod
+    def create_boot_profiler(env) -> BootProfiler | None:
+        """Returns the boot profiler of a QEMU run, or None if `QEMU_BOOT_PROFILE` is not set.
+
+        Profiling is opt-in, as every profiled run writes its reports over those of the previous run.
+
+        Args:
+            env (VarDict): The build environment
+        """
+        if str(env.GetValue("QEMU_BOOT_PROFILE", "FALSE")).upper() in ("", "FALSE"):
+            return None
+        return BootProfiler()
+
+    @staticmethod
+    def write_boot_profile(env, profiler: BootProfiler | None, config, qemu_version: list[str],
+                           snapshot: VmSnapshot = None):
+        """Writes the boot phase timing of a QEMU run as JSON, if the run was profiled.
+
+        The report is written to `QEMU_BOOT_PROFILE` if it is a path. With `QEMU_BOOT_PROFILE=TRUE` it is written to
+        `BootProfile.json` next to `QEMU_CONSOLE_LOG` or in `BUILD_OUTPUT_BASE`. It records the firmware version,
+        target, QEMU version and command, so reports of different commits and configurations can be compared.
+
+        Args:
+            env (VarDict): The build environment
+            profiler (BootProfiler | None): The profiler of the run, None if it was not profiled
+            config (QemuConfig): The QEMU configuration of the run
+            qemu_version (list[str]): The version of the QEMU binary
+            snapshot (VmSnapshot): The VM snapshot support of the run, if used
+        """
+        if profiler is None:
+            return
+        path = env.GetValue("QEMU_BOOT_PROFILE")
+        if path.upper() == "TRUE":
+            console_log = env.GetValue("QEMU_CONSOLE_LOG")
+            base = Path(console_log).parent if console_log else Path(env.GetValue("BUILD_OUTPUT_BASE"))
+            path = base / "BootProfile.json"
+        try:
+            profiler.write(path, firmware_version=env.GetValue("VERSION", "Unknown"), target=env.GetValue("TARGET"),
+                           qemu_version=".".join(qemu_version), command=config.argv(),
+                           snapshot_restored=snapshot is not None and snapshot.restoring)
+        except OSError as e:
+            logging.warning(f"Failed to write the boot profile to {path}. {e}")
+
+
+def capability_cache_path(env) -> Path:
+    """The cache of QEMU capabilities, shared by all build targets of the platform."""
+    return Path(env.GetValue("BUILD_OUTPUT_BASE")).parent / "QemuCapabilities.json"
@@ -0,0 +1,63 @@
+##
+# Tests which optional parts of a QEMU run the build environment enables.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import os
+import sys
+import tempfile
+import unittest
+
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Put on the python path by FileUtils_path_env.yaml during a build
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "FileUtils"))
+
+from QemuCommand import QemuConfig  # noqa: E402
+from QemuRunnerLib import QemuRunnerLib  # noqa: E402
+
+
+class FakeEnv:
+
+    def __init__(self, **values):
+        self.values = values
+
+    def GetValue(self, name, default=None):
+        return self.values.get(name, default)
+
+
+class BootProfileTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp = Path(temp_dir.name)
+
+    def profile(self, **values) -> list[str]:
+        """Profiles an empty run and returns the files written to the build output."""
+        env = FakeEnv(BUILD_OUTPUT_BASE=str(self.temp), **values)
+        profiler = QemuRunnerLib.create_boot_profiler(env)
+        if profiler is not None:
+            profiler.begin()
+            profiler.finish()
+        QemuRunnerLib.write_boot_profile(env, profiler, QemuConfig("qemu-system-x86_64"), ["8", "2", "0"])
+        return sorted(path.name for path in self.temp.iterdir())
+
+    def test_disabled_by_default(self):
+        self.assertEqual(self.profile(), [])
+        self.assertEqual(self.profile(QEMU_BOOT_PROFILE="FALSE"), [])
+
+    def test_default_location(self):
+        self.assertEqual(self.profile(QEMU_BOOT_PROFILE="TRUE"),
+                         ["BootProfile.drivers.txt", "BootProfile.folded", "BootProfile.json"])
+
+    def test_path(self):
+        self.assertEqual(self.profile(QEMU_BOOT_PROFILE=str(self.temp / "Boot.json")),
+                         ["Boot.drivers.txt", "Boot.folded", "Boot.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+##
+# A minimal client for the QEMU Machine Protocol (QMP).
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import json
+import socket
+import time
+
+from os import PathLike
+
+
+class QmpError(Exception):
+    """A QMP command failed or QEMU could not be reached."""
+
+
+class QmpClient:
+    """Sends commands to QEMU over a QMP unix socket, e.g. one added with `-qmp unix:<path>,server=on,wait=off`.
+
+    Asynchronous events received while waiting for a response are kept in `events`.
+    """
+
+    def __init__(self):
+        self._socket = None
+        self._file = None
+        self.events = []
+
+    def connect(self, path: PathLike, timeout: float = 10.0) -> "QmpClient":
+        """Connects to the QMP socket and negotiates capabilities, retrying until QEMU has created the socket.
+
+        Raises:
+            (QmpError): QEMU could not be reached within `timeout` seconds
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(timeout)
+                sock.connect(str(path))
+                break
+            except OSError as e:
+                sock.close()
+                if time.monotonic() >= deadline:
+                    raise QmpError(f"Failed to connect to QMP at {path}. {e}")
+                time.sleep(0.1)
+
+        self._socket = sock
+        self._file = sock.makefile("rb")
+        greeting = self._receive()
+        if "QMP" not in greeting:
+            self.close()
+            raise QmpError(f"Unexpected QMP greeting: {greeting}")
+        self.execute("qmp_capabilities")
+        return self
+
+    def execute(self, command: str, **arguments):
+        """Runs a QMP command and returns its result.
+
+        Raises:
+            (QmpError): The command failed or the connection was lost
+        """
+        if self._socket is None:
+            raise QmpError("QMP is not connected.")
+        request = {"execute": command}
+        if arguments:
+            request["arguments"] = arguments
+        try:
+            self._socket.sendall(json.dumps(request).encode() + b"\n")
+        except OSError as e:
+            raise QmpError(f"Failed to send QMP command {command}. {e}")
+
+        while True:
+            response = self._receive()
+            if "event" in response:
+                self.events.append(response)
+                continue
+            if "error" in response:
+                raise QmpError(f"QMP command {command} failed: {response['error'].get('desc', response['error'])}")
+            return response.get("return")
+
+    @property
+    def timeout(self) -> float | None:
+        """The seconds to wait for QEMU to respond, or None to wait until it does."""
+        return self._socket.gettimeout() if self._socket is not None else None
+
+    @timeout.setter
+    def timeout(self, timeout: float | None):
+        if self._socket is not None:
+            self._socket.settimeout(timeout)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _receive(self) -> dict:
+        try:
+            line = self._file.readline()
+        except OSError as e:
+            raise QmpError(f"Failed to read from QMP. {e}")
+        if not line:
+            raise QmpError("QMP connection closed.")
+        try:
+            return json.loads(line)
+        except ValueError:
+            raise QmpError(f"Invalid QMP message: {line!r}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,77 @@
+##
+# Named QEMU run profiles, which trade emulated CPU features and devices for boot speed.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import logging
+
+from dataclasses import dataclass, field
+
+
+# The default profile, which keeps the machine QEMU has always been run with
+DEFAULT_PROFILE = "default"
+
+# The QEMU major version that added each CPU option
+CPU_OPTION_VERSIONS = {"pauth-impdef": 6}
+
+
+@dataclass
+class RunProfile:
+    """The CPU, machine and accelerator settings of a QEMU run.
+
+    Attributes:
+        name (str): The name the profile is selected by
+        description (str): What the profile is for
+        cpu (str): The CPU model
+        cpu_options (dict): The CPU options, e.g. `{"sve": "off"}`
+        machine_options (dict): The machine options, e.g. `{"mte": "on"}`
+        accel_options (dict | None): The options of `-accel tcg`, e.g. `{"thread": "multi"}`, or None for the QEMU
+            default
+        smp (int): The number of cores
+    """
+    name: str
+    description: str
+    cpu: str = "max"
+    cpu_options: dict = field(default_factory=dict)
+    machine_options: dict = field(default_factory=dict)
+    accel_options: dict | None = None
+    smp: int = 4
+
+    def apply(self, config, qemu_version: list[str]):
+        """Sets the CPU, machine and accelerator of a QemuConfig.
+
+        CPU options the QEMU version does not support are left out with a warning.
+        """
+        config.cpu = self.cpu
+        config.cpu_options = dict(self.cpu_options)
+        for option, version in CPU_OPTION_VERSIONS.items():
+            if option in config.cpu_options and int(qemu_version[0]) < version:
+                logging.warning(f"QEMU {'.'.join(qemu_version)} does not support the {option} CPU option, "
+                                f"it requires QEMU {version}.0.")
+                del config.cpu_options[option]
+        config.machine_options.update(self.machine_options)
+
+        config.smp = self.smp
+        if self.accel_options is not None:
+            config.add("accel", "tcg", **self.accel_options)
+
+
+_ARM_VIRT_MACHINE = {"secure": "on", "virtualization": "on", "gic-version": 3}
+
+ARM_VIRT_PROFILES = {profile.name: profile for profile in [
+    RunProfile(DEFAULT_PROFILE, "The full machine with MTE and an SMMUv3, using the QEMU default TCG settings",
+               cpu_options={"sve": "off", "sme": "off"},
+               machine_options={**_ARM_VIRT_MACHINE, "mte": "on", "iommu": "smmuv3"}),
+    RunProfile("fast", "Boots fastest: no MTE or SMMU, cheap pointer authentication, two cores, multi-threaded TCG",
+               cpu_options={"sve": "off", "sme": "off", "pauth-impdef": "on"},
+               machine_options=dict(_ARM_VIRT_MACHINE),
+               accel_options={"thread": "multi", "tb-size": 1024},
+               smp=2),
+    RunProfile("full-security", "The full machine with architected pointer authentication, MTE and an SMMUv3, "
+               "using multi-threaded TCG",
+               cpu_options={"sve": "off", "sme": "off"},
+               machine_options={**_ARM_VIRT_MACHINE, "mte": "on", "iommu": "smmuv3"},
+               accel_options={"thread": "multi", "tb-size": 1024}),
+]}
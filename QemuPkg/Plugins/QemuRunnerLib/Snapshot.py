@@ -0,0 +1,262 @@
+##
+# Boots QEMU from a VM snapshot taken at the UEFI shell, so repeated runs skip SEC, PEI, DXE and BDS.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from os import PathLike
+from pathlib import Path
+
+from edk2toollib.utility_functions import RunCmd
+
+from FileUtils import hash_file
+from Qmp import QmpClient, QmpError
+
+
+# The name of the VM snapshot inside the variable store image
+SNAPSHOT_TAG = "fast-start"
+
+# Bump when the way snapshots are taken changes, so older snapshots are taken again
+SNAPSHOT_VERSION = 1
+
+# The debug output of BDS launching the UEFI shell
+DEFAULT_READY_PATTERN = r"\[Bds\] ?Booting .*Shell"
+
+# Seconds without console output after the ready line before the shell is considered idle
+SETTLE_TIME = 3.0
+
+# Seconds the firmware is given to enumerate the hot-plugged test drive
+HOTPLUG_DELAY = 3.0
+
+# Seconds the first boot may take to reach the UEFI shell
+READY_TIMEOUT = 600.0
+
+# Seconds QEMU may take to save the snapshot, which includes the whole guest memory
+SAVE_TIMEOUT = 600.0
+
+DRIVE_NODE = "snapshot-drive"
+DRIVE_DEVICE = "snapshot-disk"
+
+# QEMU key codes of the characters typed into the UEFI shell
+_KEYS = {" ": ["spc"], "\n": ["ret"], ":": ["shift", "semicolon"], "\\": ["backslash"], ".": ["dot"],
+         "-": ["minus"], "_": ["shift", "minus"], "/": ["slash"]}
+
+
+def _keys(char: str) -> list[str]:
+    if char in _KEYS:
+        return _KEYS[char]
+    if char.isupper():
+        return ["shift", char.lower()]
+    return [char]
+
+
+class VmSnapshot:
+    """Takes a VM snapshot once a QEMU run reaches the UEFI shell and restores it in later runs.
+
+    The snapshot is saved in a qcow2 image of the variable store, which QEMU uses in place of the raw variable
+    store. QEMU requires every writable drive of a snapshot to be qcow2, so the virtual drive with the tests is not
+    attached when QEMU starts. It is hot-plugged as a USB drive once the shell is idle and `startup.nsh` is run from
+    it, in the first run right after the snapshot is taken and in later runs right after it is restored.
+
+    A snapshot is only restored by runs with the same firmware, QEMU version and machine configuration. It is kept
+    in `snapshot_dir` named after a hash of those, so a new snapshot is taken whenever one of them changes.
+
+    Attributes:
+        snapshot_dir (Path): The directory the snapshot is kept in
+        firmware (list[Path]): The firmware files the snapshot depends on, e.g. the code FD
+        var_store (Path): The raw variable store the first run starts from
+        image (Path): The qcow2 variable store image the run uses
+        drive (Path): The virtual drive with `startup.nsh`, an image file or a directory
+        qemu_img (str): The qemu-img binary
+        ready_pattern (str): The console output that shows the UEFI shell is starting
+        restoring (bool): Whether the run restores the snapshot, once configured
+    """
+
+    def __init__(self, snapshot_dir: PathLike, firmware: list[PathLike], var_store: PathLike, drive: PathLike,
+                 qemu_img: str = "qemu-img", ready_pattern: str = DEFAULT_READY_PATTERN):
+        self.snapshot_dir = Path(snapshot_dir)
+        self.firmware = [Path(path) for path in firmware]
+        self.var_store = Path(var_store)
+        self.image = self.var_store.with_suffix(".qcow2")
+        self.drive = Path(drive)
+        self.qemu_img = qemu_img
+        self.ready_pattern = re.compile(ready_pattern)
+        self.restoring = False
+        self._attached = False
+        self._key = None
+        self._qmp_dir = None
+        self._qmp_path = None
+        self._process = None
+        self._ready = threading.Event()
+        self._last_output = time.monotonic()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def snapshot_path(self) -> Path:
+        return self.snapshot_dir / f"{self._key}.qcow2"
+
+    def key(self, config, qemu_version: list[str]) -> str:
+        """Returns the hash that identifies the snapshot of a configuration.
+
+        It covers the firmware files, the initial variable store, the QEMU version, and the machine and devices of
+        the configuration, which must match for QEMU to restore the snapshot. File paths are not included, so
+        runs with copies of the same files, such as test shards, share the snapshot.
+        """
+        devices = [option for option in config.options if option[0] in ("device", "global", "smbios")]
+        identity = {
+            "version": SNAPSHOT_VERSION,
+            "qemu": qemu_version,
+            "firmware": [hash_file(path) for path in self.firmware + [self.var_store]],
+            "machine": [config.machine, config.machine_options, config.cpu, config.cpu_options, config.memory,
+                        config.smp],
+            "devices": devices,
+        }
+        return hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()[:32]
+
+    def configure(self, config, qemu_version: list[str]):
+        """Prepares the variable store image and adds the snapshot and QMP options to a QemuConfig.
+
+        The variable store drive of the configuration must already use `image` with the qcow2 format.
+        """
+        self._key = self.key(config, qemu_version)
+        self.image.unlink(missing_ok=True)
+        self.restoring = self.snapshot_path.is_file()
+        if self.restoring:
+            logging.info(f"Restoring the VM snapshot {self.snapshot_path}.")
+            shutil.copyfile(self.snapshot_path, self.image)
+            config.add("loadvm", SNAPSHOT_TAG)
+        else:
+            logging.info(f"No VM snapshot for this firmware, one is taken at the UEFI shell in {self.snapshot_path}.")
+            ret = RunCmd(self.qemu_img, f'convert -f raw -O qcow2 "{self.var_store}" "{self.image}"',
+                         logging_level=logging.DEBUG)
+            if ret != 0:
+                raise RuntimeError(f"Failed to create the variable store image {self.image}.")
+
+        self._qmp_dir = tempfile.mkdtemp(prefix="qemu-snapshot-")
+        self._qmp_path = os.path.join(self._qmp_dir, "qmp.sock")
+        config.add("qmp", f"unix:{self._qmp_path}", server="on", wait="off")
+
+    def start(self, process: subprocess.Popen):
+        """Takes or restores the snapshot and starts the tests while QEMU runs."""
+        self._process = process
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def feed(self, line: str):
+        """Records console output, to detect when the UEFI shell is idle."""
+        self._last_output = time.monotonic()
+        if not self._ready.is_set() and self.ready_pattern.search(line):
+            self._ready.set()
+
+    def stop(self):
+        """Stops once QEMU has exited and removes the QMP socket."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._qmp_dir is not None:
+            shutil.rmtree(self._qmp_dir, ignore_errors=True)
+            self._qmp_dir = None
+        if self.restoring and not self._attached:
+            # e.g. the snapshot was taken by a QEMU build that cannot restore it
+            logging.warning(f"QEMU failed after restoring {self.snapshot_path}, it is taken again in the next run.")
+            self.snapshot_path.unlink(missing_ok=True)
+
+    def _running(self) -> bool:
+        return not self._stopped.is_set() and self._process.poll() is None
+
+    def _run(self):
+        try:
+            with QmpClient().connect(self._qmp_path) as qmp:
+                if not self.restoring:
+                    if not self._wait_for_shell():
+                        return
+                    self._save(qmp)
+                self._attach_drive(qmp)
+                self._wait(HOTPLUG_DELAY)
+                self._type(qmp, "map -r\n")
+                self._wait(1.0)
+                self._type(qmp, "fs0:\\startup.nsh\n")
+        except QmpError as e:
+            if self._running():
+                logging.error(f"Failed to control QEMU through QMP. {e}")
+
+    def _wait(self, seconds: float) -> bool:
+        return not self._stopped.wait(seconds) and self._running()
+
+    def _wait_for_shell(self) -> bool:
+        """Waits until the UEFI shell has started and the console is idle."""
+        deadline = time.monotonic() + READY_TIMEOUT
+        while not self._ready.wait(1.0):
+            if not self._running():
+                return False
+            if time.monotonic() >= deadline:
+                logging.error("QEMU did not reach the UEFI shell, no VM snapshot is taken.")
+                return False
+        while time.monotonic() - self._last_output < SETTLE_TIME:
+            if not self._wait(0.5):
+                return False
+        return self._running()
+
+    def _save(self, qmp: QmpClient):
+        qmp.execute("stop")
+        try:
+            # savevm writes the whole guest memory to the image, which can take much longer than other commands
+            timeout = qmp.timeout
+            qmp.timeout = SAVE_TIMEOUT
+            error = qmp.execute("human-monitor-command", **{"command-line": f"savevm {SNAPSHOT_TAG}"})
+            qmp.timeout = timeout
+            if error:
+                logging.warning(f"Failed to take a VM snapshot. {error.strip()}")
+            else:
+                self._keep()
+        finally:
+            # Never leave the guest paused, the run would hang
+            qmp.execute("cont")
+
+    def _keep(self):
+        """Copies the variable store image with the new snapshot to `snapshot_path`."""
+        staging = None
+        try:
+            self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+            # Unique per run, test shards run in the same process and may take the snapshot at the same time
+            fd, staging = tempfile.mkstemp(dir=self.snapshot_dir, suffix=".tmp")
+            os.close(fd)
+            shutil.copyfile(self.image, staging)
+            os.replace(staging, self.snapshot_path)
+        except OSError as e:
+            logging.warning(f"Failed to keep the VM snapshot {self.snapshot_path}. {e}")
+            if staging is not None:
+                Path(staging).unlink(missing_ok=True)
+            return
+
+        for stale in self.snapshot_dir.glob("*.qcow2"):
+            if stale != self.snapshot_path:
+                stale.unlink(missing_ok=True)
+        logging.info(f"Saved the VM snapshot {self.snapshot_path}.")
+
+    def _attach_drive(self, qmp: QmpClient):
+        if self.drive.is_dir():
+            node = {"driver": "vvfat", "node-name": DRIVE_NODE, "dir": str(self.drive), "rw": True}
+        else:
+            node = {"driver": "raw", "node-name": DRIVE_NODE,
+                    "file": {"driver": "file", "filename": str(self.drive)}}
+        qmp.execute("blockdev-add", **node)
+        qmp.execute("device_add", driver="usb-storage", bus="usb.0", drive=DRIVE_NODE, id=DRIVE_DEVICE)
+        self._attached = True
+
+    def _type(self, qmp: QmpClient, text: str):
+        for char in text:
+            qmp.execute("send-key", keys=[{"type": "qcode", "data": key} for key in _keys(char)])
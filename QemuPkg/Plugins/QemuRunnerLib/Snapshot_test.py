@@ -0,0 +1,89 @@
+##
+# Tests that taking a VM snapshot always resumes the guest.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Put on the python path by FileUtils_path_env.yaml during a build
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "FileUtils"))
+
+from Snapshot import SAVE_TIMEOUT, VmSnapshot  # noqa: E402
+
+
+class FakeQmp:
+    """Records the QMP commands and the timeout each one is sent with."""
+
+    def __init__(self):
+        self.timeout = 10.0
+        self.commands = []
+
+    def execute(self, command, **arguments):
+        self.commands.append((command, self.timeout))
+        return ""
+
+
+class VmSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp = Path(temp_dir.name)
+        (self.temp / "VARS.fd").write_bytes(b"vars")
+
+    def snapshot(self, name: str = "VARS.fd") -> VmSnapshot:
+        snapshot = VmSnapshot(self.temp / "Snapshots", [], self.temp / name, self.temp / "VirtualDrive")
+        snapshot._key = "key"
+        return snapshot
+
+    def test_save(self):
+        snapshot = self.snapshot()
+        snapshot.image.write_bytes(b"qcow2")
+        qmp = FakeQmp()
+        snapshot._save(qmp)
+
+        self.assertEqual(qmp.commands, [("stop", 10.0), ("human-monitor-command", SAVE_TIMEOUT), ("cont", 10.0)])
+        self.assertEqual(snapshot.snapshot_path.read_bytes(), b"qcow2")
+        self.assertEqual(list(snapshot.snapshot_dir.glob("*.tmp")), [])
+
+    def test_failed_copy_resumes_guest(self):
+        # The variable store image does not exist, so copying it fails
+        snapshot = self.snapshot()
+        qmp = FakeQmp()
+        with self.assertLogs(level="WARNING"):
+            snapshot._save(qmp)
+
+        self.assertEqual(qmp.commands[-1][0], "cont")
+        self.assertFalse(snapshot.snapshot_path.exists())
+        self.assertEqual(list(snapshot.snapshot_dir.glob("*.tmp")), [])
+
+    def test_concurrent_saves(self):
+        data = os.urandom(4 * 1024 * 1024)
+        snapshots = []
+        for index in range(4):
+            (self.temp / f"VARS{index}.fd").write_bytes(b"vars")
+            snapshot = self.snapshot(f"VARS{index}.fd")
+            snapshot.image.write_bytes(data)
+            snapshots.append(snapshot)
+
+        threads = [threading.Thread(target=snapshot._save, args=(FakeQmp(),)) for snapshot in snapshots]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(snapshots[0].snapshot_path.read_bytes(), data)
+        self.assertEqual(list(snapshots[0].snapshot_dir.glob("*.tmp")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+##
+# Runs a software TPM (swtpm) for a single QEMU instance.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import logging
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import tempfile
+import time
+
+from os import PathLike
+from pathlib import Path
+
+from TpmState import TpmStateStore, has_state
+
+
+# Seconds swtpm is given to accept commands on its control socket
+READY_TIMEOUT = 10.0
+
+# Seconds swtpm is given to exit, once after it is asked to shut down and once more after it is terminated
+SHUTDOWN_TIMEOUT = 5.0
+
+# swtpm control channel commands
+CMD_GET_CAPABILITY = 0x01
+CMD_SHUTDOWN = 0x03
+
+
+class SwTpm:
+    """Runs swtpm in its own process, with a control socket and TPM state that belong to one QEMU instance.
+
+    The control socket is created in a new temporary directory, so instances sharing a build output directory do
+    not collide and the socket path stays short enough for a unix socket. The TPM state is kept in `state_dir` if
+    one is given, e.g. to keep the TPM provisioned across runs, otherwise in a new temporary directory that is
+    removed with the socket once swtpm stops. With a `golden` store, a run without a TPM state starts from a clone of
+    the golden state of the firmware, and the state of a successful run that provisioned the TPM is captured as the
+    golden state if there is none yet.
+
+    QEMU must only be started once `start` returns, and `stop` must be called once QEMU has exited:
+
+        tpm = SwTpm(device="tpm-tis")
+        tpm.configure(config)
+        with tpm:
+            run_qemu(config, qemu_version)
+
+    Attributes:
+        state_dir (Path | None): The directory of the TPM state, a temporary directory until it is started if None
+        device (str): The TPM device of the machine, e.g. `tpm-tis` or `tpm-tis-device`
+        swtpm (str): The swtpm binary
+        golden (TpmStateStore | None): The golden TPM states
+        capture_golden (bool): Whether the run may capture the golden state. Runs that change the TPM beyond
+            provisioning it, e.g. by running tests, must not.
+        ctrl_path (Path | None): The control socket QEMU connects to, once configured
+        log_path (Path | None): The output of swtpm, once configured
+        restored (bool): Whether the run starts from the golden state, once configured
+    """
+
+    def __init__(self, state_dir: PathLike = None, device: str = "tpm-tis", swtpm: str = "swtpm",
+                 golden: TpmStateStore = None, capture_golden: bool = True):
+        self.state_dir = Path(state_dir) if state_dir else None
+        self.device = device
+        self.swtpm = swtpm
+        self.golden = golden
+        self.capture_golden = capture_golden
+        self.restored = False
+        self._blank = False
+        self.ctrl_path = None
+        self.log_path = None
+        self._run_dir = None
+        self._owns_state = False
+        self._process = None
+
+    def configure(self, config):
+        """Creates the directories of the instance and adds the TPM device to a QemuConfig."""
+        self._run_dir = Path(tempfile.mkdtemp(prefix="swtpm-"))
+        self.ctrl_path = self._run_dir / "swtpm-sock"
+        self.log_path = self._run_dir / "swtpm.log"
+        if self.state_dir is None:
+            self.state_dir = self._run_dir / "state"
+            self._owns_state = True
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+
+        # A blank TPM is provisioned by the firmware during the run
+        self._blank = not has_state(self.state_dir)
+        if self.golden is not None and self._blank:
+            self.restored = self.golden.restore(self.state_dir)
+            self._blank = not self.restored
+
+        config.add("chardev", "socket", id="chrtpm", path=self.ctrl_path)
+        config.add("tpmdev", "emulator", id="tpm0", chardev="chrtpm")
+        config.add_device(self.device, tpmdev="tpm0")
+
+    def start(self, timeout: float = READY_TIMEOUT):
+        """Starts swtpm and waits until it accepts commands on its control socket.
+
+        Raises:
+            (RuntimeError): swtpm exited or did not become ready within `timeout` seconds
+        """
+        args = [self.swtpm, "socket", "--tpm2",
+                "--tpmstate", f"dir={self.state_dir}",
+                "--ctrl", f"type=unixio,path={self.ctrl_path}",
+                "--log", "level=1"]
+        logging.info(f"Starting the TPM emulator with its state in {self.state_dir}.")
+        logging.debug(" ".join(args))
+        try:
+            with open(self.log_path, "wb") as log:
+                self._process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+        except OSError as e:
+            self._remove()
+            raise RuntimeError(f"Failed to start the TPM emulator. {e}")
+
+        deadline = time.monotonic() + timeout
+        while not self._command(CMD_GET_CAPABILITY):
+            if self._process.poll() is not None or time.monotonic() >= deadline:
+                reason = (f"exited with {self._process.returncode}" if self._process.poll() is not None
+                          else f"was not ready after {timeout:.0f} seconds")
+                self._terminate()
+                self._log_output(logging.ERROR)
+                self._remove()
+                raise RuntimeError(f"The TPM emulator {reason}.")
+            time.sleep(0.05)
+
+    def stop(self, capture: bool = False):
+        """Stops swtpm once QEMU has exited and removes the directories of the instance.
+
+        QEMU shuts the TPM down when it exits normally. Otherwise, e.g. when QEMU was killed, swtpm is shut down
+        through its control socket and terminated if it does not exit.
+
+        Args:
+            capture (bool): Whether the run succeeded, so a TPM state it provisioned from scratch can be captured as
+                the golden state
+        """
+        if self._process is not None:
+            if self._process.poll() is None:
+                self._command(CMD_SHUTDOWN)
+            self._terminate()
+            if self._process.returncode not in (0, -signal.SIGTERM):
+                logging.warning(f"The TPM emulator exited with {self._process.returncode}.")
+                self._log_output(logging.WARNING)
+            elif (capture and self.capture_golden and self._process.returncode == 0 and self.golden is not None
+                  and self._blank):
+                self.golden.capture(self.state_dir)
+            self._process = None
+        self._remove()
+
+    def _terminate(self):
+        try:
+            self._process.wait(SHUTDOWN_TIMEOUT)
+            return
+        except subprocess.TimeoutExpired:
+            logging.debug("The TPM emulator is still running, terminating it.")
+        self._process.terminate()
+        try:
+            self._process.wait(SHUTDOWN_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+
+    def _command(self, command: int) -> bool:
+        """Sends a command on the control socket, returning whether swtpm responded."""
+        if not self.ctrl_path.exists():
+            return False
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(1.0)
+            try:
+                sock.connect(str(self.ctrl_path))
+                sock.sendall(struct.pack(">I", command))
+                return len(sock.recv(64)) > 0
+            except OSError:
+                return False
+
+    def _log_output(self, level: int):
+        try:
+            output = self.log_path.read_text(errors="replace").strip()
+        except OSError:
+            return
+        if output:
+            logging.log(level, f"TPM emulator log:\n{output}")
+
+    def _remove(self):
+        if self._run_dir is not None:
+            shutil.rmtree(self._run_dir, ignore_errors=True)
+            self._run_dir = None
+            if self._owns_state:
+                self.state_dir = None
+                self._owns_state = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
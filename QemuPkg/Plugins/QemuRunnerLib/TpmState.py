@@ -0,0 +1,102 @@
+##
+# Keeps golden TPM states, captured once a firmware build has provisioned the TPM, and clones them into later runs.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from os import PathLike
+from pathlib import Path
+
+from FileUtils import clone_file, hash_file
+
+
+# Bump when the way TPM states are captured changes, so older states are captured again
+GOLDEN_STATE_VERSION = 1
+
+# The files swtpm keeps the TPM state in, e.g. `tpm2-00.permall`
+STATE_PATTERN = "tpm2-*"
+
+
+def has_state(state_dir: PathLike) -> bool:
+    """Returns whether a directory holds a TPM state."""
+    return any(Path(state_dir).glob(STATE_PATTERN))
+
+
+class TpmStateStore:
+    """Keeps the TPM state of the first successful run of each firmware build, to start later runs from.
+
+    Without it, every run starts with a blank TPM that the firmware has to start up and provision, e.g. allocating
+    the PCR banks, so the first boot of each run is slower and measured boot depends on what earlier runs left in
+    the TPM. With it, each run starts from a clone of the same golden state.
+
+    The golden states are kept in `store_dir`, named after a hash of the firmware files and the TPM device, so a new
+    state is captured whenever the firmware is rebuilt. Only the state of the latest firmware build is kept.
+
+    Attributes:
+        store_dir (Path): The directory the golden states are kept in
+        firmware (list[Path]): The firmware files the state depends on, e.g. the code FD
+        device (str): The TPM device of the machine
+    """
+
+    def __init__(self, store_dir: PathLike, firmware: list[PathLike], device: str):
+        self.store_dir = Path(store_dir)
+        self.firmware = [Path(path) for path in firmware]
+        self.device = device
+        self._key = None
+
+    def key(self) -> str:
+        """Returns the hash that identifies the golden state of the firmware build."""
+        if self._key is None:
+            identity = {
+                "version": GOLDEN_STATE_VERSION,
+                "device": self.device,
+                "firmware": [hash_file(path) for path in self.firmware],
+            }
+            self._key = hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()[:32]
+        return self._key
+
+    @property
+    def golden_path(self) -> Path:
+        return self.store_dir / self.key()
+
+    def restore(self, state_dir: PathLike) -> bool:
+        """Clones the golden state into an empty state directory, returning False if there is none yet."""
+        if not has_state(self.golden_path):
+            return False
+        for src in self.golden_path.glob(STATE_PATTERN):
+            clone_file(src, Path(state_dir) / src.name)
+        logging.info(f"Starting the TPM from the golden state {self.golden_path}.")
+        return True
+
+    def capture(self, state_dir: PathLike):
+        """Keeps the TPM state of a run as the golden state, unless a concurrent run already did."""
+        if not has_state(state_dir) or self.golden_path.exists():
+            return
+        staging = None
+        try:
+            self.store_dir.mkdir(parents=True, exist_ok=True)
+            # Unique per run, test shards run in the same process and may capture the state at the same time
+            staging = Path(tempfile.mkdtemp(dir=self.store_dir, suffix=".tmp"))
+            for src in Path(state_dir).glob(STATE_PATTERN):
+                clone_file(src, staging / src.name)
+            os.rename(staging, self.golden_path)
+        except OSError as e:
+            # e.g. a concurrent run captured the golden state first
+            if not self.golden_path.exists():
+                logging.warning(f"Failed to capture the golden TPM state {self.golden_path}. {e}")
+            if staging is not None:
+                shutil.rmtree(staging, ignore_errors=True)
+            return
+
+        for stale in self.store_dir.iterdir():
+            if stale != self.golden_path and stale.is_dir() and not stale.name.endswith(".tmp"):
+                shutil.rmtree(stale, ignore_errors=True)
+        logging.info(f"Captured the golden TPM state {self.golden_path}.")
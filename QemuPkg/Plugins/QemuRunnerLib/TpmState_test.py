@@ -0,0 +1,93 @@
+##
+# Tests capturing the golden TPM state and which runs may capture it.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Put on the python path by FileUtils_path_env.yaml during a build
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "FileUtils"))
+
+from QemuRunnerLib import QemuRunnerLib  # noqa: E402
+from TpmState import TpmStateStore  # noqa: E402
+
+
+class FakeEnv:
+
+    def __init__(self, **values):
+        self.values = values
+
+    def GetValue(self, name, default=None):
+        return self.values.get(name, default)
+
+
+class FakeStore:
+
+    def __init__(self):
+        self.captured = []
+
+    def capture(self, state_dir):
+        self.captured.append(state_dir)
+
+
+class TpmStateTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp = Path(temp_dir.name)
+        self.code_fd = self.temp / "QEMU_CODE.fd"
+        self.code_fd.write_bytes(b"code")
+
+    def test_concurrent_captures(self):
+        data = os.urandom(1024 * 1024)
+        state_dirs = []
+        for index in range(4):
+            state_dir = self.temp / f"State{index}"
+            state_dir.mkdir()
+            (state_dir / "tpm2-00.permall").write_bytes(data)
+            state_dirs.append(state_dir)
+
+        store = TpmStateStore(self.temp / "SwTpmStates", [self.code_fd], "tpm-tis")
+        threads = [threading.Thread(target=store.capture, args=(state_dir,)) for state_dir in state_dirs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual((store.golden_path / "tpm2-00.permall").read_bytes(), data)
+        self.assertEqual([path.name for path in store.store_dir.iterdir()], [store.golden_path.name])
+
+    def stop_provisioning_run(self, **values) -> list:
+        env = FakeEnv(SWTPM_GOLDEN_STATE="TRUE", BUILD_OUTPUT_BASE=str(self.temp), **values)
+        swtpm = QemuRunnerLib.create_swtpm(env, "tpm-tis", [self.code_fd])
+        swtpm.golden = FakeStore()
+        # A swtpm that exited normally after provisioning a blank TPM
+        swtpm._blank = True
+        swtpm._process = subprocess.Popen([sys.executable, "-c", ""])
+        swtpm._process.wait()
+        swtpm.stop(capture=True)
+        return swtpm.golden.captured
+
+    @unittest.skipIf(os.name == "nt", "swtpm is not used on Windows")
+    def test_boot_to_shell_captures(self):
+        self.assertEqual(len(self.stop_provisioning_run()), 1)
+
+    @unittest.skipIf(os.name == "nt", "swtpm is not used on Windows")
+    def test_test_run_does_not_capture(self):
+        self.assertEqual(self.stop_provisioning_run(RUN_TESTS="TRUE"), [])
+        self.assertEqual(self.stop_provisioning_run(STARTUP_NSH="startup.nsh"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
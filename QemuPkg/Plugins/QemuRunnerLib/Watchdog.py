@@ -0,0 +1,136 @@
+##
+# Ends QEMU runs that take too long or stop producing console output.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+from Qmp import QmpClient, QmpError
+
+
+# The exit code of a QEMU run ended by the watchdog, distinct from the exit codes of QEMU itself
+WATCHDOG_EXIT_CODE = 0xDEAD
+
+# Seconds QEMU is given to quit through QMP before it is killed
+DEFAULT_GRACE_PERIOD = 10.0
+
+# Seconds between checks of the timeouts
+POLL_INTERVAL = 1.0
+
+
+class Watchdog:
+    """Shuts QEMU down once a run exceeds its total timeout or produces no console output for the idle timeout.
+
+    QEMU is first asked to quit through a QMP socket the watchdog adds to the configuration, then killed if it is
+    still running after the grace period. Feed each console line with `feed` so idle time and the last line are
+    known.
+
+    Attributes:
+        timeout (float | None): Seconds the whole run may take
+        idle_timeout (float | None): Seconds the run may go without console output
+        grace_period (float): Seconds QEMU is given to quit before it is killed
+        expired (str | None): Which timeout ended the run, `total` or `idle`
+        last_line (str | None): The last console line
+        expired_line (str | None): The last console line when the watchdog expired
+    """
+
+    def __init__(self, timeout: float = None, idle_timeout: float = None,
+                 grace_period: float = DEFAULT_GRACE_PERIOD):
+        self.timeout = timeout or None
+        self.idle_timeout = idle_timeout or None
+        self.grace_period = grace_period
+        self.expired = None
+        self.last_line = None
+        self.expired_line = None
+        self._expired_at = None
+        self._qmp_dir = None
+        self._qmp_path = None
+        self._process = None
+        self._start = None
+        self._last_output = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def configure(self, config):
+        """Adds the QMP socket used for the graceful shutdown to a QemuConfig."""
+        if os.name == 'nt':
+            # QMP is reached through a unix socket, which is not used on Windows, so QEMU is killed instead
+            return
+        # Socket paths are limited to ~100 characters, so the socket is not placed in the build output
+        self._qmp_dir = tempfile.mkdtemp(prefix="qemu-qmp-")
+        self._qmp_path = os.path.join(self._qmp_dir, "qmp.sock")
+        config.add("qmp", f"unix:{self._qmp_path}", server="on", wait="off")
+
+    def start(self, process: subprocess.Popen):
+        """Starts timing the QEMU process."""
+        self._process = process
+        self._start = self._last_output = time.monotonic()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def feed(self, line: str):
+        """Records console output."""
+        self._last_output = time.monotonic()
+        self.last_line = line
+
+    def stop(self):
+        """Stops the watchdog once QEMU has exited and removes the QMP socket."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._qmp_dir is not None:
+            shutil.rmtree(self._qmp_dir, ignore_errors=True)
+            self._qmp_dir = None
+
+    def report(self):
+        """Logs which timeout ended the run and where the console output stopped."""
+        if self.expired is None:
+            return
+        elapsed, idle = self._expired_at
+        limit = self.timeout if self.expired == "total" else self.idle_timeout
+        logging.critical(f"QEMU watchdog expired: {self.expired} timeout of {limit:.0f}s, after {elapsed:.0f}s with "
+                         f"no console output for {idle:.0f}s.")
+        logging.critical(f"Console output stopped at: {self.expired_line}")
+
+    def _watch(self):
+        while not self._stopped.wait(POLL_INTERVAL):
+            now = time.monotonic()
+            if self.timeout is not None and now - self._start >= self.timeout:
+                self.expired = "total"
+            elif self.idle_timeout is not None and now - self._last_output >= self.idle_timeout:
+                self.expired = "idle"
+            else:
+                continue
+            self.expired_line = self.last_line
+            self._expired_at = (now - self._start, now - self._last_output)
+            self._shutdown()
+            return
+
+    def _shutdown(self):
+        logging.error(f"QEMU watchdog expired ({self.expired} timeout), shutting QEMU down.")
+        if self._qmp_path is not None:
+            try:
+                with QmpClient().connect(self._qmp_path, timeout=self.grace_period) as qmp:
+                    try:
+                        qmp.execute("quit")
+                    except QmpError:
+                        # QEMU may close the connection before it responds
+                        pass
+            except QmpError as e:
+                logging.warning(f"Failed to quit QEMU through QMP. {e}")
+            try:
+                self._process.wait(self.grace_period)
+                return
+            except subprocess.TimeoutExpired:
+                pass
+
+        logging.error("Killing QEMU.")
+        self._process.kill()
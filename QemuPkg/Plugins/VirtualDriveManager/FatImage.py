@@ -0,0 +1,651 @@
+##
+# In-process reader and writer for FAT32 formatted virtual drive images.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import datetime
+import errno
+import os
+import struct
+import sys
+import uuid
+
+from array import array
+from dataclasses import dataclass
+from os import PathLike
+from pathlib import Path, PurePosixPath
+
+
+SECTOR_SIZE = 512
+DIR_ENTRY_SIZE = 32
+
+ATTR_READ_ONLY = 0x01
+ATTR_HIDDEN = 0x02
+ATTR_SYSTEM = 0x04
+ATTR_VOLUME_ID = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_ARCHIVE = 0x20
+ATTR_LONG_NAME = ATTR_READ_ONLY | ATTR_HIDDEN | ATTR_SYSTEM | ATTR_VOLUME_ID
+
+FAT_ENTRY_MASK = 0x0FFFFFFF
+FAT_FREE = 0x00000000
+FAT_BAD = 0x0FFFFFF7
+FAT_EOC = 0x0FFFFFFF
+FAT_EOC_MIN = 0x0FFFFFF8
+
+# FAT32 requires at least this many clusters, otherwise the volume is FAT12/16 by definition
+FAT32_MIN_CLUSTERS = 65525
+
+ENTRY_END = 0x00
+ENTRY_DELETED = 0xE5
+
+SHORT_NAME_CHARS = set("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789$%'-_@~`!(){}^#&")
+LFN_CHARS_PER_ENTRY = 13
+
+
+@dataclass
+class FatDirEntry:
+    """A file or directory found in a FAT directory.
+
+    Attributes:
+        name (str): The long name of the entry if present, otherwise the short name
+        short_name (bytes): The raw 11 byte 8.3 name
+        attributes (int): The FAT attribute byte
+        cluster (int): The first cluster of the entry, 0 if empty
+        size (int): The size of the file in bytes
+        offset (int): Byte offset of the short name entry in the image
+        lfn_offsets (list[int]): Byte offsets of the long name entries belonging to this entry
+    """
+    name: str
+    short_name: bytes
+    attributes: int
+    cluster: int
+    size: int
+    offset: int
+    lfn_offsets: list
+
+    @property
+    def is_dir(self) -> bool:
+        return bool(self.attributes & ATTR_DIRECTORY)
+
+
+def _fat_timestamp(when: datetime.datetime) -> tuple[int, int]:
+    """Returns the FAT (time, date) words for `when`."""
+    year = min(max(when.year, 1980), 2107)
+    date = ((year - 1980) << 9) | (when.month << 5) | when.day
+    time = (when.hour << 11) | (when.minute << 5) | (when.second // 2)
+    return time, date
+
+
+def _lfn_checksum(short_name: bytes) -> int:
+    checksum = 0
+    for c in short_name:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + c) & 0xFF
+    return checksum
+
+
+def _sectors_per_cluster(total_sectors: int) -> int:
+    """Returns the sectors per cluster recommended by the FAT specification for a FAT32 volume."""
+    for limit, sectors_per_cluster in ((532480, 1), (16777216, 8), (33554432, 16), (67108864, 32)):
+        if total_sectors <= limit:
+            return sectors_per_cluster
+    return 64
+
+
+def _short_name_from_83(name: str) -> tuple[bytes, int] | None:
+    """Returns the (short name, case flags) for `name` if it can be stored without a long name entry."""
+    base, dot, ext = name.partition(".")
+    if not base or len(base) > 8 or len(ext) > 3 or "." in ext:
+        return None
+    if not all(c.upper() in SHORT_NAME_CHARS for c in base + ext):
+        return None
+
+    # The NT case flags only allow an all lower case base and/or extension
+    flags = 0
+    for part, flag in ((base, 0x08), (ext, 0x10)):
+        if part != part.upper():
+            if part != part.lower():
+                return None
+            flags |= flag
+
+    return (base.upper().ljust(8) + ext.upper().ljust(3)).encode("ascii"), flags
+
+
+def _decode_short_name(raw: bytes) -> str:
+    base = raw[0:8]
+    if base[0] == 0x05:
+        base = b"\xe5" + base[1:]
+    base = base.decode("latin-1").rstrip()
+    ext = raw[8:11].decode("latin-1").rstrip()
+    return f"{base}.{ext}" if ext else base
+
+
+class FatImage:
+    """Reads and writes files directly in a FAT32 formatted image file.
+
+    The image must be a "superfloppy" FAT32 volume (no partition table), which is what `format` creates and what
+    `mkfs.vfat -F 32` creates when run against an image file. Without `-F 32`, `mkfs.vfat` formats small images, e.g.
+    the default 60MB drive, as FAT16, which is not supported. The file allocation table is cached in memory and
+    written back to every FAT copy when the image is closed.
+
+    Paths use `/` or `\\` as a separator and are matched case insensitively against both long and short names.
+
+    !!! note
+        Use the image as a context manager, or call `close()`, to make sure the file allocation table is flushed.
+    """
+
+    def __init__(self, path: PathLike):
+        """Opens an existing FAT32 image.
+
+        Raises:
+            (ValueError): The image is not a FAT32 volume
+        """
+        self.path = Path(path)
+        self._file = open(self.path, "r+b")
+        try:
+            self._read_boot_sector()
+            self._file.seek(self._fat_offset)
+            self._fat = array("I")
+            self._fat.frombytes(self._file.read(self._fat_entries * 4))
+            if sys.byteorder == "big":
+                self._fat.byteswap()
+        except Exception:
+            self._file.close()
+            raise
+        self._fat_dirty = False
+        self._next_free = 2
+
+    @classmethod
+    def format(cls, path: PathLike, size: int, label: str = "NO NAME") -> "FatImage":
+        """Creates a new, empty FAT32 image.
+
+        Only the reserved region, the allocation tables and the root directory are written. The rest of the image
+        is created by extending the file, leaving it sparse on file systems that support it.
+
+        Args:
+            path (PathLike): The image to create. Any existing file is replaced.
+            size (int): The size of the image in MB
+            label (str): The volume label
+
+        Raises:
+            (ValueError): `size` is too small to hold a FAT32 volume
+        """
+        total_sectors = size * 1024 * 1024 // SECTOR_SIZE
+        sectors_per_cluster = _sectors_per_cluster(total_sectors)
+        reserved_sectors = 32
+        num_fats = 2
+
+        # FAT size calculation from the Microsoft FAT specification
+        tmp1 = total_sectors - reserved_sectors
+        tmp2 = (256 * sectors_per_cluster + num_fats) // 2
+        fat_sectors = (tmp1 + tmp2 - 1) // tmp2
+
+        data_sectors = total_sectors - reserved_sectors - num_fats * fat_sectors
+        if data_sectors // sectors_per_cluster < FAT32_MIN_CLUSTERS:
+            raise ValueError(f"{size}MB is too small for a FAT32 volume.")
+
+        volume_id = uuid.uuid4().int & 0xFFFFFFFF
+        label = label.upper().encode("ascii", "replace")[:11].ljust(11)
+
+        boot = bytearray(SECTOR_SIZE)
+        boot[0:3] = b"\xEB\x58\x90"
+        boot[3:11] = b"MSWIN4.1"
+        struct.pack_into("<HBHBHHBHHHII", boot, 11,
+                         SECTOR_SIZE,          # BytsPerSec
+                         sectors_per_cluster,  # SecPerClus
+                         reserved_sectors,     # RsvdSecCnt
+                         num_fats,             # NumFATs
+                         0,                    # RootEntCnt
+                         0,                    # TotSec16
+                         0xF8,                 # Media
+                         0,                    # FATSz16
+                         32,                   # SecPerTrk
+                         64,                   # NumHeads
+                         0,                    # HiddSec
+                         total_sectors)        # TotSec32
+        struct.pack_into("<IHHIHH", boot, 36,
+                         fat_sectors,          # FATSz32
+                         0,                    # ExtFlags, FATs are mirrored
+                         0,                    # FSVer
+                         2,                    # RootClus
+                         1,                    # FSInfo
+                         6)                    # BkBootSec
+        struct.pack_into("<BBBI", boot, 64, 0x80, 0, 0x29, volume_id)
+        boot[71:82] = label
+        boot[82:90] = b"FAT32   "
+        boot[510:512] = b"\x55\xAA"
+
+        total_clusters = data_sectors // sectors_per_cluster
+        fsinfo = bytearray(SECTOR_SIZE)
+        struct.pack_into("<I", fsinfo, 0, 0x41615252)
+        struct.pack_into("<IIII", fsinfo, 484, 0x61417272, total_clusters - 1, 3, 0)
+        struct.pack_into("<I", fsinfo, 508, 0xAA550000)
+
+        fat_start = bytes(struct.pack("<III", 0x0FFFFF00 | 0xF8, FAT_EOC, FAT_EOC))
+        root_offset = (reserved_sectors + num_fats * fat_sectors) * SECTOR_SIZE
+
+        with open(path, "wb") as f:
+            f.truncate(total_sectors * SECTOR_SIZE)
+            for sector, data in ((0, boot), (1, fsinfo), (6, boot), (7, fsinfo)):
+                f.seek(sector * SECTOR_SIZE)
+                f.write(data)
+            for i in range(num_fats):
+                f.seek((reserved_sectors + i * fat_sectors) * SECTOR_SIZE)
+                f.write(fat_start)
+
+            # The root directory starts with the volume label
+            f.seek(root_offset)
+            f.write(label + bytes([ATTR_VOLUME_ID]) + bytes(DIR_ENTRY_SIZE - 12))
+
+        return cls(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Flushes the file allocation table and closes the image."""
+        if self._file.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._file.close()
+
+    def flush(self):
+        """Writes the cached file allocation table and free cluster count back to the image."""
+        if self._fat_dirty:
+            fat = self._fat
+            if sys.byteorder == "big":
+                fat = array("I", fat)
+                fat.byteswap()
+            data = fat.tobytes()
+            for i in range(self._num_fats):
+                self._file.seek(self._fat_offset + i * self._fat_size)
+                self._file.write(data)
+
+            if self._fsinfo_sector:
+                free = self._fat[2:self._cluster_count + 2].count(FAT_FREE)
+                for sector in {self._fsinfo_sector, self._backup_boot_sector + 1}:
+                    self._file.seek(sector * self._bytes_per_sector + 488)
+                    self._file.write(struct.pack("<II", free, self._next_free))
+            self._fat_dirty = False
+        self._file.flush()
+
+    def exists(self, path: str) -> bool:
+        """Returns if a file or directory exists at `path`."""
+        try:
+            self._lookup(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def list_dir(self, path: str = "") -> list[FatDirEntry]:
+        """Returns the entries of the directory at `path`, excluding `.` and `..`."""
+        return [e for e in self._read_dir(self._dir_cluster(path)) if e.short_name[0:1] != b"."]
+
+    def read_file(self, path: str) -> bytes:
+        """Returns the contents of the file at `path`.
+
+        Raises:
+            (FileNotFoundError): The file does not exist
+            (IsADirectoryError): `path` is a directory
+        """
+        entry = self._lookup(path)
+        if entry.is_dir:
+            raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), path)
+        return self._read_chain(entry.cluster, entry.size)
+
+    def write_file(self, path: str, data: bytes):
+        """Writes `data` to the file at `path`, replacing it if it already exists.
+
+        Missing parent directories are created.
+
+        Raises:
+            (OSError): The image does not have enough free space
+            (IsADirectoryError): `path` is a directory
+        """
+        parent, name = self._split(path)
+        dir_cluster = self._make_dirs(parent)
+
+        existing = self._find(dir_cluster, name)
+        if existing is not None:
+            if existing.is_dir:
+                raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), path)
+            # Free the old clusters only once the new data is written, so a full image keeps the existing file
+            first_cluster = self._write_chain(data)
+            self._update_entry(existing.offset, first_cluster, len(data))
+            self._free_chain(existing.cluster)
+            return
+
+        first_cluster = self._write_chain(data)
+        self._create_entry(dir_cluster, name, ATTR_ARCHIVE, first_cluster, len(data))
+
+    def delete(self, path: str):
+        """Deletes the file or empty directory at `path`.
+
+        Raises:
+            (FileNotFoundError): The file does not exist
+            (OSError): `path` is a directory that is not empty
+        """
+        entry = self._lookup(path)
+        if entry.is_dir and self.list_dir(path):
+            raise OSError(errno.ENOTEMPTY, os.strerror(errno.ENOTEMPTY), path)
+        self._free_chain(entry.cluster)
+        self._mark_deleted(entry.lfn_offsets + [entry.offset])
+
+    def _read_boot_sector(self):
+        self._file.seek(0)
+        boot = self._file.read(SECTOR_SIZE)
+        if len(boot) < SECTOR_SIZE or boot[510:512] != b"\x55\xAA":
+            raise ValueError(f"{self.path} does not contain a FAT boot sector.")
+
+        (self._bytes_per_sector, self._sectors_per_cluster, reserved_sectors, self._num_fats,
+         root_entries, total_sectors16, _, fat_size16) = struct.unpack_from("<HBHBHHBH", boot, 11)
+        total_sectors32, = struct.unpack_from("<I", boot, 32)
+        fat_size32, ext_flags, _, self._root_cluster, self._fsinfo_sector, self._backup_boot_sector = \
+            struct.unpack_from("<IHHIHH", boot, 36)
+
+        if fat_size16 != 0 or root_entries != 0:
+            raise ValueError(f"{self.path} is a FAT12/16 volume, only FAT32 is supported. Recreate the drive with the "
+                             "fat backend or format it with `mkfs.vfat -F 32`.")
+        if fat_size32 == 0:
+            raise ValueError(f"{self.path} is not a FAT32 volume.")
+        if ext_flags & 0x80:
+            raise ValueError(f"{self.path} uses a single active FAT, which is not supported.")
+
+        total_sectors = total_sectors32 or total_sectors16
+        self._fat_size = fat_size32 * self._bytes_per_sector
+        self._fat_offset = reserved_sectors * self._bytes_per_sector
+        self._data_offset = self._fat_offset + self._num_fats * self._fat_size
+        self._cluster_size = self._sectors_per_cluster * self._bytes_per_sector
+        data_sectors = total_sectors - reserved_sectors - self._num_fats * fat_size32
+        self._cluster_count = data_sectors // self._sectors_per_cluster
+        self._fat_entries = min(self._cluster_count + 2, self._fat_size // 4)
+
+    def _cluster_offset(self, cluster: int) -> int:
+        return self._data_offset + (cluster - 2) * self._cluster_size
+
+    def _chain(self, cluster: int) -> list[int]:
+        """Returns the list of clusters in the chain starting at `cluster`."""
+        chain = []
+        while 2 <= cluster < FAT_BAD and len(chain) <= self._cluster_count:
+            chain.append(cluster)
+            cluster = self._fat[cluster] & FAT_ENTRY_MASK
+        return chain
+
+    def _runs(self, chain: list[int]) -> list[tuple[int, int]]:
+        """Groups a cluster chain into (first cluster, count) runs of contiguous clusters."""
+        runs = []
+        for cluster in chain:
+            if runs and runs[-1][0] + runs[-1][1] == cluster:
+                runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+            else:
+                runs.append((cluster, 1))
+        return runs
+
+    def _read_chain(self, cluster: int, size: int = None) -> bytes:
+        data = bytearray()
+        for first, count in self._runs(self._chain(cluster)):
+            self._file.seek(self._cluster_offset(first))
+            data += self._file.read(count * self._cluster_size)
+            if size is not None and len(data) >= size:
+                break
+        return bytes(data if size is None else data[:size])
+
+    def _allocate(self, count: int) -> list[int]:
+        """Allocates `count` clusters, preferring contiguous runs, and links them into a chain."""
+        clusters = []
+        last = self._cluster_count + 2
+        for start, stop in ((self._next_free, last), (2, self._next_free)):
+            for cluster in range(start, stop):
+                if self._fat[cluster] & FAT_ENTRY_MASK == FAT_FREE:
+                    clusters.append(cluster)
+                    if len(clusters) == count:
+                        break
+            if len(clusters) == count:
+                break
+        if len(clusters) < count:
+            raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC), str(self.path))
+
+        for cluster, following in zip(clusters, clusters[1:] + [FAT_EOC]):
+            self._fat[cluster] = following
+        self._fat_dirty = True
+        self._next_free = clusters[-1] + 1 if clusters[-1] + 1 < last else 2
+        return clusters
+
+    def _free_chain(self, cluster: int):
+        for c in self._chain(cluster):
+            self._fat[c] = FAT_FREE
+            self._fat_dirty = True
+
+    def _write_chain(self, data: bytes) -> int:
+        """Writes `data` to newly allocated clusters and returns the first cluster, or 0 for empty data."""
+        if not data:
+            return 0
+        count = (len(data) + self._cluster_size - 1) // self._cluster_size
+        clusters = self._allocate(count)
+        view = memoryview(data)
+        position = 0
+        for first, run in self._runs(clusters):
+            length = run * self._cluster_size
+            chunk = view[position:position + length]
+            self._file.seek(self._cluster_offset(first))
+            self._file.write(chunk)
+            if len(chunk) < length:
+                # Zero the slack in the last cluster so stale data never leaks into the file
+                self._file.write(bytes(length - len(chunk)))
+            position += length
+        return clusters[0]
+
+    def _read_dir(self, cluster: int) -> list[FatDirEntry]:
+        entries = []
+        lfn_parts = {}
+        lfn_offsets = []
+        lfn_checksum = None
+        for first, count in self._runs(self._chain(cluster)):
+            base = self._cluster_offset(first)
+            self._file.seek(base)
+            raw = self._file.read(count * self._cluster_size)
+            for i in range(0, len(raw), DIR_ENTRY_SIZE):
+                entry = raw[i:i + DIR_ENTRY_SIZE]
+                if entry[0] == ENTRY_END:
+                    return entries
+                if entry[0] == ENTRY_DELETED:
+                    lfn_parts, lfn_offsets, lfn_checksum = {}, [], None
+                    continue
+
+                attributes = entry[11]
+                if attributes & 0x3F == ATTR_LONG_NAME:
+                    order = entry[0] & 0x1F
+                    if entry[0] & 0x40:
+                        lfn_parts, lfn_offsets = {}, []
+                    lfn_checksum = entry[13]
+                    lfn_parts[order] = entry[1:11] + entry[14:26] + entry[28:32]
+                    lfn_offsets.append(base + i)
+                    continue
+
+                if attributes & ATTR_VOLUME_ID:
+                    lfn_parts, lfn_offsets, lfn_checksum = {}, [], None
+                    continue
+
+                short_name = entry[0:11]
+                name = None
+                if lfn_parts and lfn_checksum == _lfn_checksum(short_name):
+                    raw_name = b"".join(lfn_parts[k] for k in sorted(lfn_parts))
+                    name = raw_name.decode("utf-16-le", "replace").split("\x00", 1)[0]
+                if not name:
+                    name = _decode_short_name(short_name)
+                    ntres = entry[12]
+                    base_name, dot, ext = name.partition(".")
+                    if ntres & 0x08:
+                        base_name = base_name.lower()
+                    if ntres & 0x10:
+                        ext = ext.lower()
+                    name = base_name + dot + ext
+
+                cluster_hi, = struct.unpack_from("<H", entry, 20)
+                cluster_lo, size = struct.unpack_from("<HI", entry, 26)
+                entries.append(FatDirEntry(name, short_name, attributes, (cluster_hi << 16) | cluster_lo, size,
+                                           base + i, lfn_offsets))
+                lfn_parts, lfn_offsets, lfn_checksum = {}, [], None
+        return entries
+
+    def _split(self, path: str) -> tuple[list[str], str]:
+        parts = [p for p in PurePosixPath(str(path).replace("\\", "/")).parts if p not in ("/", ".")]
+        if not parts:
+            raise ValueError(f"Invalid path on the virtual drive: {path}")
+        return parts[:-1], parts[-1]
+
+    def _find(self, dir_cluster: int, name: str) -> FatDirEntry | None:
+        upper = name.upper()
+        for entry in self._read_dir(dir_cluster):
+            if entry.name.upper() == upper or _decode_short_name(entry.short_name) == upper:
+                return entry
+        return None
+
+    def _lookup(self, path: str) -> FatDirEntry:
+        parents, name = self._split(path)
+        cluster = self._root_cluster
+        for part in parents:
+            entry = self._find(cluster, part)
+            if entry is None or not entry.is_dir:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), str(path))
+            cluster = entry.cluster or self._root_cluster
+        entry = self._find(cluster, name)
+        if entry is None:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), str(path))
+        return entry
+
+    def _dir_cluster(self, path: str) -> int:
+        if not str(path).strip("/\\."):
+            return self._root_cluster
+        entry = self._lookup(path)
+        if not entry.is_dir:
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), str(path))
+        return entry.cluster or self._root_cluster
+
+    def _make_dirs(self, parts: list[str]) -> int:
+        cluster = self._root_cluster
+        for part in parts:
+            entry = self._find(cluster, part)
+            if entry is None:
+                parent = cluster
+                cluster = self._allocate(1)[0]
+                self._file.seek(self._cluster_offset(cluster))
+                self._file.write(bytes(self._cluster_size))
+                dot_parent = 0 if parent == self._root_cluster else parent
+                self._write_raw_entry(self._cluster_offset(cluster), b".          ", ATTR_DIRECTORY, cluster, 0)
+                self._write_raw_entry(self._cluster_offset(cluster) + DIR_ENTRY_SIZE, b"..         ",
+                                      ATTR_DIRECTORY, dot_parent, 0)
+                self._create_entry(parent, part, ATTR_DIRECTORY, cluster, 0)
+            elif not entry.is_dir:
+                raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), part)
+            else:
+                cluster = entry.cluster or self._root_cluster
+        return cluster
+
+    def _write_raw_entry(self, offset: int, short_name: bytes, attributes: int, cluster: int, size: int,
+                         case_flags: int = 0):
+        time, date = _fat_timestamp(datetime.datetime.now())
+        entry = struct.pack("<11sBBBHHHHHHHI", short_name, attributes, case_flags, 0, time, date, date,
+                            cluster >> 16, time, date, cluster & 0xFFFF, size)
+        self._file.seek(offset)
+        self._file.write(entry)
+
+    def _update_entry(self, offset: int, cluster: int, size: int):
+        time, date = _fat_timestamp(datetime.datetime.now())
+        self._file.seek(offset + 18)
+        self._file.write(struct.pack("<HHHHHI", date, cluster >> 16, time, date, cluster & 0xFFFF, size))
+
+    def _unique_short_name(self, dir_cluster: int, name: str) -> bytes:
+        """Generates a unique numeric-tail 8.3 name (e.g. `LONGFI~1.EFI`) for `name`."""
+        stem, dot, ext = name.rpartition(".")
+        if not stem:
+            stem, ext = name, ""
+        clean = lambda s: "".join(c if c in SHORT_NAME_CHARS else "_" for c in s.upper().replace(" ", "").replace(".", ""))
+        stem, ext = clean(stem), clean(ext)[:3]
+        existing = {e.short_name for e in self._read_dir(dir_cluster)}
+        for n in range(1, 1000000):
+            tail = f"~{n}"
+            candidate = ((stem[:8 - len(tail)] + tail).ljust(8) + ext.ljust(3)).encode("ascii")
+            if candidate not in existing:
+                return candidate
+        raise OSError(errno.EEXIST, "Could not generate a unique short name", name)
+
+    def _create_entry(self, dir_cluster: int, name: str, attributes: int, cluster: int, size: int):
+        short = _short_name_from_83(name)
+        if short is not None:
+            short_name, case_flags = short
+            lfn_entries = []
+        else:
+            case_flags = 0
+            short_name = self._unique_short_name(dir_cluster, name)
+            checksum = _lfn_checksum(short_name)
+            encoded = name.encode("utf-16-le")
+            count = (len(name) + LFN_CHARS_PER_ENTRY - 1) // LFN_CHARS_PER_ENTRY
+            padded = encoded + b"\x00\x00" if len(name) % LFN_CHARS_PER_ENTRY else encoded
+            padded = padded.ljust(count * LFN_CHARS_PER_ENTRY * 2, b"\xff")
+            lfn_entries = []
+            for order in range(count, 0, -1):
+                part = padded[(order - 1) * 26:order * 26]
+                sequence = order | (0x40 if order == count else 0)
+                lfn_entries.append(bytes([sequence]) + part[0:10] + bytes([ATTR_LONG_NAME, 0, checksum]) +
+                                   part[10:22] + b"\x00\x00" + part[22:26])
+
+        offset = self._find_free_entries(dir_cluster, len(lfn_entries) + 1)
+        for raw in lfn_entries:
+            self._file.seek(offset)
+            self._file.write(raw)
+            offset += DIR_ENTRY_SIZE
+        self._write_raw_entry(offset, short_name, attributes, cluster, size, case_flags)
+
+    def _find_free_entries(self, dir_cluster: int, count: int) -> int:
+        """Returns the offset of `count` consecutive free directory entries, growing the directory if needed."""
+        chain = self._chain(dir_cluster)
+        entries_per_cluster = self._cluster_size // DIR_ENTRY_SIZE
+        end_markers = []
+        run_start = None
+        run_length = 0
+        for cluster in chain:
+            base = self._cluster_offset(cluster)
+            self._file.seek(base)
+            raw = self._file.read(self._cluster_size)
+            for i in range(entries_per_cluster):
+                marker = raw[i * DIR_ENTRY_SIZE]
+                if marker in (ENTRY_END, ENTRY_DELETED):
+                    # A run of free entries must not be split across non-adjacent clusters
+                    offset = base + i * DIR_ENTRY_SIZE
+                    if run_length and offset != run_start + run_length * DIR_ENTRY_SIZE:
+                        run_start, run_length = None, 0
+                    if run_start is None:
+                        run_start = offset
+                    if marker == ENTRY_END:
+                        end_markers.append(offset)
+                    run_length += 1
+                    if run_length == count:
+                        run_end = run_start + count * DIR_ENTRY_SIZE
+                        self._mark_deleted([o for o in end_markers if not run_start <= o < run_end])
+                        return run_start
+                else:
+                    run_start, run_length = None, 0
+
+        # Grow the directory by enough zeroed clusters to hold the new entries. Any end-of-directory markers left
+        # in the existing clusters would hide the new entries, so they are converted to deleted entries.
+        self._mark_deleted(end_markers)
+        needed = (count + entries_per_cluster - 1) // entries_per_cluster
+        new_clusters = self._allocate(needed)
+        self._fat[chain[-1]] = new_clusters[0]
+        for cluster in new_clusters:
+            self._file.seek(self._cluster_offset(cluster))
+            self._file.write(bytes(self._cluster_size))
+        return self._cluster_offset(new_clusters[0])
+
+    def _mark_deleted(self, offsets: list[int]):
+        for offset in offsets:
+            self._file.seek(offset)
+            self._file.write(bytes([ENTRY_DELETED]))
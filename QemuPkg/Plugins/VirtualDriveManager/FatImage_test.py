@@ -0,0 +1,68 @@
+##
+# Tests the in-process FAT32 image reader and writer.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import errno
+import os
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from FatImage import FatImage, SECTOR_SIZE  # noqa: E402
+
+MB = 1024 * 1024
+
+
+class FatImageTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = os.path.join(temp_dir.name, "VirtualDrive.img")
+
+    def test_replace_file_without_space_keeps_existing_file(self):
+        with FatImage.format(self.path, 40) as image:
+            free = image._cluster_count * image._cluster_size
+            image.write_file("big.bin", b"\xAA" * (free // 2 + 1))
+            image.write_file("test.txt", b"old")
+
+            with self.assertRaises(OSError) as raised:
+                image.write_file("big.bin", b"\xBB" * (free // 2 + 1))
+            self.assertEqual(raised.exception.errno, errno.ENOSPC)
+
+            self.assertEqual(image.read_file("big.bin"), b"\xAA" * (free // 2 + 1))
+            self.assertEqual(image.read_file("test.txt"), b"old")
+
+    def test_replace_file_frees_old_clusters(self):
+        with FatImage.format(self.path, 40) as image:
+            image.write_file("test.txt", b"old")
+            image.write_file("test.txt", b"new")
+            used = [c for c in range(2, image._cluster_count + 2) if image._fat[c]]
+
+        with FatImage(self.path) as image:
+            self.assertEqual(image.read_file("test.txt"), b"new")
+        # The root directory and the new file
+        self.assertEqual(len(used), 2)
+
+    def test_open_fat16_image(self):
+        # The boot sector mkfs.vfat writes for a 60MB image without `-F 32`
+        boot = bytearray(SECTOR_SIZE)
+        struct.pack_into("<HBHBHHBH", boot, 11, SECTOR_SIZE, 4, 4, 2, 512, 0, 0xF8, 120)
+        struct.pack_into("<I", boot, 32, 60 * MB // SECTOR_SIZE)
+        boot[510:512] = b"\x55\xAA"
+        with open(self.path, "wb") as f:
+            f.write(boot)
+            f.truncate(60 * MB)
+
+        with self.assertRaisesRegex(ValueError, "FAT12/16 volume, only FAT32 is supported"):
+            FatImage(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,260 @@
+##
+# Streaming parser and result model for the JUnit XML written by UEFI shell based unit tests.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import io
+import json
+import xml.etree.ElementTree
+
+from dataclasses import dataclass, field
+from html import unescape
+from os import PathLike
+
+
+@dataclass
+class TestCaseResult:
+    """The result of a single test case.
+
+    Attributes:
+        name (str): The name of the test case
+        classname (str): The class name of the test case, which the UEFI unit test framework uses as a description
+        time (float | None): Duration of the test case in seconds, if reported
+        failure (str | None): The failure message if the test case failed
+        skipped (bool): Whether or not the test case was skipped
+    """
+    name: str
+    classname: str
+    time: float | None = None
+    failure: str | None = None
+    skipped: bool = False
+
+    @property
+    def passed(self) -> bool:
+        return self.failure is None
+
+
+@dataclass
+class TestSuiteResult:
+    """The results of a test suite.
+
+    Attributes:
+        name (str): The name of the test suite
+        time (float | None): Duration of the test suite in seconds, if reported
+        cases (list[TestCaseResult]): The results of the test cases in the suite
+    """
+    name: str
+    time: float | None = None
+    cases: list[TestCaseResult] = field(default_factory=list)
+
+    @property
+    def failures(self) -> int:
+        return sum(1 for case in self.cases if not case.passed)
+
+    @property
+    def duration(self) -> float | None:
+        """The suite duration, or the sum of the case durations if the suite did not report one."""
+        if self.time is not None:
+            return self.time
+        times = [case.time for case in self.cases if case.time is not None]
+        return sum(times) if times else None
+
+
+@dataclass
+class TestResult:
+    """The results of one test application.
+
+    Attributes:
+        test (str): The file name of the test application (e.g. `MyTestApp.efi`)
+        suites (list[TestSuiteResult]): The results of each test suite the application ran
+        error (str | None): Why no results could be read, e.g. the application produced no result file
+        elapsed (float | None): Wall-clock duration of the test application in seconds, including any reboots, as
+            measured by the startup script
+    """
+    test: str
+    suites: list[TestSuiteResult] = field(default_factory=list)
+    error: str | None = None
+    elapsed: float | None = None
+
+    @property
+    def failures(self) -> int:
+        """The number of failed test cases. A test application without results counts as one failure."""
+        return sum(suite.failures for suite in self.suites) + (1 if self.error else 0)
+
+    @property
+    def duration(self) -> float | None:
+        durations = [suite.duration for suite in self.suites if suite.duration is not None]
+        return sum(durations) if durations else None
+
+
+def _time(element) -> float | None:
+    try:
+        return float(element.attrib["time"])
+    except (KeyError, ValueError):
+        return None
+
+
+def parse_junit(data: bytes) -> list[TestSuiteResult]:
+    """Parses JUnit XML incrementally, keeping only the compact result model in memory.
+
+    Args:
+        data (bytes): The JUnit XML
+
+    Raises:
+        (xml.etree.ElementTree.ParseError): The XML is malformed
+    """
+    suites = []
+    # The enclosing suites of the current element, suites can be nested
+    open_suites = []
+    for event, element in xml.etree.ElementTree.iterparse(io.BytesIO(data), events=("start", "end")):
+        if event == "start":
+            if element.tag == "testsuite":
+                open_suites.append(TestSuiteResult(element.attrib.get("name", ""), _time(element)))
+                suites.append(open_suites[-1])
+            continue
+
+        if element.tag == "testcase":
+            case = TestCaseResult(element.attrib.get("name", ""), element.attrib.get("classname", ""), _time(element))
+            for result in element:
+                if result.tag in ("failure", "error"):
+                    case.failure = unescape(result.attrib.get("message", ""))
+                elif result.tag == "skipped":
+                    case.skipped = True
+            if not open_suites:
+                open_suites.append(TestSuiteResult(""))
+                suites.append(open_suites[-1])
+            open_suites[-1].cases.append(case)
+            element.clear()
+        elif element.tag == "testsuite":
+            open_suites.pop()
+            element.clear()
+    return suites
+
+
+def format_suite(suite: TestSuiteResult) -> str:
+    """Formats a test suite as a summary table with one row per test case."""
+    duration = f"{suite.duration:.3f}s" if suite.duration is not None else "-"
+    lines = [f"{suite.name}: {len(suite.cases)} case(s), {suite.failures} failed, {duration}"]
+    for case in suite.cases:
+        status = "FAIL" if not case.passed else "SKIP" if case.skipped else "PASS"
+        time = f"{case.time:.3f}" if case.time is not None else "-"
+        line = f"\t{status}  {time:>9}  {case.classname}"
+        if case.failure is not None:
+            line += f" - {case.failure}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def format_durations(results: list[TestResult]) -> str:
+    """Formats the durations of the test applications as a table, longest first.
+
+    Wall-clock time is measured by the startup script and includes reboots and application startup. Reported time
+    is the sum of the durations in the JUnit results.
+    """
+    def key(result):
+        return result.elapsed if result.elapsed is not None else (result.duration or 0.0)
+
+    lines = [f"{'Wall-clock':>10}  {'Reported':>10}  Test"]
+    for result in sorted(results, key=key, reverse=True):
+        elapsed = f"{result.elapsed:.0f}s" if result.elapsed is not None else "-"
+        duration = f"{result.duration:.3f}s" if result.duration is not None else "-"
+        lines.append(f"{elapsed:>10}  {duration:>10}  {result.test}")
+    return "\n".join(lines)
+
+
+def _format_time(seconds: float | None) -> str:
+    return f"{seconds:.3f}" if seconds is not None else "0"
+
+
+def write_junit(results: list[TestResult], path: PathLike, exempt: set[str] = frozenset()):
+    """Writes the results of all test applications as a single JUnit XML file.
+
+    Each test suite records its test application as its `package`. A test application without results is written
+    as a suite with a single errored case. The suites of exempt test applications have an `exempt` property.
+
+    Args:
+        results (list[TestResult]): The results of each test application
+        path (PathLike): The file to write
+        exempt (set[str]): The file names of the test applications whose failures are exempt
+    """
+    E = xml.etree.ElementTree.Element
+    SubElement = xml.etree.ElementTree.SubElement
+
+    root = E("testsuites", name="UEFI shell unit tests")
+    total_cases = total_failures = 0
+    total_time = 0.0
+    for result in results:
+        suites = result.suites
+        if result.error:
+            error_case = TestCaseResult(result.test, result.test, None, result.error)
+            suites = suites + [TestSuiteResult(result.test, None, [error_case])]
+
+        for suite in suites:
+            element = SubElement(root, "testsuite", name=suite.name, package=result.test, tests=str(len(suite.cases)),
+                                 failures=str(suite.failures), skipped=str(sum(1 for case in suite.cases if case.skipped)),
+                                 time=_format_time(suite.duration))
+            if result.test in exempt:
+                properties = SubElement(element, "properties")
+                SubElement(properties, "property", name="exempt", value="true")
+            for case in suite.cases:
+                case_element = SubElement(element, "testcase", name=case.name, classname=case.classname,
+                                          time=_format_time(case.time))
+                if case.failure is not None:
+                    SubElement(case_element, "failure", message=case.failure)
+                elif case.skipped:
+                    SubElement(case_element, "skipped")
+            total_cases += len(suite.cases)
+            total_failures += suite.failures
+            total_time += suite.duration or 0.0
+
+    root.set("tests", str(total_cases))
+    root.set("failures", str(total_failures))
+    root.set("time", _format_time(total_time))
+    xml.etree.ElementTree.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def write_summary(results: list[TestResult], path: PathLike, exempt: set[str] = frozenset()):
+    """Writes a JSON summary of the results of all test applications.
+
+    The summary holds the totals of the run and, per test application, its case counts, durations, failed cases
+    and exempt status. `failures` only counts the failures of test applications that are not exempt.
+
+    Args:
+        results (list[TestResult]): The results of each test application
+        path (PathLike): The file to write
+        exempt (set[str]): The file names of the test applications whose failures are exempt
+    """
+    tests = []
+    for result in results:
+        cases = [case for suite in result.suites for case in suite.cases]
+        tests.append({
+            "test": result.test,
+            "exempt": result.test in exempt,
+            "failures": result.failures,
+            "cases": len(cases),
+            "skipped": sum(1 for case in cases if case.skipped),
+            "elapsed": result.elapsed,
+            "duration": result.duration,
+            "error": result.error,
+            "failed_cases": [
+                {"suite": suite.name, "name": case.name, "classname": case.classname, "message": case.failure}
+                for suite in result.suites for case in suite.cases if not case.passed
+            ],
+        })
+
+    summary = {
+        "tests": len(tests),
+        "failed_tests": sum(1 for test in tests if test["failures"]),
+        "cases": sum(test["cases"] for test in tests),
+        "failed_cases": sum(len(test["failed_cases"]) for test in tests),
+        "skipped_cases": sum(test["skipped"] for test in tests),
+        "failures": sum(test["failures"] for test in tests if not test["exempt"]),
+        "exempt_failures": sum(test["failures"] for test in tests if test["exempt"]),
+        "elapsed": sum(test["elapsed"] for test in tests if test["elapsed"] is not None),
+        "duration": sum(test["duration"] for test in tests if test["duration"] is not None),
+        "results": tests,
+    }
+    with open(path, "w") as f:
+        json.dump(summary, f, indent=2)
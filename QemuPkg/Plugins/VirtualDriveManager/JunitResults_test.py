@@ -0,0 +1,131 @@
+##
+# Tests reading the JUnit XML written by UEFI shell based unit tests and writing the combined results.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+import xml.etree.ElementTree
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import JunitResults  # noqa: E402
+
+from JunitResults import parse_junit, write_junit, write_summary  # noqa: E402
+
+JUNIT = b"""<?xml version="1.0" encoding="utf-8"?>
+<testsuites>
+  <testsuite name="Outer" time="1.5">
+    <testsuite name="Inner">
+      <testcase name="InnerPass" classname="Inner pass" time="0.25"/>
+    </testsuite>
+    <testcase name="Pass" classname="Passes" time="0.5"/>
+    <testcase name="Fail" classname="Fails" time="0.75">
+      <failure message="Expected &amp;lt;1&amp;gt;" type="FAIL"/>
+    </testcase>
+  </testsuite>
+  <testsuite name="Second">
+    <testcase name="Error" classname="Errors" time="0.125">
+      <error message="Crashed"/>
+    </testcase>
+    <testcase name="Skip" classname="Skips">
+      <skipped/>
+    </testcase>
+  </testsuite>
+</testsuites>
+"""
+
+
+class ParseJunitTest(unittest.TestCase):
+
+    def test_nested_suites(self):
+        suites = parse_junit(JUNIT)
+
+        self.assertEqual([suite.name for suite in suites], ["Outer", "Inner", "Second"])
+        self.assertEqual([case.name for case in suites[1].cases], ["InnerPass"])
+        # Cases after a nested suite belong to the enclosing suite
+        self.assertEqual([case.name for case in suites[0].cases], ["Pass", "Fail"])
+        self.assertEqual([case.name for case in suites[2].cases], ["Error", "Skip"])
+
+    def test_failures_and_errors(self):
+        cases = {case.name: case for suite in parse_junit(JUNIT) for case in suite.cases}
+
+        self.assertTrue(cases["Pass"].passed)
+        self.assertEqual(cases["Fail"].failure, "Expected <1>")
+        self.assertEqual(cases["Error"].failure, "Crashed")
+        self.assertTrue(cases["Skip"].skipped)
+        self.assertTrue(cases["Skip"].passed)
+        self.assertIsNone(cases["Skip"].time)
+
+    def test_durations(self):
+        suites = parse_junit(JUNIT)
+        result = JunitResults.TestResult("Test.efi", suites)
+
+        self.assertEqual(suites[0].duration, 1.5)
+        # Second reports no time, so its duration is the sum of its cases
+        self.assertEqual(suites[2].duration, 0.125)
+        self.assertEqual(result.failures, 2)
+
+    def test_missing_results(self):
+        result = JunitResults.TestResult("Test.efi", error="No results")
+
+        self.assertEqual(result.failures, 1)
+        self.assertIsNone(result.duration)
+
+
+class WriteResultsTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp = temp_dir.name
+        self.results = [
+            JunitResults.TestResult("Test.efi", parse_junit(JUNIT), elapsed=12.0),
+            JunitResults.TestResult("Exempt.efi", error="No results"),
+        ]
+
+    def test_write_junit(self):
+        path = os.path.join(self.temp, "UnitTestResults.xml")
+        write_junit(self.results, path, exempt={"Exempt.efi"})
+        root = xml.etree.ElementTree.parse(path).getroot()
+
+        self.assertEqual((root.get("tests"), root.get("failures")), ("6", "3"))
+        suites = root.findall("testsuite")
+        self.assertEqual([(suite.get("name"), suite.get("package")) for suite in suites],
+                         [("Outer", "Test.efi"), ("Inner", "Test.efi"), ("Second", "Test.efi"),
+                          ("Exempt.efi", "Exempt.efi")])
+        self.assertEqual(suites[2].get("skipped"), "1")
+        self.assertEqual(suites[0].find("testcase[@name='Fail']/failure").get("message"), "Expected <1>")
+        # The errored test application is a single failed case, only its suite is exempt
+        self.assertEqual(suites[3].find("testcase/failure").get("message"), "No results")
+        self.assertEqual([suite.find("properties/property[@name='exempt']") is not None for suite in suites],
+                         [False, False, False, True])
+
+        # The combined results can be read back
+        with open(path, "rb") as f:
+            self.assertEqual(len(parse_junit(f.read())), 4)
+
+    def test_write_summary(self):
+        path = os.path.join(self.temp, "UnitTestResults.json")
+        write_summary(self.results, path, exempt={"Exempt.efi"})
+        with open(path, "r") as f:
+            summary = json.load(f)
+
+        self.assertEqual({key: summary[key] for key in ("tests", "failed_tests", "cases", "failed_cases",
+                                                        "skipped_cases", "failures", "exempt_failures", "elapsed")},
+                         {"tests": 2, "failed_tests": 2, "cases": 5, "failed_cases": 2, "skipped_cases": 1,
+                          "failures": 2, "exempt_failures": 1, "elapsed": 12.0})
+        test, exempt = summary["results"]
+        self.assertFalse(test["exempt"])
+        self.assertEqual([case["name"] for case in test["failed_cases"]], ["Fail", "Error"])
+        self.assertTrue(exempt["exempt"])
+        self.assertEqual(exempt["error"], "No results")
+
+
+if __name__ == "__main__":
+    unittest.main()
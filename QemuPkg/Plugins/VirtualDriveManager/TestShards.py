@@ -0,0 +1,149 @@
+##
+# Splits UEFI shell based unit tests into shards that run on separate QEMU instances.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import heapq
+import json
+import logging
+import statistics
+
+from dataclasses import dataclass, field
+from os import PathLike
+from pathlib import Path
+
+from JunitResults import TestResult
+
+
+# The duration assumed for a test with no recorded duration, if no test has one
+DEFAULT_TEST_DURATION = 10.0
+
+# An automatic shard timeout allows this multiple of the expected duration of the shard, plus the boot allowance
+AUTO_TIMEOUT_FACTOR = 3.0
+AUTO_TIMEOUT_ALLOWANCE = 300.0
+
+
+@dataclass
+class TestShard:
+    """The tests run by one QEMU instance.
+
+    Attributes:
+        index (int): The index of the shard
+        tests (list[Path]): The test applications in the shard
+        estimate (float): The expected duration of the shard in seconds, from recorded test durations
+        drive (VirtualDrive): The virtual drive the shard runs its tests from
+        env (ShardEnvironment): The environment QEMU is run with
+        returncode (int | None): The QEMU exit code, once the shard has run
+    """
+    index: int
+    tests: list[Path] = field(default_factory=list)
+    estimate: float = 0.0
+    drive: object = None
+    env: object = None
+    returncode: int | None = None
+
+
+class ShardEnvironment:
+    """A view of the build environment with values overridden for a single shard.
+
+    Values that are not overridden are read from the build environment, which is not modified.
+    """
+
+    def __init__(self, env, overrides: dict[str, str] = None):
+        self._env = env
+        self._overrides = dict(overrides or {})
+
+    def GetValue(self, name: str, default: str = None) -> str:
+        if name in self._overrides:
+            return self._overrides[name]
+        return self._env.GetValue(name, default)
+
+    def GetBuildValue(self, name: str, *args) -> str:
+        if name in self._overrides:
+            return self._overrides[name]
+        return self._env.GetBuildValue(name, *args)
+
+    def SetValue(self, name: str, value: str, comment: str = "", *args) -> bool:
+        self._overrides[name] = value
+        return True
+
+    def __getattr__(self, name):
+        return getattr(self._env, name)
+
+
+def load_durations(path: PathLike) -> dict[str, float]:
+    """Returns the recorded duration of each test, keyed by test file name. Missing or invalid records are ignored."""
+    try:
+        with open(path, "r") as f:
+            return {name: float(duration) for name, duration in json.load(f).items()}
+    except (OSError, ValueError, AttributeError) as e:
+        logging.debug(f"No test durations loaded from {path}. {e}")
+        return {}
+
+
+def save_durations(path: PathLike, results: list[TestResult]):
+    """Records the duration of each test with results, keeping the records of tests that did not run.
+
+    The wall-clock duration measured by the startup script is preferred over the duration in the JUnit results, as
+    it includes reboots and application startup.
+    """
+    durations = load_durations(path)
+    for result in results:
+        duration = result.elapsed if result.elapsed is not None else result.duration
+        if duration is not None:
+            durations[result.test] = duration
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(durations, f, indent=2, sort_keys=True)
+
+
+def shard_timeout(value: str, estimate: float) -> float | None:
+    """Returns the total timeout of a shard in seconds from a `TEST_SHARD_TIMEOUT` value.
+
+    Args:
+        value (str): A number of seconds, or `AUTO` to scale the timeout with the expected duration of the shard
+        estimate (float): The expected duration of the shard in seconds
+
+    Returns:
+        (float | None): The timeout, or None if `value` is not set or is 0
+    """
+    if not value:
+        return None
+    if value.strip().upper() == "AUTO":
+        return estimate * AUTO_TIMEOUT_FACTOR + AUTO_TIMEOUT_ALLOWANCE
+    return float(value) or None
+
+
+def partition(tests: list[PathLike], count: int, durations: dict[str, float] = None) -> list[TestShard]:
+    """Splits tests into at most `count` shards with similar expected durations.
+
+    Tests are assigned longest first to the shard with the lowest expected duration. Tests without a recorded
+    duration are expected to take the median recorded duration.
+
+    Args:
+        tests (list[PathLike]): The test applications
+        count (int): The number of shards
+        durations (dict[str, float]): The recorded duration of each test, keyed by test file name
+
+    Returns:
+        (list[TestShard]): The non-empty shards. Each shard keeps its tests in the order of `tests`.
+    """
+    durations = durations or {}
+    tests = [Path(test) for test in tests]
+    known = [durations[test.name] for test in tests if test.name in durations]
+    default = statistics.median(known) if known else DEFAULT_TEST_DURATION
+
+    order = {test: i for i, test in enumerate(tests)}
+    shards = [TestShard(i) for i in range(max(1, min(count, len(tests))))]
+    heap = [(0.0, shard.index) for shard in shards]
+    for test in sorted(tests, key=lambda t: durations.get(t.name, default), reverse=True):
+        estimate, index = heapq.heappop(heap)
+        shards[index].tests.append(test)
+        shards[index].estimate = estimate + durations.get(test.name, default)
+        heapq.heappush(heap, (shards[index].estimate, index))
+
+    for shard in shards:
+        shard.tests.sort(key=order.get)
+    return [shard for shard in shards if shard.tests]
@@ -0,0 +1,68 @@
+##
+# Tests splitting unit tests into shards and the shard timeouts.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import os
+import sys
+import unittest
+
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from TestShards import (AUTO_TIMEOUT_ALLOWANCE, AUTO_TIMEOUT_FACTOR, DEFAULT_TEST_DURATION, partition,  # noqa: E402
+                        shard_timeout)
+
+
+class PartitionTest(unittest.TestCase):
+
+    def test_longest_first_to_least_loaded_shard(self):
+        tests = ["A.efi", "B.efi", "C.efi", "D.efi", "E.efi"]
+        durations = {"A.efi": 1.0, "B.efi": 8.0, "C.efi": 5.0, "D.efi": 4.0, "E.efi": 3.0}
+        shards = partition(tests, 2, durations)
+
+        # B (8) and C (5) start the shards, D (4) joins C, E (3) joins B, A (1) joins C
+        self.assertEqual([shard.tests for shard in shards],
+                         [[Path("B.efi"), Path("E.efi")], [Path("A.efi"), Path("C.efi"), Path("D.efi")]])
+        self.assertEqual([shard.estimate for shard in shards], [11.0, 10.0])
+
+    def test_unknown_tests_take_median_duration(self):
+        durations = {"A.efi": 2.0, "B.efi": 4.0, "C.efi": 30.0}
+        shards = partition(["A.efi", "B.efi", "C.efi", "New.efi"], 2, durations)
+
+        # New.efi is expected to take the median of 4 seconds
+        self.assertEqual([shard.tests for shard in shards],
+                         [[Path("C.efi")], [Path("A.efi"), Path("B.efi"), Path("New.efi")]])
+        self.assertEqual(shards[1].estimate, 10.0)
+
+    def test_no_recorded_durations(self):
+        shards = partition(["A.efi", "B.efi", "C.efi"], 2)
+
+        self.assertEqual(sorted(len(shard.tests) for shard in shards), [1, 2])
+        self.assertEqual(sum(shard.estimate for shard in shards), 3 * DEFAULT_TEST_DURATION)
+
+    def test_more_shards_than_tests(self):
+        shards = partition(["A.efi", "B.efi"], 8)
+
+        self.assertEqual([shard.index for shard in shards], [0, 1])
+
+
+class ShardTimeoutTest(unittest.TestCase):
+
+    def test_auto(self):
+        self.assertEqual(shard_timeout("auto", 100.0), 100.0 * AUTO_TIMEOUT_FACTOR + AUTO_TIMEOUT_ALLOWANCE)
+
+    def test_seconds(self):
+        self.assertEqual(shard_timeout("900", 100.0), 900.0)
+
+    def test_disabled(self):
+        self.assertIsNone(shard_timeout(None, 100.0))
+        self.assertIsNone(shard_timeout("", 100.0))
+        self.assertIsNone(shard_timeout("0", 100.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,25 +5,110 @@
 # SPDX-License-Identifier: BSD-2-Clause-Patent
 ##
 
-import errno
+import fnmatch
+import io
+import json
 import logging
-import string
+import re
+import shlex
 import shutil
+import subprocess
 import tempfile
+import time
 import os
-import xml.etree.ElementTree
 
+from concurrent.futures import ThreadPoolExecutor
 from os import PathLike
 from pathlib import Path
 
 from edk2toolext.environment.plugintypes.uefi_helper_plugin import IUefiHelperPlugin
 from edk2toolext.environment import shell_environment
 from edk2toollib.utility_functions import RunCmd
-from html import unescape
+
+from FatImage import FatImage
+from FileUtils import clone_file, hash_file, reflink
+from JunitResults import TestResult, format_durations, format_suite, parse_junit, write_junit, write_summary
+from TestShards import ShardEnvironment, TestShard, load_durations, partition, save_durations, shard_timeout
 
 
 logger = logging.getLogger(__name__)
 
+MB = 1024 * 1024
+
+# Used when the virtual drive size is calculated from the files placed on it. The headroom leaves space for the
+# results, logs and audit data the tests write back to the drive.
+AUTO_SIZE_MIN_MB = 64
+AUTO_SIZE_HEADROOM_MB = 32
+AUTO_SIZE_CLUSTER_SIZE = 4096
+
+
+# Run after the tests by `add_tests` to dump the page tables for `generate_paging_audit`
+PAGING_AUDIT_APP = "DxePagingAuditTestApp.efi"
+
+# Per test timestamps written by the startup script generated by `add_tests`. Each marker line is followed by the
+# output of the shell `time` command, e.g. `12:34:56 (UTC+00:00)`.
+TIMING_FILE_SUFFIX = "_TIMING.TXT"
+TIMING_RESULT_FILE_SUFFIX = "_TIMING_RESULT.TXT"
+TIMING_START = "START"
+TIMING_END = "END"
+TIMING_STAMP = re.compile(r"(\d{1,2}):(\d{2}):(\d{2})")
+
+# The combined results of all tests, written to the unit test results directory by `write_results`
+RESULTS_JUNIT_FILE = "UnitTestResults.xml"
+RESULTS_SUMMARY_FILE = "UnitTestResults.json"
+
+# Recorded in the unit test results directory by `record_test_durations` and used to balance test shards
+TEST_DURATIONS_FILE = "TestDurations.json"
+
+# Environment values holding TCP ports. Each shard uses the port plus its index.
+SHARD_PORT_VALUES = ("GDB_SERVER", "SERIAL_PORT", "MONITOR_PORT")
+
+
+def _matches(name: str, pattern: str) -> bool:
+    """Returns if a file name on the virtual drive matches a glob pattern. FAT names are case insensitive."""
+    return fnmatch.fnmatchcase(name.upper(), pattern.upper())
+
+
+def _parse_timing(data: bytes) -> float | None:
+    """Returns the seconds from the first START to the last END stamp of a timing file, or None if incomplete.
+
+    The shell `time` command has a resolution of one second and no date, so stamps that go backwards are taken to
+    have passed midnight.
+    """
+    stamps = []
+    marker = None
+    elapsed = 0
+    for line in data.decode("ascii", errors="replace").splitlines():
+        line = line.strip()
+        if line in (TIMING_START, TIMING_END):
+            marker = line
+            continue
+        match = TIMING_STAMP.search(line)
+        if match is None or marker is None:
+            continue
+        hours, minutes, seconds = (int(group) for group in match.groups())
+        stamp = hours * 3600 + minutes * 60 + seconds + elapsed
+        if stamps and stamp < stamps[-1][1]:
+            elapsed += 24 * 3600
+            stamp += 24 * 3600
+        stamps.append((marker, stamp))
+        marker = None
+
+    starts = [stamp for marker, stamp in stamps if marker == TIMING_START]
+    ends = [stamp for marker, stamp in stamps if marker == TIMING_END]
+    if not starts or not ends or ends[-1] < starts[0]:
+        return None
+    return float(ends[-1] - starts[0])
+
+
+def _save_files(contents: dict[str, bytes], local_dir: PathLike = None):
+    """Writes files retrieved from a virtual drive to `local_dir`, if provided."""
+    if local_dir is None:
+        return
+    Path(local_dir).mkdir(parents=True, exist_ok=True)
+    for virtual_path, data in contents.items():
+        Path(local_dir, Path(virtual_path.replace("\\", "/")).name).write_bytes(data)
+
 
 class StartupScript:
     FS_FINDER_SCRIPT = r'''
@@ -67,22 +152,64 @@ class VirtualDrive:
     Attributes:
         drive_path (Path): the path to the drive
     """
+    # Identifies the on-disk format created by `make_drive`. Blank drive templates are only shared between drives
+    # of the same format and size.
+    FORMAT = None
+
     def __init__(self, path: PathLike):
         """Initializes the virtual drive."""
         self.drive_path = Path(path)
+        self.template_dir = None
 
     def exists(self) -> bool:
         """Returns if the Virtual drive exists at `drive_path`."""
         return self.drive_path.exists()
 
+    def capacity(self) -> int | None:
+        """Returns the size of the virtual drive in MB, or None if it does not exist or cannot be determined."""
+        if not self.exists():
+            return None
+        return self.drive_path.stat().st_size // MB
+
     def wipe(self, size: int = 60):
-        """Deletes the virtual drive and creates an empty one at the same location."""
+        """Deletes the virtual drive and creates an empty one at the same location.
+
+        If `template_dir` is set, the empty drive is cloned from a cached blank drive of the same size and format,
+        which is created on first use. Cloning uses a reflink when the file system supports it.
+        """
         self.delete()
+
+        template = self._template_path(size)
+        if template is not None and template.exists():
+            try:
+                clone_file(template, self.drive_path)
+                self._on_created()
+                return
+            except OSError as e:
+                logger.warning(f"Failed to clone {template}, formatting a new drive instead. {e}")
+                self.delete()
+
         self.make_drive(size)
-    
+
+        if template is not None:
+            staging = template.with_name(f"{template.name}.{os.getpid()}.tmp")
+            try:
+                template.parent.mkdir(parents=True, exist_ok=True)
+                clone_file(self.drive_path, staging)
+                os.replace(staging, template)
+            except OSError as e:
+                logger.warning(f"Failed to cache a blank drive template at {template}. {e}")
+                staging.unlink(missing_ok=True)
+
+    @property
+    def manifest_path(self) -> Path:
+        """The manifest that records the files synchronized to the drive by `VirtualDriveManager.sync_files`."""
+        return self.drive_path.with_name(self.drive_path.name + ".manifest.json")
+
     def delete(self):
         """Deletes the virtual drive."""
         self.drive_path.unlink(missing_ok=True)
+        self.manifest_path.unlink(missing_ok=True)
 
     def add_startup_script(self, lines: list[str] = [], auto_shutdown = True):
         """Adds a startup script that executes on boot.
@@ -102,15 +229,53 @@ class VirtualDrive:
         nsh.write_out(nsh_path, auto_shutdown)
         self.add_file(nsh_path)
 
-    def add_files(self, filepaths: list[str]):
-        """Adds files to the root directory of the virtual drive."""
+    def _template_path(self, size: int) -> Path | None:
+        """Returns the path of the cached blank drive for `size`, or None if templates are not used."""
+        if self.template_dir is None or self.FORMAT is None:
+            return None
+        return Path(self.template_dir) / f"Blank_{self.FORMAT}_{size}MB{self.drive_path.suffix}"
+
+    def _on_created(self):
+        """Called after the drive was cloned from a blank template."""
+        pass
+
+    def add_files(self, filepaths: list[PathLike]) -> dict[Path, bool]:
+        """Adds files to the root directory of the virtual drive.
+
+        The default implementation inserts one file at a time. Backends that can insert many files in a single
+        operation should override this.
+
+        Args:
+            filepaths (list[PathLike]): The files to insert
+
+        Returns:
+            (dict[Path, bool]): Whether or not each file was inserted into the drive
+        """
+        status = {}
         for filepath in filepaths:
-            self.add_file(filepath)
+            try:
+                self.add_file(filepath)
+                status[Path(filepath)] = True
+            except RuntimeError:
+                status[Path(filepath)] = False
+        return status
 
     def add_file(self, file: PathLike):
         """Adds a file to the root directory of the virtual drive."""
         raise NotImplementedError
 
+    def delete_file(self, virtual_path: PathLike):
+        """Deletes a file from the virtual drive.
+
+        Args:
+            virtual_path (PathLike): Path on the virtual drive to the file
+        """
+        raise NotImplementedError
+
+    def list_files(self) -> list[str]:
+        """Returns the names of the files in the root directory of the virtual drive."""
+        raise NotImplementedError
+
     def make_drive(self, size: int = 60):
         """Creates a virtual drive at self.drive_path."""
         raise NotImplementedError
@@ -124,9 +289,11 @@ class VirtualDrive:
         """
         raise NotImplementedError
 
-    def get_file_contents(self, virtual_path: PathLike, local_path: PathLike = None) -> str:
+    def get_file_contents(self, virtual_path: PathLike, local_path: PathLike = None) -> bytes:
         """Gets a contents from a file from the virtual drive. Optionally save the file too.
 
+        The contents are returned from memory. A local copy is only written when `local_path` is provided.
+
         Args:
             virtual_path (PathLike): The path to the file on the virtual drive
             local_path (PathLike): The path to save the file to
@@ -136,23 +303,50 @@ class VirtualDrive:
         """
         raise NotImplementedError
 
+    def get_files(self, virtual_paths: list[PathLike] | str, local_dir: PathLike = None) -> dict[str, bytes]:
+        """Gets the contents of many files from the virtual drive in one operation. Optionally save the files too.
+
+        The default implementation reads one file at a time. Backends that can extract many files in a single
+        operation should override this.
+
+        Args:
+            virtual_paths (list[PathLike] | str): The paths of the files on the virtual drive, or a glob pattern
+                (e.g. `*_JUNIT_RESULT.XML`) matched case insensitively against the files in the root directory
+            local_dir (PathLike): A directory to save the files to
+
+        Returns:
+            (dict[str, bytes]): The contents of each file, keyed by the requested path or, for a pattern, by the
+                name of the matched file. Files that do not exist on the drive are omitted.
+        """
+        if isinstance(virtual_paths, str):
+            virtual_paths = [name for name in self.list_files() if _matches(name, virtual_paths)]
+
+        contents = {}
+        for virtual_path in virtual_paths:
+            try:
+                contents[str(virtual_path)] = self.get_file_contents(virtual_path)
+            except RuntimeError:
+                continue
+
+        _save_files(contents, local_dir)
+        return contents
+
 
 class LinuxVirtualDrive(VirtualDrive):
+    FORMAT = "vfat"
+
+    # Upper bound on the length of the source file list passed to a single mcopy invocation
+    MCOPY_MAX_ARGS_LENGTH = 65536
+
+    # With `-i <image>`, mtools addresses the image itself as the `::` drive. No drive letter, mtools config file
+    # or lookup of the host mounts is needed, so each instance is independent of every other drive.
+    DRIVE = "::"
+
     def __init__(self, path: PathLike):
         super().__init__(path)
-        self.drive_letter = self._find_unused_drive_letter()
-
-        conf_path = os.path.join(os.path.dirname(self.drive_path), "mtool.conf")
-        if os.path.exists(conf_path):
-            shell_environment.GetEnvironment().set_shell_var("MTOOLSRC", conf_path)
-        elif os.path.exists(self.drive_path):
-            logger.error("VirtualDrive.img exists from a previous build but "
-                         "mtool.conf is not in the same directory. Add "
-                         f"mtool.conf or delete {self.drive_path} to recreate "
-                         "the virtual drive and the corresponding mtool.conf "
-                         "file.")
-            raise FileNotFoundError(
-                errno.ENOENT, os.strerror(errno.ENOENT), conf_path)
+        # Equivalent to `mtools_skip_check=1` in an mtools config file. Images formatted by other tools may not pass
+        # the strict consistency checks mtools performs by default.
+        shell_environment.GetEnvironment().set_shell_var("MTOOLS_SKIP_CHECK", "1")
 
     def make_drive(self, size: int = 60):
         """Creates a virtual hard drive
@@ -163,12 +357,11 @@ class LinuxVirtualDrive(VirtualDrive):
         Raises:
         (RuntimeError): The drive could not be created
         """
-        # Create an image
-        cmd = "dd"
-        args = f"if=/dev/zero of={self.drive_path} bs=1M count={size}"
-        result = RunCmd(cmd, args)
-        if result != 0:
-            e = f"[{cmd} {args}] Result: {result}"
+        # Create a sparse image. Blocks are only allocated once mkfs.vfat or mcopy write to them.
+        try:
+            with open(self.drive_path, "wb") as f:
+                f.truncate(size * MB)
+        except OSError as e:
             logger.error("Drive could not be created.")
             logger.error(e)
             raise RuntimeError(e)
@@ -180,7 +373,7 @@ class LinuxVirtualDrive(VirtualDrive):
             logging.error(e)
             raise RuntimeError(e)
 
-        args = f"{self.drive_path}"
+        args = f'"{self.drive_path}"'
         result = RunCmd(cmd, args)
         if result != 0:
             e = f"[{cmd} {args}] Result: {result}"
@@ -188,27 +381,10 @@ class LinuxVirtualDrive(VirtualDrive):
             logger.error(e)
             raise RuntimeError(e)
 
-        rc = 0
-        # Create an mtools config file to virtually map the image to a drive letter
-        conf_path = os.path.join(os.path.dirname(self.drive_path), "mtool.conf")
-        if os.path.exists(conf_path):
-            # This should be repopulated per build
-            rc |= RunCmd("rm", conf_path)
-        rc |= RunCmd("echo", "mtools_skip_check=1 > ~/.mtoolsrc")
-        rc |= RunCmd("echo", f"drive+ {self.drive_letter}: >> {conf_path}")
-        rc |= RunCmd("echo", f"\"  file=\\\"{self.drive_path}\\\" exclusive\" >> {conf_path}")
-        shell_environment.GetEnvironment().set_shell_var ("MTOOLSRC", conf_path)
-        
-        if rc != 0:
-            self.delete()
-            e = f"Failed to map image to drive letter. Review above command errors."
-            logger.error(e)
-            raise RuntimeError(e)
-
     def add_file(self, filepath: PathLike):
         """Adds a file to the virtual drive."""
         cmd = "mcopy"
-        args = f"-D overwrite -i {str(self.drive_path)} {filepath} {self.drive_letter}:"
+        args = f'-D overwrite -i "{self.drive_path}" "{filepath}" {self.DRIVE}'
         result = RunCmd(cmd, args)
         if result != 0:
             e = f"[{cmd} {args}] Result: {result}"
@@ -216,6 +392,67 @@ class LinuxVirtualDrive(VirtualDrive):
             logger.error(e)
             raise RuntimeError(e)
 
+    def add_files(self, filepaths: list[PathLike]) -> dict[Path, bool]:
+        """Adds files to the virtual drive using as few mcopy invocations as possible.
+
+        Files are inserted in batches limited by `MCOPY_MAX_ARGS_LENGTH`. If a batch fails, the files in that batch
+        are inserted one at a time to determine which file(s) could not be inserted.
+
+        Args:
+            filepaths (list[PathLike]): The files to insert
+
+        Returns:
+            (dict[Path, bool]): Whether or not each file was inserted into the drive
+        """
+        status = {}
+        for batch in self._batch_files([Path(f) for f in filepaths]):
+            cmd = "mcopy"
+            sources = " ".join(f'"{f}"' for f in batch)
+            args = f'-D overwrite -i "{self.drive_path}" {sources} {self.DRIVE}'
+            result = RunCmd(cmd, args)
+            if result == 0:
+                status.update(dict.fromkeys(batch, True))
+                continue
+
+            logger.warning(f"[{cmd}] Result: {result}. Retrying {len(batch)} file(s) individually.")
+            status.update(super().add_files(batch))
+        return status
+
+    def delete_file(self, virtual_path: PathLike):
+        """Deletes a file from the virtual drive.
+
+        Raises:
+            (RuntimeError): Failed to delete the file
+        """
+        cmd = "mdel"
+        args = f'-i "{self.drive_path}" "{self.DRIVE}/{virtual_path}"'
+        result = RunCmd(cmd, args)
+        if result != 0:
+            e = f"[{cmd} {args}] Result: {result}"
+            logger.error(f"Failed to delete {virtual_path} from drive.")
+            logger.error(e)
+            raise RuntimeError(e)
+
+    def list_files(self) -> list[str]:
+        """Returns the names of the files in the root directory of the virtual drive.
+
+        Raises:
+            (RuntimeError): Failed to list the drive
+        """
+        cmd = "mdir"
+        args = f'-b -i "{self.drive_path}" {self.DRIVE}'
+        outstream = io.StringIO()
+        result = RunCmd(cmd, args, outstream=outstream, logging_level=logging.DEBUG)
+        if result != 0:
+            e = f"[{cmd} {args}] Result: {result}"
+            logger.error("Failed to list the files on the drive.")
+            logger.error(e)
+            raise RuntimeError(e)
+
+        # Bare output is one `<drive>:/<name>` line per entry, directories end with a `/`
+        lines = [line.strip() for line in outstream.getvalue().splitlines()]
+        return [line.rsplit("/", 1)[-1] for line in lines if line and not line.endswith("/")]
+
     def get_file(self, virtual_path: PathLike, local_path: PathLike):
         """Gets a file from the virtual drive.
 
@@ -227,8 +464,8 @@ class LinuxVirtualDrive(VirtualDrive):
             (RuntimeError): Failed to get the filepath
         """
         cmd = "mcopy"
-        full_path = os.path.join(self.drive_letter + ":", virtual_path)
-        args = f"-n -i {self.drive_path} {full_path} {local_path}"
+        full_path = f"{self.DRIVE}/{virtual_path}"
+        args = f'-n -i "{self.drive_path}" "{full_path}" "{local_path}"'
         result = RunCmd(cmd, args)
         if result != 0:
             e = f"[{cmd} {args}] Result: {result}"
@@ -236,9 +473,12 @@ class LinuxVirtualDrive(VirtualDrive):
             logger.error(e)
             raise RuntimeError(e)
 
-    def get_file_contents(self, virtual_path: PathLike, local_path: PathLike = None):
+    def get_file_contents(self, virtual_path: PathLike, local_path: PathLike = None) -> bytes:
         """Gets a contents from a file from the virtual drive. Optionally save the file too.
 
+        The contents are streamed from the image by `mtype`, no intermediate file is written unless `local_path`
+        is provided.
+
         Args:
             virtual_path (PathLike): The path to the file on the virtual drive
             local_path (PathLike): The path to save the file to
@@ -246,34 +486,80 @@ class LinuxVirtualDrive(VirtualDrive):
         Raises:
             (RuntimeError): Failed to get the filepath
         """
-        if local_path is None:
-            local_path = tempfile.mktemp()
-        self.get_file(virtual_path, local_path)
-
-        with open(local_path, "rb") as f:
-            return f.read()
+        # mtype does not translate line endings unless -t is passed, so the output is the raw file contents. RunCmd
+        # decodes the output as text, so mtype is run directly. The stuart shell environment, e.g. MTOOLS_SKIP_CHECK,
+        # is kept in os.environ, which RunCmd runs commands with too.
+        cmd = ["mtype", "-i", str(self.drive_path), f"{self.DRIVE}/{virtual_path}"]
+        logger.debug(f"Cmd to run is: {shlex.join(cmd)}")
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=os.environ.copy())
+        except OSError as e:
+            logger.error(f"Failed to get {virtual_path} from drive.")
+            logger.error(e)
+            raise RuntimeError(e)
+        logger.debug(f"[{cmd[0]}] Return Code: {result.returncode:#010x}, {len(result.stdout)} byte(s)")
+        if result.returncode != 0:
+            e = f"[{shlex.join(cmd)}] Result: {result.returncode} {result.stderr.decode(errors='replace').strip()}"
+            logger.error(f"Failed to get {virtual_path} from drive.")
+            logger.error(e)
+            raise RuntimeError(e)
 
-    def _find_unused_drive_letter(self):
-        for drive_letter in string.ascii_lowercase:
-            cmd = "grep"
-            args = f"-i '/mnt/{drive_letter} ' /etc/mtab"
-            result = RunCmd(cmd, args)
+        if local_path is not None:
+            Path(local_path).write_bytes(result.stdout)
+        return result.stdout
 
-            # per man grep, ret 1 is no lines matched, so we can return
-            if result == 1:
-                return drive_letter
+    def get_files(self, virtual_paths: list[PathLike] | str, local_dir: PathLike = None) -> dict[str, bytes]:
+        """Gets the contents of many files from the virtual drive using as few mcopy invocations as possible.
 
-            # per man grep, ret 0 is lines were matched
-            elif result == 0:
-                continue
+        Args:
+            virtual_paths (list[PathLike] | str): The paths of the files on the virtual drive, or a glob pattern
+                (e.g. `*_JUNIT_RESULT.XML`) matched against the files in the root directory
+            local_dir (PathLike): A directory to save the files to
 
+        Returns:
+            (dict[str, bytes]): The contents of each file, keyed by the requested path or, for a pattern, by the
+                name of the matched file. Files that do not exist on the drive are omitted.
+        """
+        pattern = virtual_paths if isinstance(virtual_paths, str) else None
+        sources = [pattern] if pattern else [str(p) for p in virtual_paths]
+
+        contents = {}
+        with tempfile.TemporaryDirectory() as extract_dir:
+            for batch in self._batch_files(sources):
+                cmd = "mcopy"
+                files = " ".join(f'"{self.DRIVE}/{f}"' for f in batch)
+                args = f'-n -i "{self.drive_path}" {files} "{extract_dir}"'
+                # Missing files are expected (e.g. a test that produced no result), and mcopy still copies the rest
+                RunCmd(cmd, args, logging_level=logging.DEBUG)
+
+            extracted = {f.name.upper(): f for f in Path(extract_dir).iterdir()}
+            if pattern:
+                contents = {f.name: f.read_bytes() for f in extracted.values() if _matches(f.name, pattern)}
             else:
-                e = f"[{cmd} {args}] Result: {result}"
-                logger.error("Failed to check if drive letter is in use.")
-                logger.error(e)
-                raise RuntimeError(e)
-
-        raise ValueError("No unused drive letters available")
+                for virtual_path in sources:
+                    local_file = extracted.get(Path(virtual_path.replace("\\", "/")).name.upper())
+                    if local_file is not None:
+                        contents[virtual_path] = local_file.read_bytes()
+
+        _save_files(contents, local_dir)
+        return contents
+
+    def _batch_files(self, filepaths: list[Path]) -> list[list[Path]]:
+        """Splits `filepaths` into batches that fit on a single mcopy command line."""
+        batches = []
+        batch = []
+        length = 0
+        for filepath in filepaths:
+            arg_length = len(str(filepath)) + 3
+            if batch and length + arg_length > self.MCOPY_MAX_ARGS_LENGTH:
+                batches.append(batch)
+                batch = []
+                length = 0
+            batch.append(filepath)
+            length += arg_length
+        if batch:
+            batches.append(batch)
+        return batches
 
     def _locate_cmd(self, cmd: str) -> str | None:
         """Locates a command on a linux file system using `which`."""  
@@ -296,10 +582,16 @@ class LinuxVirtualDrive(VirtualDrive):
         return None
 
 class WindowsVirtualDrive(VirtualDrive):
+    FORMAT = "vhd"
+
     def __init__(self, path: PathLike):
         super().__init__(path)
         self.drive_path = Path(path)
 
+    def capacity(self) -> int | None:
+        """The size of a VHD file does not reflect the size of the disk it contains."""
+        return None
+
     def make_drive(self, size: int = 60):
         """Creates a virtual hard drive
 
@@ -311,7 +603,7 @@ class WindowsVirtualDrive(VirtualDrive):
         """
         # Create an image
         cmd = "VHDCreate"
-        args = f"-sz {size}MB {self.drive_path}"
+        args = f'-sz {size}MB "{self.drive_path}"'
         result = RunCmd(cmd, args)
         if result != 0:
             e = f"[{cmd} {args}] Result: {result}"
@@ -321,7 +613,7 @@ class WindowsVirtualDrive(VirtualDrive):
 
         # Format the image as FAT32
         cmd = "DiskFormat"
-        args = f"-ft fat -ptt bios {self.drive_path}"
+        args = f'-ft fat -ptt bios "{self.drive_path}"'
         result = RunCmd(cmd, args)
         if result != 0:
             e = f"[{cmd} {args}] Result: {result}"
@@ -334,7 +626,7 @@ class WindowsVirtualDrive(VirtualDrive):
         filename = Path(filepath).name
 
         cmd = "FileInsert"
-        args = f"{filepath} {filename} {str(self.drive_path)}"
+        args = f'"{filepath}" {filename} "{self.drive_path}"'
         result = RunCmd(cmd, args)
         if result != 0:
             e = f"[{cmd} {args}] Result: {result}"
@@ -353,7 +645,7 @@ class WindowsVirtualDrive(VirtualDrive):
             (RuntimeError): Failed to get the filepath
         """
         cmd = "FileExtract"
-        args = f"{virtual_path} {local_path} {self.drive_path}"
+        args = f'{virtual_path} "{local_path}" "{self.drive_path}"'
         result = RunCmd(cmd, args)
         if result != 0:
             e = f"[{cmd} {args}] Result: {result}"
@@ -361,9 +653,12 @@ class WindowsVirtualDrive(VirtualDrive):
             logging.error(e)
             raise RuntimeError(e)
 
-    def get_file_contents(self, virtual_path: PathLike, local_path: PathLike = None):
+    def get_file_contents(self, virtual_path: PathLike, local_path: PathLike = None) -> bytes:
         """Gets a contents from a file from the virtual drive. Optionally save the file too.
 
+        FileExtract can only write to a file, so without `local_path` the file is extracted to a temporary
+        directory that is removed before returning.
+
         Args:
             virtual_path (PathLike): The path to the file on the virtual drive
             local_path (PathLike): The path to save the file to
@@ -371,32 +666,483 @@ class WindowsVirtualDrive(VirtualDrive):
         Raises:
             (RuntimeError): Failed to get the filepath
         """
-        if local_path is None:
-            local_path = tempfile.mktemp()
+        if local_path is not None:
+            self.get_file(virtual_path, local_path)
+            return Path(local_path).read_bytes()
+
+        with tempfile.TemporaryDirectory() as extract_dir:
+            extract_path = Path(extract_dir, Path(str(virtual_path).replace("\\", "/")).name)
+            self.get_file(virtual_path, extract_path)
+            return extract_path.read_bytes()
+
+
+class FatVirtualDrive(VirtualDrive):
+    """A virtual drive backed by a raw FAT32 image that is formatted, read and written in-process.
+
+    No external tools are required, and every operation works directly on the image file.
+    """
+    FORMAT = "fat32"
+
+    def make_drive(self, size: int = 60):
+        """Creates a virtual hard drive
+
+        Args:
+            size (int | Optional): The size of the hard drive in MB
+
+        Raises:
+            (RuntimeError): The drive could not be created
+        """
+        try:
+            FatImage.format(self.drive_path, size).close()
+        except (OSError, ValueError) as e:
+            logger.error("Drive could not be created.")
+            logger.error(e)
+            raise RuntimeError(e)
+
+    def add_file(self, filepath: PathLike):
+        """Adds a file to the virtual drive."""
+        status = self.add_files([filepath])
+        if not status[Path(filepath)]:
+            raise RuntimeError(f"Failed to insert {filepath} into drive.")
+
+    def add_files(self, filepaths: list[PathLike]) -> dict[Path, bool]:
+        """Adds files to the virtual drive, opening the image only once.
+
+        Args:
+            filepaths (list[PathLike]): The files to insert
+
+        Returns:
+            (dict[Path, bool]): Whether or not each file was inserted into the drive
+        """
+        status = {}
+        with self._open() as image:
+            for filepath in map(Path, filepaths):
+                try:
+                    image.write_file(filepath.name, filepath.read_bytes())
+                    status[filepath] = True
+                except (OSError, ValueError) as e:
+                    logger.error(f"Failed to insert {filepath} into drive.")
+                    logger.error(e)
+                    status[filepath] = False
+        return status
+
+    def delete_file(self, virtual_path: PathLike):
+        """Deletes a file from the virtual drive.
+
+        Raises:
+            (RuntimeError): Failed to delete the file
+        """
+        try:
+            with self._open() as image:
+                image.delete(str(virtual_path))
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to delete {virtual_path} from drive.")
+            logger.error(e)
+            raise RuntimeError(e)
+
+    def list_files(self) -> list[str]:
+        """Returns the names of the files in the root directory of the virtual drive."""
+        with self._open() as image:
+            return [entry.name for entry in image.list_dir() if not entry.is_dir]
+
+    def get_file(self, virtual_path: PathLike, local_path: PathLike):
+        """Gets a file from the virtual drive.
 
-        self.get_file(virtual_path, local_path)
+        Args:
+            virtual_path (PathLike): The path to the file on the virtual drive
+            local_path (PathLike): The path to save the file to
+
+        Raises:
+            (RuntimeError): Failed to get the filepath
+        """
+        self.get_file_contents(virtual_path, local_path)
 
-        with open(local_path, "rb") as f:
-            return f.read()
+    def get_file_contents(self, virtual_path: PathLike, local_path: PathLike = None) -> bytes:
+        """Gets a contents from a file from the virtual drive. Optionally save the file too.
+
+        Args:
+            virtual_path (PathLike): The path to the file on the virtual drive
+            local_path (PathLike): The path to save the file to
+
+        Raises:
+            (RuntimeError): Failed to get the filepath
+        """
+        try:
+            with self._open() as image:
+                data = image.read_file(str(virtual_path))
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to get {virtual_path} from drive.")
+            logger.error(e)
+            raise RuntimeError(e)
+
+        if local_path is not None:
+            Path(local_path).write_bytes(data)
+        return data
+
+    def get_files(self, virtual_paths: list[PathLike] | str, local_dir: PathLike = None) -> dict[str, bytes]:
+        """Gets the contents of many files from the virtual drive, opening the image only once.
+
+        Args:
+            virtual_paths (list[PathLike] | str): The paths of the files on the virtual drive, or a glob pattern
+                (e.g. `*_JUNIT_RESULT.XML`) matched case insensitively against the files in the root directory
+            local_dir (PathLike): A directory to save the files to
+
+        Returns:
+            (dict[str, bytes]): The contents of each file, keyed by the requested path or, for a pattern, by the
+                name of the matched file. Files that do not exist on the drive are omitted.
+        """
+        contents = {}
+        with self._open() as image:
+            if isinstance(virtual_paths, str):
+                virtual_paths = [e.name for e in image.list_dir() if not e.is_dir and _matches(e.name, virtual_paths)]
+            for virtual_path in virtual_paths:
+                try:
+                    contents[str(virtual_path)] = image.read_file(str(virtual_path))
+                except (OSError, ValueError):
+                    continue
+
+        _save_files(contents, local_dir)
+        return contents
+
+    def _open(self) -> FatImage:
+        try:
+            return FatImage(self.drive_path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to open {self.drive_path}.")
+            logger.error(e)
+            raise RuntimeError(e)
+
+
+class DirectoryVirtualDrive(VirtualDrive):
+    """A virtual drive backed by a host directory that QEMU exposes to the guest as a FAT disk (`fat:rw:<dir>`).
+
+    Every operation is a plain file operation on the directory, no image is created, formatted or parsed.
+
+    QEMU writes the changes made by the guest back to the directory while it runs, so the directory must not be
+    modified on the host until QEMU exits. Files written by the guest, such as test results, are then read directly
+    from the directory. FAT names are case insensitive, so files are looked up case insensitively.
+
+    Attributes:
+        hardlink (bool): Add files as hardlinks when a reflink is not possible, instead of copying them. QEMU
+            commits guest writes to an existing file in place, so a guest that modifies an added file also modifies
+            the linked build output.
+    """
+
+    def __init__(self, path: PathLike, hardlink: bool = False):
+        super().__init__(path)
+        self.hardlink = hardlink
+
+    def exists(self) -> bool:
+        """Returns if the Virtual drive exists at `drive_path`."""
+        return self.drive_path.is_dir()
+
+    def capacity(self) -> int | None:
+        """QEMU sizes the disk from the contents of the directory."""
+        return None
+
+    def make_drive(self, size: int = 60):
+        """Creates the directory backing the virtual drive. QEMU sizes the disk, so `size` is not used.
+
+        Raises:
+            (RuntimeError): The drive could not be created
+        """
+        try:
+            self.drive_path.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            logger.error("Drive could not be created.")
+            logger.error(e)
+            raise RuntimeError(e)
+
+    def delete(self):
+        """Deletes the virtual drive."""
+        shutil.rmtree(self.drive_path, ignore_errors=True)
+        self.manifest_path.unlink(missing_ok=True)
+
+    def add_file(self, filepath: PathLike):
+        """Adds a file to the virtual drive as a reflink or, if that is not possible, a hardlink or a copy.
+
+        Raises:
+            (RuntimeError): Failed to insert the file
+        """
+        filepath = Path(filepath)
+        try:
+            # Replace rather than overwrite an existing entry, it may be a hardlink to a file from an earlier build
+            existing = self._find(filepath.name)
+            if existing is not None:
+                existing.unlink()
+
+            dst = self.drive_path / filepath.name
+            if reflink(filepath, dst):
+                return
+            if self.hardlink:
+                try:
+                    os.link(filepath, dst)
+                    return
+                except OSError:
+                    # e.g. the build output and the drive are on different file systems
+                    pass
+            shutil.copyfile(filepath, dst)
+        except OSError as e:
+            logger.error(f"Failed to insert {filepath} into drive.")
+            logger.error(e)
+            raise RuntimeError(e)
+
+    def delete_file(self, virtual_path: PathLike):
+        """Deletes a file from the virtual drive.
+
+        Raises:
+            (RuntimeError): Failed to delete the file
+        """
+        try:
+            self._get(virtual_path).unlink()
+        except OSError as e:
+            logger.error(f"Failed to delete {virtual_path} from drive.")
+            logger.error(e)
+            raise RuntimeError(e)
+
+    def list_files(self) -> list[str]:
+        """Returns the names of the files in the root directory of the virtual drive.
+
+        Raises:
+            (RuntimeError): Failed to list the drive
+        """
+        try:
+            return [entry.name for entry in os.scandir(self.drive_path) if entry.is_file()]
+        except OSError as e:
+            logger.error("Failed to list the files on the drive.")
+            logger.error(e)
+            raise RuntimeError(e)
+
+    def get_file(self, virtual_path: PathLike, local_path: PathLike):
+        """Gets a file from the virtual drive.
+
+        The file is copied rather than linked, as QEMU rewrites files on the drive in place on the next run.
+
+        Args:
+            virtual_path (PathLike): The path to the file on the virtual drive
+            local_path (PathLike): The path to save the file to
+
+        Raises:
+            (RuntimeError): Failed to get the filepath
+        """
+        try:
+            clone_file(self._get(virtual_path), local_path)
+        except OSError as e:
+            logger.error(f"Failed to get {virtual_path} from drive.")
+            logger.error(e)
+            raise RuntimeError(e)
+
+    def get_file_contents(self, virtual_path: PathLike, local_path: PathLike = None) -> bytes:
+        """Gets a contents from a file from the virtual drive. Optionally save the file too.
+
+        Args:
+            virtual_path (PathLike): The path to the file on the virtual drive
+            local_path (PathLike): The path to save the file to
+
+        Raises:
+            (RuntimeError): Failed to get the filepath
+        """
+        try:
+            data = self._get(virtual_path).read_bytes()
+        except OSError as e:
+            logger.error(f"Failed to get {virtual_path} from drive.")
+            logger.error(e)
+            raise RuntimeError(e)
+
+        if local_path is not None:
+            Path(local_path).write_bytes(data)
+        return data
+
+    def get_files(self, virtual_paths: list[PathLike] | str, local_dir: PathLike = None) -> dict[str, bytes]:
+        """Gets the contents of many files from the virtual drive.
+
+        Args:
+            virtual_paths (list[PathLike] | str): The paths of the files on the virtual drive, or a glob pattern
+                (e.g. `*_JUNIT_RESULT.XML`) matched case insensitively against the files in the root directory
+            local_dir (PathLike): A directory to save the files to
+
+        Returns:
+            (dict[str, bytes]): The contents of each file, keyed by the requested path or, for a pattern, by the
+                name of the matched file. Files that do not exist on the drive are omitted.
+        """
+        if isinstance(virtual_paths, str):
+            virtual_paths = [name for name in self.list_files() if _matches(name, virtual_paths)]
+
+        contents = {}
+        for virtual_path in virtual_paths:
+            # Missing files are expected (e.g. a test that produced no result)
+            path = self._find(virtual_path)
+            if path is not None:
+                contents[str(virtual_path)] = path.read_bytes()
+
+        _save_files(contents, local_dir)
+        return contents
+
+    def _get(self, virtual_path: PathLike) -> Path:
+        """Returns the host path of a file on the drive.
+
+        Raises:
+            (FileNotFoundError): The file does not exist
+        """
+        path = self._find(virtual_path)
+        if path is None:
+            raise FileNotFoundError(f"{virtual_path} does not exist on the drive.")
+        return path
+
+    def _find(self, virtual_path: PathLike) -> Path | None:
+        """Returns the host path of a file on the drive, matching each path component case insensitively."""
+        path = self.drive_path
+        for part in Path(str(virtual_path).replace("\\", "/")).parts:
+            if (path / part).exists():
+                path = path / part
+                continue
+            try:
+                path = next(entry for entry in path.iterdir() if entry.name.upper() == part.upper())
+            except (OSError, StopIteration):
+                return None
+        return path if path.is_file() else None
 
 
 class VirtualDriveManager(IUefiHelperPlugin):
     def RegisterHelpers(self, obj):
         fp = str(Path(__file__).absolute())
         obj.Register("get_virtual_drive", VirtualDriveManager.get_virtual_drive, fp)
+        obj.Register("required_drive_size", VirtualDriveManager.required_drive_size, fp)
+        obj.Register("sync_files", VirtualDriveManager.sync_files, fp)
         obj.Register("add_tests", VirtualDriveManager.add_tests, fp)
+        obj.Register("collect_results", VirtualDriveManager.collect_results, fp)
+        obj.Register("log_results", VirtualDriveManager.log_results, fp)
+        obj.Register("write_results", VirtualDriveManager.write_results, fp)
         obj.Register("report_results", VirtualDriveManager.report_results, fp)
         obj.Register("generate_paging_audit", VirtualDriveManager.generate_paging_audit, fp)
+        obj.Register("record_test_durations", VirtualDriveManager.record_test_durations, fp)
+        obj.Register("run_test_shards", VirtualDriveManager.run_test_shards, fp)
         return 0
 
     @staticmethod
-    def get_virtual_drive(path: PathLike):
-        if os.name == 'nt':
-            return WindowsVirtualDrive(path)
-        return LinuxVirtualDrive(path)
+    def get_virtual_drive(path: PathLike, backend: str = None, hardlink: bool = False):
+        """Returns a virtual drive object for the drive at `path`.
+
+        Args:
+            path (PathLike): The path to the virtual drive
+            backend (str): The implementation used to manage the drive. `fat` manages a raw FAT32 image in-process
+                without any external tools. `dir` uses `path` as a directory that QEMU exposes as a FAT disk.
+                `mtools` (the default on Linux) and `vhd` (the default on Windows) use host tools. Empty or None
+                selects the default for the host.
+            hardlink (bool): Let the `dir` backend add files as hardlinks to the originals when a reflink is not
+                possible. Writes the firmware makes to those files then modify the originals.
+
+        !!! note
+            Wiping the returned drive clones a cached, pre-formatted blank drive from `VirtualDriveTemplates` next
+            to `path` instead of formatting a new one.
+        """
+        backend = (backend or "").lower()
+        if not backend:
+            backend = "vhd" if os.name == 'nt' else "mtools"
+
+        if backend == "fat":
+            drive = FatVirtualDrive(path)
+        elif backend == "vhd":
+            drive = WindowsVirtualDrive(path)
+        elif backend == "mtools":
+            drive = LinuxVirtualDrive(path)
+        elif backend == "dir":
+            drive = DirectoryVirtualDrive(path, hardlink)
+        else:
+            raise ValueError(f"Unknown virtual drive backend: {backend}")
+
+        # Blank drive templates are cached next to the drive, in the build output directory
+        drive.template_dir = drive.drive_path.parent / "VirtualDriveTemplates"
+        return drive
+
+    @staticmethod
+    def required_drive_size(file_list: list[PathLike]) -> int:
+        """Returns the virtual drive size, in MB, needed to hold `file_list`.
+
+        Every file is rounded up to a whole cluster, 25% is added for file system overhead and growth, and a fixed
+        headroom is added for the files written by the tests themselves.
+        """
+        total = 0
+        for file in file_list:
+            size = Path(file).stat().st_size
+            total += -(-size // AUTO_SIZE_CLUSTER_SIZE) * AUTO_SIZE_CLUSTER_SIZE
+        return max(AUTO_SIZE_MIN_MB, -(-total * 5 // (4 * MB)) + AUTO_SIZE_HEADROOM_MB)
+
+    @staticmethod
+    def sync_files(drive: VirtualDrive, file_list: list[PathLike]) -> dict[Path, bool]:
+        """Makes the files on the virtual drive match `file_list`, only writing files that are new or changed.
+
+        A manifest of the synchronized files (name, size, modification time and SHA-256 of the contents) is kept
+        next to the drive. A file is written when it is not in the manifest, its contents changed, or it is
+        missing from the drive. Files recorded in the manifest that are no longer in `file_list` are deleted from
+        the drive. Files placed on the drive by other means, such as test results, are left untouched.
+
+        Args:
+            drive (VirtualDrive): The virtual drive to synchronize
+            file_list (list[PathLike]): The files that should be on the drive
+
+        Returns:
+            (dict[Path, bool]): Whether or not each file is on the drive and up to date
+        """
+        manifest = {}
+        drive_id = drive.drive_path.stat().st_ino if drive.drive_path.is_file() else None
+        if drive.exists() and drive.manifest_path.exists():
+            try:
+                data = json.loads(drive.manifest_path.read_text())
+                # A drive recreated without going through `delete` no longer has the recorded files
+                if data.get("drive_id") == drive_id:
+                    manifest = data.get("files", {})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable virtual drive manifest {drive.manifest_path}. {e}")
+
+        on_drive = None
+        if manifest:
+            try:
+                on_drive = {name.upper() for name in drive.list_files()}
+            except NotImplementedError:
+                pass
+
+        status = {}
+        files = {}
+        changed = []
+        for file in map(Path, file_list):
+            stat = file.stat()
+            record = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            previous = manifest.get(file.name)
+            present = on_drive is None or file.name.upper() in on_drive
+
+            if previous and previous["size"] == record["size"] and previous["mtime_ns"] == record["mtime_ns"]:
+                record["sha256"] = previous["sha256"]
+            else:
+                record["sha256"] = hash_file(file)
+
+            files[file.name] = record
+            if previous and previous["sha256"] == record["sha256"] and present:
+                status[file] = True
+            else:
+                changed.append(file)
+
+        for name in manifest.keys() - files.keys():
+            try:
+                drive.delete_file(name)
+            except NotImplementedError:
+                logger.warning(f"{name} is no longer requested but cannot be deleted from this virtual drive.")
+            except RuntimeError:
+                logger.warning(f"Failed to delete {name} from the virtual drive.")
+
+        if changed:
+            status.update(drive.add_files(changed))
+        logger.info(f"Virtual drive sync: {len(changed)} file(s) written, {len(file_list) - len(changed)} unchanged.")
+
+        for file, inserted in status.items():
+            if not inserted:
+                files.pop(file.name, None)
+
+        drive.manifest_path.write_text(json.dumps({"drive_id": drive_id, "files": files}, indent=2))
+        return status
 
     @staticmethod
-    def add_tests(drive: VirtualDrive, test_list: list[str], auto_run = True, auto_shutdown = True, paging_audit = False):
+    def add_tests(drive: VirtualDrive, test_list: list[str], auto_run = True, auto_shutdown = True, paging_audit = False, sync = False):
         """Adds tests to the virtual drive and optionally adds them to the startup script.
 
         !!! note
@@ -417,12 +1163,24 @@ class VirtualDriveManager(IUefiHelperPlugin):
 
             3. We finally rename the current test results to _JUNIT_RESULT.XML to reset test progress and also allow
                for test results to be read after Qemu has shut down.
+
+            4. Each test is bracketed by START / END markers, each followed by the output of the shell `time`
+               command, appended to <TestName>_TIMING.TXT. The file is only reset when a test starts without a
+               _Cache.dat file, so a test that reboots and resumes keeps its first START stamp. Like the results,
+               the file is renamed to _TIMING_RESULT.TXT once all tests have finished.
         Args:
             drive (VirtualDrive): The virtual drive to add the tests to.
             auto_run (Boolean): Whether or not to run tests automatically.
             auto_shutdown (Boolean): Whether or not to shutdown after tests have completed.
+            sync (Boolean): Whether to use `sync_files` to only write tests that changed since the last run.
+
+        Returns:
+            (dict[Path, bool]): Whether or not each test was inserted into the drive
         """
-        drive.add_files(test_list)
+        if sync:
+            status = VirtualDriveManager.sync_files(drive, test_list)
+        else:
+            status = drive.add_files(test_list)
         tests = []
 
         if auto_run:
@@ -438,14 +1196,27 @@ class VirtualDriveManager(IUefiHelperPlugin):
             tests.append("#    of the test (important for tests that require restarts)")
             tests.append("# 3. We finally rename the current test results to _JUNIT_RESULT.XML to reset test progress and also allow")
             tests.append("#    for test results to be read after Qemu has shut down.")
+            tests.append("# 4. Each test is bracketed by timestamps in <TestName>_TIMING.TXT. The file is only reset when a test")
+            tests.append("#    starts without a _Cache.dat, so a test that reboots and resumes keeps its first timestamp.")
             for test in test_list:
+                timing_file = f"{test.stem}{TIMING_FILE_SUFFIX}"
                 tests.append(f"if not exist {test.stem}_JUNIT.XML then")
+                tests.append(f"    if not exist {test.stem}_Cache.dat then")
+                tests.append(f"        if exist {timing_file} then")
+                tests.append(f"            rm {timing_file}")
+                tests.append("        endif")
+                tests.append("    endif")
+                tests.append(f"    echo {TIMING_START} >>a {timing_file}")
+                tests.append(f"    time >>a {timing_file}")
                 tests.append(f"    {test.name}")
+                tests.append(f"    echo {TIMING_END} >>a {timing_file}")
+                tests.append(f"    time >>a {timing_file}")
                 tests.append("endif")
 
             # Tests have finished, no more restarts
             # Remove any old test results and reset test status
             tests.append("rm *_JUNIT_RESULT.XML")
+            tests.append(f"rm *{TIMING_RESULT_FILE_SUFFIX}")
             tests.append("rm *_Cache.dat")
 
             # Rename test results to what we expect
@@ -453,48 +1224,190 @@ class VirtualDriveManager(IUefiHelperPlugin):
                 tests.append(f"if exist {test.stem}_JUNIT.XML then")
                 tests.append(f"    mv {test.stem}_JUNIT.XML {test.stem}_JUNIT_RESULT.XML")
                 tests.append("endif")
+                tests.append(f"if exist {test.stem}{TIMING_FILE_SUFFIX} then")
+                tests.append(f"    mv {test.stem}{TIMING_FILE_SUFFIX} {test.stem}{TIMING_RESULT_FILE_SUFFIX}")
+                tests.append("endif")
 
             if paging_audit:
-                tests.append("DxePagingAuditTestApp.efi -d")
+                tests.append(f"{PAGING_AUDIT_APP} -d")
 
         drive.add_startup_script(tests, auto_shutdown = auto_shutdown)
+        return status
 
     @staticmethod
-    def report_results(drive: VirtualDrive, test_list: list[str], result_output_dir: Path) -> list[(str, str)]:
-        """Prints test results to the terminal and returns the number of failed tests."""
+    def collect_results(drive: VirtualDrive, test_list: list[PathLike], result_output_dir: Path) -> list[TestResult]:
+        """Extracts and parses the JUnit results of each test.
+
+        Args:
+            drive (VirtualDrive): The virtual drive the tests ran from
+            test_list (list[PathLike]): The test applications
+            result_output_dir (Path): The directory to save the result files to
+
+        Returns:
+            (list[TestResult]): The results of each test, in the order of `test_list`
+        """
         result_output_dir.mkdir(exist_ok=True)
 
+        # Extract all result and timing files in one operation
+        result_files = {Path(test).name: Path(test).stem + "_JUNIT_RESULT.XML" for test in test_list}
+        timing_files = {Path(test).name: Path(test).stem + TIMING_RESULT_FILE_SUFFIX for test in test_list}
+        contents = drive.get_files(list(result_files.values()) + list(timing_files.values()), result_output_dir)
+
+        results = []
+        for test, result_file in result_files.items():
+            result = TestResult(test)
+            timing = contents.get(timing_files[test])
+            if timing is not None:
+                result.elapsed = _parse_timing(timing)
+            data = contents.get(result_file)
+            if data is None:
+                result.error = "produced no result file"
+            else:
+                try:
+                    result.suites = parse_junit(data)
+                except Exception as ex:
+                    result.error = f"result file could not be read. {ex}"
+            results.append(result)
+        return results
+
+    @staticmethod
+    def log_results(results: list[TestResult]) -> int:
+        """Logs a summary table per test suite and the duration of each test, and returns the number of failed tests."""
         failure_count = 0
-        for test in test_list:
-            result_file = test.stem + "_JUNIT_RESULT.XML"
-            local_file_path = result_output_dir / result_file
-            try:
-                data = drive.get_file_contents(result_file, local_file_path)
-            except:
-                logging.error(f"unit test ({test}) produced no result file.")
-                failure_count += 1
-                continue
+        for result in results:
+            if result.error:
+                logging.error(f"unit test ({result.test}) {result.error}")
+            for suite in result.suites:
+                level = logging.ERROR if suite.failures else logging.INFO
+                logging.log(level, format_suite(suite))
+            failure_count += result.failures
+
+        if any(result.elapsed is not None or result.duration is not None for result in results):
+            logging.info("Test durations:\n" + format_durations(results))
+        return failure_count
+
+    @staticmethod
+    def write_results(results: list[TestResult], result_output_dir: Path, exempt_tests: list[str] = []):
+        """Writes the results of all tests as a single JUnit XML file and a JSON summary.
+
+        Args:
+            results (list[TestResult]): The results of each test
+            result_output_dir (Path): The directory to write `UnitTestResults.xml` and `UnitTestResults.json` to
+            exempt_tests (list[str]): The file names of the tests whose failures are exempt
+        """
+        exempt = set(exempt_tests)
+        write_junit(results, Path(result_output_dir) / RESULTS_JUNIT_FILE, exempt)
+        write_summary(results, Path(result_output_dir) / RESULTS_SUMMARY_FILE, exempt)
+        logging.info(f"Combined test results written to {Path(result_output_dir) / RESULTS_JUNIT_FILE}")
+
+    @staticmethod
+    def report_results(drive: VirtualDrive, test_list: list[str], result_output_dir: Path, exempt_tests: list[str] = []) -> int:
+        """Prints test results to the terminal, writes the combined results and returns the number of failed tests.
+
+        Failures of `exempt_tests` are printed but not counted.
+        """
+        results = VirtualDriveManager.collect_results(drive, test_list, result_output_dir)
+        VirtualDriveManager.write_results(results, result_output_dir, exempt_tests)
+        exempt = set(exempt_tests)
+        VirtualDriveManager.log_results([result for result in results if result.test in exempt])
+        return VirtualDriveManager.log_results([result for result in results if result.test not in exempt])
+
+    @staticmethod
+    def record_test_durations(results: list[TestResult], result_output_dir: Path):
+        """Records the duration of each test so later runs can balance tests across shards."""
+        save_durations(Path(result_output_dir) / TEST_DURATIONS_FILE, results)
 
+    @staticmethod
+    def run_test_shards(env, qemu_run, test_list: list[PathLike], shard_count: int, var_store: PathLike,
+                        drive_size: int = 60, auto_shutdown: bool = True, paging_audit: bool = False) -> list[TestShard]:
+        """Runs the tests split across concurrent QEMU instances.
+
+        Tests are balanced across the shards using the durations recorded by `record_test_durations`. Each shard gets
+        its own virtual drive, copy of the variable store and TPM state directory in
+        `BUILD_OUTPUT_BASE/TestShards/Shard<N>`, where the QEMU console output is written to `Console.log`. The
+        shards run with a copy of `env` that points QEMU at these files and offsets any debug ports by the shard
+        index. `TEST_SHARD_TIMEOUT` replaces `QEMU_TIMEOUT` for each shard, either in seconds or `AUTO` to scale
+        with the expected duration of the shard.
+
+        Args:
+            env (VarDict): The build environment
+            qemu_run (Callable): Runs QEMU with the given environment and returns its exit code
+            test_list (list[PathLike]): The test applications
+            shard_count (int): The maximum number of QEMU instances to run
+            var_store (PathLike): The variable store that is copied for each shard
+            drive_size (int): The size of each virtual drive in MB
+            auto_shutdown (Boolean): Whether or not to shutdown after tests have completed
+            paging_audit (Boolean): Whether or not to dump the page tables after the tests in the shard that has
+                the paging audit app
+
+        Returns:
+            (list[TestShard]): The shards, each with its tests, drive and QEMU exit code
+        """
+        output_base = Path(env.GetValue("BUILD_OUTPUT_BASE"))
+        drive_path = Path(env.GetValue("VIRTUAL_DRIVE_PATH"))
+        tpm_state_dir = Path(env.GetValue("SWTPM_STATE_DIR")) if env.GetValue("SWTPM_STATE_DIR") else None
+        durations = load_durations(drive_path.parent / "unit_test_results" / TEST_DURATIONS_FILE)
+        shards = partition(test_list, shard_count, durations)
+        if not shards:
+            return shards
+        logging.info(f"Running {len(test_list)} test(s) on {len(shards)} QEMU instance(s).")
+
+        for shard in shards:
+            shard_dir = output_base / "TestShards" / f"Shard{shard.index}"
+            shard_dir.mkdir(parents=True, exist_ok=True)
+
+            shard.drive = VirtualDriveManager.get_virtual_drive(
+                shard_dir / drive_path.name, env.GetValue("VIRTUAL_DRIVE_BACKEND"),
+                env.GetValue("VIRTUAL_DRIVE_HARDLINK", "FALSE").upper() == "TRUE")
+            shard.drive.template_dir = drive_path.parent / "VirtualDriveTemplates"
+            shard.drive.wipe(drive_size)
+            shard_audit = paging_audit and any(test.name == PAGING_AUDIT_APP for test in shard.tests)
+            VirtualDriveManager.add_tests(shard.drive, shard.tests, auto_shutdown=auto_shutdown,
+                                          paging_audit=shard_audit)
+
+            # Every shard starts from the same variable store and TPM state, the TPM state of SWTPM_STATE_DIR if set,
+            # otherwise the golden TPM state with SWTPM_GOLDEN_STATE or a blank TPM
+            shard_var_store = shard_dir / Path(var_store).name
+            shard_var_store.unlink(missing_ok=True)
+            clone_file(var_store, shard_var_store)
+            for tpm_state in shard_dir.glob("tpm2-*"):
+                tpm_state.unlink()
+            if tpm_state_dir is not None:
+                for tpm_state in tpm_state_dir.glob("tpm2-*"):
+                    clone_file(tpm_state, shard_dir / tpm_state.name)
+
+            overrides = {
+                "VIRTUAL_DRIVE_PATH": str(shard.drive.drive_path),
+                "VAR_STORE_PATH": str(shard_var_store),
+                "SWTPM_STATE_DIR": str(shard_dir),
+                "QEMU_CONSOLE_LOG": str(shard_dir / "Console.log"),
+            }
+            for name in SHARD_PORT_VALUES:
+                port = env.GetValue(name)
+                if port is not None:
+                    overrides[name] = str(int(port) + shard.index)
+            timeout = shard_timeout(env.GetValue("TEST_SHARD_TIMEOUT"), shard.estimate)
+            if timeout is not None:
+                overrides["QEMU_TIMEOUT"] = str(timeout)
+            shard.env = ShardEnvironment(env, overrides)
+
+            logging.info(f"Shard {shard.index}: {len(shard.tests)} test(s), expected to take {shard.estimate:.0f}s. "
+                         f"Console output: {overrides['QEMU_CONSOLE_LOG']}")
+
+        def run(shard: TestShard):
+            start = time.monotonic()
             try:
-                # Parse the xml data to gather all results
-                root = xml.etree.ElementTree.fromstring(data)
-                for suite in root:
-                    logging.info(" ")
-                    for case in suite:
-                        logging.info('\t\t' + case.attrib['classname'] + " - ")
-                        caseresult = "\t\t\tPASS"
-                        level = logging.INFO
-                        for result in case:
-                            if result.tag == 'failure':
-                                level = logging.ERROR
-                                caseresult = "\t\tFAIL" + " - " + unescape(result.attrib['message'])
-                                failure_count += 1
-                        logging.log( level, caseresult)
-
-            except Exception as ex:
-                logging.error("Exception trying to read xml." + str(ex))
-                failure_count += 1
-        return failure_count
+                shard.returncode = qemu_run(shard.env)
+            except Exception as e:
+                logging.error(f"Shard {shard.index} failed to run. {e}")
+                shard.returncode = -1
+            logging.info(f"Shard {shard.index} finished in {time.monotonic() - start:.0f}s. "
+                         f"Result: {shard.returncode}")
+
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            list(executor.map(run, shards))
+
+        return shards
 
     @staticmethod
     def generate_paging_audit(drive: VirtualDrive, report_output_dir: Path, version: str, platform: str):
@@ -503,8 +1416,12 @@ class VirtualDriveManager(IUefiHelperPlugin):
         paging_audit_generator_path = os.path.join("Common", "MU", "UefiTestingPkg", "AuditTests",
                                                    "PagingAudit", "Windows", "PagingReportGenerator.py")
         report_output_dir.mkdir(exist_ok=True)
-        for file in paging_audit_data_files:
-            drive.get_file(file, os.path.join(report_output_dir, file))
+        extracted = drive.get_files(paging_audit_data_files, report_output_dir)
+        missing = [file for file in paging_audit_data_files if file not in extracted]
+        if missing:
+            e = f"Paging audit data missing from the drive: {', '.join(missing)}"
+            logger.error(e)
+            raise RuntimeError(e)
         output_audit = os.path.join(report_output_dir, "pagingaudit.html")
         output_debug = os.path.join(report_output_dir, "pagingauditdebug.txt")
         cmd = "python"
@@ -0,0 +1,181 @@
+##
+# Tests how files are placed on and synchronized to the virtual drives.
+#
+# Copyright (c) Microsoft Corporation
+# SPDX-License-Identifier: BSD-2-Clause-Patent
+##
+
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# Put on the python path by FileUtils_path_env.yaml during a build
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "FileUtils"))
+
+import VirtualDriveManager as VirtualDriveManagerModule  # noqa: E402
+
+from VirtualDriveManager import VirtualDriveManager  # noqa: E402
+
+
+class DirectoryVirtualDriveTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.build_output = Path(temp_dir.name, "Test.efi")
+        self.build_output.write_bytes(b"build output")
+        self.drive_path = Path(temp_dir.name, "VirtualDrive")
+
+    def add_and_modify(self, **kwargs) -> Path:
+        drive = VirtualDriveManager.get_virtual_drive(self.drive_path, "dir", **kwargs)
+        drive.make_drive()
+        drive.add_file(self.build_output)
+        # QEMU writes guest changes to a file on the drive in place
+        on_drive = self.drive_path / self.build_output.name
+        with open(on_drive, "r+b") as f:
+            f.write(b"guest")
+        return on_drive
+
+    def test_guest_writes_keep_build_output(self):
+        self.add_and_modify()
+        self.assertEqual(self.build_output.read_bytes(), b"build output")
+
+    def test_hardlink_opt_in(self):
+        on_drive = self.add_and_modify(hardlink=True)
+        if self.build_output.stat().st_ino != on_drive.stat().st_ino:
+            self.skipTest("The file was reflinked")
+        self.assertEqual(self.build_output.read_bytes(), b"guest output")
+
+
+class SyncFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp = Path(temp_dir.name)
+        self.files = []
+        for name in ("A.efi", "B.efi"):
+            path = self.temp / name
+            path.write_bytes(name.encode())
+            self.files.append(path)
+        self.drive = VirtualDriveManager.get_virtual_drive(self.temp / "VirtualDrive.img", "fat")
+        self.drive.make_drive(40)
+
+    def sync(self, file_list: list[Path]) -> list[Path]:
+        """Synchronizes the drive and returns the files that were written."""
+        with mock.patch.object(self.drive, "add_files", wraps=self.drive.add_files) as add_files:
+            status = VirtualDriveManager.sync_files(self.drive, file_list)
+        self.assertTrue(all(status.values()))
+        return [file for call in add_files.call_args_list for file in call.args[0]]
+
+    def test_unchanged_files_are_skipped(self):
+        self.assertEqual(self.sync(self.files), self.files)
+        self.assertEqual(self.sync(self.files), [])
+
+    def test_unchanged_files_are_skipped_without_listing(self):
+        self.sync(self.files)
+        with mock.patch.object(self.drive, "list_files", side_effect=NotImplementedError):
+            self.assertEqual(self.sync(self.files), [])
+
+    def test_changed_file_is_rewritten(self):
+        self.sync(self.files)
+        self.files[0].write_bytes(b"rebuilt")
+        os.utime(self.files[0], ns=(0, self.files[0].stat().st_mtime_ns + 1))
+
+        self.assertEqual(self.sync(self.files), [self.files[0]])
+        self.assertEqual(self.drive.get_file_contents("A.efi"), b"rebuilt")
+
+    def test_touched_file_with_same_contents_is_skipped(self):
+        self.sync(self.files)
+        os.utime(self.files[0], ns=(0, self.files[0].stat().st_mtime_ns + 1))
+
+        self.assertEqual(self.sync(self.files), [])
+
+    def test_file_missing_from_drive_is_rewritten(self):
+        self.sync(self.files)
+        self.drive.delete_file("B.efi")
+
+        self.assertEqual(self.sync(self.files), [self.files[1]])
+        self.assertIn("B.EFI", [name.upper() for name in self.drive.list_files()])
+
+    def test_unmatched_file_is_deleted(self):
+        self.sync(self.files)
+        (self.temp / "RESULT.XML").write_bytes(b"result")
+        self.drive.add_file(self.temp / "RESULT.XML")
+
+        self.sync(self.files[:1])
+        names = [name.upper() for name in self.drive.list_files()]
+        self.assertNotIn("B.EFI", names)
+        # Files that were not synchronized, such as test results, are left alone
+        self.assertIn("RESULT.XML", names)
+
+    def test_recreated_drive_invalidates_manifest(self):
+        self.sync(self.files)
+        # Replace the image without `delete`, which would remove the manifest
+        new_drive = VirtualDriveManager.get_virtual_drive(self.temp / "New.img", "fat")
+        new_drive.make_drive(40)
+        os.replace(new_drive.drive_path, self.drive.drive_path)
+
+        self.assertEqual(self.sync(self.files), self.files)
+        self.assertEqual(len(self.drive.list_files()), 2)
+
+
+class LinuxVirtualDriveTest(unittest.TestCase):
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp = Path(temp_dir.name, "Build Output")
+        self.drive = VirtualDriveManager.get_virtual_drive(self.temp / "VirtualDrive.img", "mtools")
+        self.calls = []
+        patcher = mock.patch.object(VirtualDriveManagerModule, "RunCmd", side_effect=self.run_cmd)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_cmd(self, cmd, args, **kwargs):
+        self.calls.append([cmd] + shlex.split(args))
+        return self.result
+
+    def test_paths_with_spaces(self):
+        self.result = 0
+        self.drive.add_file(self.temp / "My Test.efi")
+        self.drive.delete_file("My Test.efi")
+        self.drive.get_file("My Test.efi", self.temp / "My Test.efi")
+
+        drive = str(self.drive.drive_path)
+        self.assertEqual(self.calls, [
+            ["mcopy", "-D", "overwrite", "-i", drive, str(self.temp / "My Test.efi"), "::"],
+            ["mdel", "-i", drive, "::/My Test.efi"],
+            ["mcopy", "-n", "-i", drive, "::/My Test.efi", str(self.temp / "My Test.efi")],
+        ])
+
+    def test_failed_batch_retries_paths_with_spaces(self):
+        self.result = 1
+        files = [self.temp / "A Test.efi", self.temp / "B Test.efi"]
+        status = self.drive.add_files(files)
+
+        self.assertEqual(status, dict.fromkeys(files, False))
+        self.assertEqual([call[5:-1] for call in self.calls],
+                         [[str(files[0]), str(files[1])], [str(files[0])], [str(files[1])]])
+
+    def test_get_file_contents(self):
+        data = bytes(range(256))
+        completed = subprocess.CompletedProcess([], 0, stdout=data, stderr=b"")
+        with mock.patch.object(VirtualDriveManagerModule.subprocess, "run", return_value=completed) as run, \
+                self.assertLogs(level="DEBUG") as logs:
+            self.assertEqual(self.drive.get_file_contents("Test.bin"), data)
+
+        self.assertEqual(run.call_args.args[0], ["mtype", "-i", str(self.drive.drive_path), "::/Test.bin"])
+        self.assertEqual(run.call_args.kwargs["env"]["MTOOLS_SKIP_CHECK"], "1")
+        self.assertIn(f"Cmd to run is: mtype -i '{self.drive.drive_path}' ::/Test.bin", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()